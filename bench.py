@@ -1,20 +1,442 @@
-from time import time_ns
+"""
+Benchmarks for the hot paths of the firmware, run on the host simulator.
 
-spans = {}
+    python bench.py                         # run everything, write bench.json
+    python bench.py -k history              # only scenarios containing "history"
+    python bench.py --out new.json --compare old.json
 
+Every scenario reports p50/p95/p99/max wall time per iteration and the
+bytes allocated per iteration (peak traced by `tracemalloc`). Results are
+written as JSON so two commits can be diffed with `--compare`.
+"""
 
-def span_begin(name):
-    spans[name] = time_ns()
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter_ns
 
+import sim
 
-def span_end(name):
-    dt = time_ns() - spans[name]
-    print(dt / 10000)
+sim.install()
 
-def calculate_average(file_name):
-    with open(file_name, 'r') as file:
-        values = [float(line.strip()) for line in file.readlines()]
-    average = sum(values) / len(values)
-    print(f"Average: {average:.2f}")
+from sim.simulator import Simulator  # noqa: E402
+from sim.traces import SyntheticPpg  # noqa: E402
 
-calculate_average("bench.txt")
\ No newline at end of file
+scenarios = {}
+
+
+def scenario(name, iterations=200, warmup=10):
+    """
+    Register `setup` as a scenario. `setup` prepares the state and returns
+    the function that is timed once per iteration, plus an optional cleanup.
+    """
+
+    def register(setup):
+        scenarios[name] = (setup, iterations, warmup)
+        return setup
+
+    return register
+
+
+class Workdir:
+    """
+    Scratch working directory so history files never touch the repo.
+    """
+
+    def __enter__(self):
+        self.previous = os.getcwd()
+        self.path = tempfile.mkdtemp(prefix="cardiotron-bench-")
+        os.chdir(self.path)
+        return self.path
+
+    def __exit__(self, *_):
+        os.chdir(self.previous)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def measuring_simulator():
+    """
+    Simulator that has been measuring for a while so the windows are full.
+    """
+    simulator = Simulator(SyntheticPpg(seed=1))
+    simulator.enter("measure_heart_rate")
+    simulator.run_for(10_000)
+    return simulator
+
+
+@scenario("measure_heart_rate/frame", iterations=1000)
+def _():
+    simulator = measuring_simulator()
+    return simulator.step, simulator.close
+
+
+@scenario("graph/redraw_all", iterations=1000)
+def _():
+    simulator = measuring_simulator()
+    machine = simulator.machine
+    lows = machine.heart_rate_screen_lows
+    highs = machine.heart_rate_screen_highs
+    graph = machine.heart_rate_graph
+    return lambda: graph._redraw_all(lows, highs, lows.mean()), simulator.close
+
+
+@scenario("graph/plot_and_show_one_sample", iterations=1000)
+def _():
+    simulator = measuring_simulator()
+    machine = simulator.machine
+    lows = machine.heart_rate_screen_lows
+    highs = machine.heart_rate_screen_highs
+    graph = machine.heart_rate_graph
+    columns = list(zip(lows.data, highs.data))
+    index = [0]
+
+    def plot():
+        index[0] = (index[0] + 1) % len(columns)
+        low, high = columns[index[0]]
+        lows.append(low)
+        highs.append(high)
+        graph.plot(lows, highs, lows.mean())
+        machine.display.show()
+
+    return plot, simulator.close
+
+
+def running_stats_scenario(size):
+    @scenario(f"ringbuffer/running_stats/{size}", iterations=2000)
+    def _():
+        from ringbuffer import RunningStatsRingbuffer
+
+        window = RunningStatsRingbuffer(size, "f")
+        rng = random.Random(size)
+        values = [rng.uniform(20000, 40000) for _ in range(1024)]
+        index = [0]
+
+        def append():
+            index[0] = (index[0] + 1) & 1023
+            window.append(values[index[0]])
+            return window.mean(), window.min(), window.max()
+
+        return append, None
+
+
+running_stats_scenario(50)
+running_stats_scenario(500)
+
+
+@scenario("ringbuffer/spsc/put_and_drain", iterations=2000)
+def _():
+    from array import array
+    from ringbuffer import StampedSpscRingbuffer
+
+    samples = StampedSpscRingbuffer(200, "H")
+    block = memoryview(array("H", [0] * 25))
+    stamps = memoryview(array("L", [0] * 25))
+    tick = [0]
+
+    # One 100 ms frame at 250 Hz, the way `process_samples` sees it
+    def put_and_drain():
+        for _ in range(25):
+            tick[0] += 4
+            samples.put(tick[0] & 0xFFFF, tick[0])
+        return samples.drain_into(block, stamps)
+
+    return put_and_drain, None
+
+
+def detector_scenario(name, block=False):
+    @scenario(f"heart/detector/{name}{'/block' if block else ''}", iterations=200)
+    def _():
+        from array import array
+        from heart import BandPassPeakDetector, FixedPointPeakDetector, PeakDetector
+
+        detector = {
+            "float": PeakDetector,
+            "fixed": FixedPointPeakDetector,
+            "band-pass": BandPassPeakDetector,
+        }[name]()
+        source = SyntheticPpg(seed=1)
+        values = array(
+            "H",
+            [max(0, min(0xFFFF, int(source(t_ms)))) for t_ms in range(0, 60_000, 4)],
+        )
+        index = [0]
+
+        # One second of samples at 250 Hz
+        def add():
+            for _ in range(250):
+                i = index[0]
+                index[0] = (i + 1) % len(values)
+                detector.add(values[i], i * 4)
+
+        block_values = memoryview(values)
+        filtered = memoryview(array(detector.block_typecode, [0] * 25))
+
+        # The same second, in the 100 ms blocks `process_samples` drains
+        def add_blocks():
+            for _ in range(10):
+                start = index[0]
+                index[0] = (start + 25) % len(values)
+                detector.filter_block(block_values[start : start + 25], filtered)
+                for i in range(25):
+                    detector.pick(filtered[i], (start + i) * 4)
+
+        return (add_blocks if block else add), None
+
+
+detector_scenario("float")
+detector_scenario("fixed")
+detector_scenario("band-pass")
+detector_scenario("fixed", block=True)
+detector_scenario("band-pass", block=True)
+
+
+@scenario("heart_ui/draw_heart", iterations=500)
+def _():
+    from heart_ui import draw_heart
+    from machine import I2C
+    from ssd1306 import SSD1306_I2C
+
+    display = SSD1306_I2C(128, 64, I2C(1))
+    scales = [0.7 + 0.6 * i / 16 for i in range(16)]
+    index = [0]
+
+    def draw():
+        index[0] = (index[0] + 1) % len(scales)
+        draw_heart(display, scales[index[0]])
+
+    return draw, None
+
+
+@scenario("heart_ui/update_heart_animation", iterations=500)
+def _():
+    from display import PartialDisplay
+    from heart_ui import update_heart_animation
+    from machine import I2C
+    from ssd1306 import SSD1306_I2C
+
+    display = PartialDisplay(SSD1306_I2C(128, 64, I2C(1)))
+    last_update_time = [0]
+
+    def update():
+        last_update_time[0] = update_heart_animation(display, last_update_time[0])
+        display.show()
+
+    return update, None
+
+
+def make_entry(rng, i):
+    ppis = [rng.randint(600, 1000) for _ in range(40)]
+    return {
+        "KUBIOS STATUS": "WAITING",
+        "ID": i,
+        "TIMESTAMP": f"{rng.randint(1, 28)}/{rng.randint(1, 12)}/25 12:{i % 60}",
+        "MEAN HR": 72,
+        "MEAN PPI": sum(ppis) / len(ppis),
+        "RMSSD": 31.5,
+        "SDNN": 42.25,
+        "RAW PPIS": ppis,
+    }
+
+
+def populate_history(entries):
+    """
+    Write `entries` records straight into the history file, pushing them one
+    by one would be quadratic.
+    """
+    import history
+    from constants import HISTORY_DATA_FILENAME
+    from record import encode_entry
+
+    # The store remembers the log it last saw, this is a new one
+    history.store = history.HistoryStore()
+    history.init_history_file()
+    rng = random.Random(entries)
+    with open(HISTORY_DATA_FILENAME, "wb") as f:
+        for i in range(entries):
+            f.write(encode_entry(make_entry(rng, i)))
+
+
+def history_scenarios(entries, iterations):
+    @scenario(f"history/push_data/{entries}", iterations=iterations, warmup=1)
+    def _():
+        from history import push_data
+
+        workdir = Workdir()
+        workdir.__enter__()
+        populate_history(entries)
+        rng = random.Random(0)
+        next_id = [entries]
+
+        def push():
+            next_id[0] += 1
+            push_data(make_entry(rng, next_id[0]))
+
+        return push, lambda: workdir.__exit__()
+
+    @scenario(f"history/read_data/{entries}", iterations=iterations, warmup=1)
+    def _():
+        from history import read_data
+
+        workdir = Workdir()
+        workdir.__enter__()
+        populate_history(entries)
+        return read_data, lambda: workdir.__exit__()
+
+    @scenario(f"history/visible_rows/{entries}", iterations=iterations * 10)
+    def _():
+        workdir = Workdir()
+        workdir.__enter__()
+        populate_history(entries)
+        from history import store
+
+        middle = entries // 2
+        return lambda: store.entries(middle, middle + 4), lambda: workdir.__exit__()
+
+
+history_scenarios(10, 200)
+history_scenarios(100, 100)
+history_scenarios(10_000, 5)
+
+
+def hash_scenario(length, iterations):
+    @scenario(f"utils/hash_int_list/{length}", iterations=iterations)
+    def _():
+        from utils import hash_int_list
+
+        rng = random.Random(length)
+        ppis = [rng.randint(500, 1200) for _ in range(length)]
+        return lambda: hash_int_list(ppis), None
+
+
+hash_scenario(100, 500)
+hash_scenario(10_000, 20)
+
+
+@scenario("net/http/parse_request", iterations=2000)
+def _():
+    from net.http import HTTP
+
+    raw = (
+        b"GET /portal?ssid=group%2011&password=hunter2 HTTP/1.1\r\n"
+        b"Host: 192.168.4.1\r\n"
+        b"User-Agent: Mozilla/5.0\r\n"
+        b"Accept: text/html\r\n"
+        b"X-Pico-Fi-Socket-Id: 12\r\n"
+        b"\r\n"
+    )
+    return lambda: HTTP.parse_request(None, raw), None
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def run_scenario(name):
+    setup, iterations, warmup = scenarios[name]
+    body, cleanup = setup()
+    try:
+        for _ in range(warmup):
+            body()
+
+        times_ns = []
+        for _ in range(iterations):
+            start_ns = perf_counter_ns()
+            body()
+            times_ns.append(perf_counter_ns() - start_ns)
+
+        # Tracing slows everything down, so allocations get their own pass
+        alloc_bytes = []
+        tracemalloc.start()
+        for _ in range(min(iterations, 50)):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            body()
+            alloc_bytes.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+    finally:
+        if cleanup:
+            cleanup()
+
+    times_ns.sort()
+    alloc_bytes.sort()
+    return {
+        "iterations": iterations,
+        "p50_us": percentile(times_ns, 50) / 1000,
+        "p95_us": percentile(times_ns, 95) / 1000,
+        "p99_us": percentile(times_ns, 99) / 1000,
+        "max_us": times_ns[-1] / 1000,
+        "alloc_bytes_p50": percentile(alloc_bytes, 50),
+        "alloc_bytes_max": alloc_bytes[-1],
+    }
+
+
+def git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=sim.ROOT,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    header = f"{'scenario':40} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10} {'max us':>10} {'alloc B':>8}"
+    if baseline:
+        header += f" {'p50 vs base':>12}"
+    print(header)
+    for name, r in results.items():
+        line = (
+            f"{name:40} {r['p50_us']:10.1f} {r['p95_us']:10.1f} {r['p99_us']:10.1f} "
+            f"{r['max_us']:10.1f} {r['alloc_bytes_p50']:8}"
+        )
+        if baseline and name in baseline:
+            line += f" {r['p50_us'] / max(baseline[name]['p50_us'], 1e-9):11.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-k", "--filter", default="", help="substring of names")
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", help="earlier results to compare against")
+    parser.add_argument("--list", action="store_true")
+    args = parser.parse_args()
+
+    names = [name for name in scenarios if args.filter in name]
+    if args.list:
+        print("\n".join(names))
+        return
+
+    results = {}
+    for name in names:
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = run_scenario(name)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    print_results(results, baseline)
+
+    with open(args.out, "w") as f:
+        json.dump(
+            {"revision": git_revision(), "results": results}, f, indent=2
+        )
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
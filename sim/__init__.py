@@ -0,0 +1,53 @@
+"""
+Host-side simulator for the Pico firmware.
+
+`install()` puts the CPython stand-ins from `sim/stubs` and the firmware in
+`src` on the import path and swaps the `time` functions for a virtual clock.
+After that `asm.Machine` can be constructed and driven headlessly, see
+`sim.simulator.Simulator`.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+STUBS = os.path.join(ROOT, "sim", "stubs")
+
+# Firmware modules sharing a name with the host standard library
+_SHADOWED = ("logging", "secrets")
+
+_installed = False
+
+
+def install():
+    global _installed
+    if _installed:
+        return
+
+    # Host modules that import the standard `logging` have to be loaded
+    # before the firmware's own `logging` takes its place
+    import asyncio  # noqa: F401
+    from sim.clock import install as install_clock
+
+    install_clock()
+
+    for path in (SRC, STUBS, ROOT):
+        if path in sys.path:
+            sys.path.remove(path)
+    sys.path[:0] = [SRC, STUBS, ROOT]
+
+    for name in _SHADOWED:
+        module = sys.modules.get(name)
+        if module and not getattr(module, "__file__", "").startswith(SRC):
+            del sys.modules[name]
+
+    _installed = True
+
+
+def __getattr__(name):
+    if name == "Simulator":
+        from sim.simulator import Simulator
+
+        return Simulator
+    raise AttributeError(name)
@@ -0,0 +1,79 @@
+"""
+Run a synthetic measurement and print frame timings and detected PPIs.
+
+    python -m sim --seconds 60 --bpm 72
+"""
+
+import argparse
+
+from sim.simulator import Simulator, DEFAULT_FRAME_MS
+from sim.traces import SyntheticPpg, RecordedTrace
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m sim")
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--frame-ms", type=float, default=DEFAULT_FRAME_MS)
+    parser.add_argument("--bpm", type=float, default=70)
+    parser.add_argument("--hrv-ms", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace", help="file with one raw ADC value per line")
+    parser.add_argument("--trace-rate", type=float, default=250)
+    parser.add_argument("--sample-rate", type=int, help="sensor sample rate in Hz")
+    parser.add_argument(
+        "--dsp",
+        choices=("fixed", "float", "band-pass"),
+        help="signal processing arithmetic, or the float band pass detector",
+    )
+    parser.add_argument(
+        "--second-core",
+        action="store_true",
+        help="sample and find the peaks on a second thread",
+    )
+    parser.add_argument("--allocations", action="store_true")
+    args = parser.parse_args()
+
+    if args.trace:
+        source = RecordedTrace.from_file(args.trace, args.trace_rate)
+    else:
+        source = SyntheticPpg(bpm=args.bpm, hrv_ms=args.hrv_ms, seed=args.seed)
+
+    with Simulator(
+        source,
+        track_allocations=args.allocations,
+        sample_rate=args.sample_rate,
+        fixed_point=None if args.dsp is None else args.dsp == "fixed",
+        band_pass=None if args.dsp is None else args.dsp == "band-pass",
+        second_core=args.second_core or None,
+    ) as sim:
+        sim.enter("measure_heart_rate")
+        stats = sim.run_for(args.seconds * 1000, args.frame_ms)
+        frame_us = [s.frame_ns / 1000 for s in stats]
+
+        print(f"frames: {len(stats)}")
+        print(
+            f"frame time us: p50 {percentile(frame_us, 50):.1f} "
+            f"p95 {percentile(frame_us, 95):.1f} max {max(frame_us):.1f}"
+        )
+        if args.allocations:
+            alloc = [s.alloc_bytes for s in stats]
+            print(f"allocated bytes per frame: p50 {percentile(alloc, 50)}")
+        display_bytes = [s.display_bytes for s in stats]
+        print(
+            f"display bytes per frame: p50 {percentile(display_bytes, 50)} "
+            f"p95 {percentile(display_bytes, 95)} max {max(display_bytes)}"
+        )
+        print(f"i2c bytes: {sim.i2c_bytes}")
+        print(f"dropped samples: {sim.machine.heart_rate_dropped_samples}")
+        print(f"detected PPIs: {sim.ppis_ms()}")
+        if isinstance(source, SyntheticPpg):
+            print(f"true PPIs: {source.ppis_ms(sim.now_ms)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Virtual clock shared by the simulated `time` functions and `machine.Timer`.
+
+Nothing advances on its own, the simulator moves the clock forward explicitly
+and every periodic timer that became due in between fires in order.
+"""
+
+import time
+
+# The host's own, for threads that have to wait without moving the clock
+host_sleep = time.sleep
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now_us = 0
+        self._timers = []
+
+    def reset(self):
+        self.now_us = 0
+        self._timers = []
+
+    def add_timer(self, timer):
+        if timer not in self._timers:
+            self._timers.append(timer)
+
+    def remove_timer(self, timer):
+        if timer in self._timers:
+            self._timers.remove(timer)
+
+    def advance_us(self, dt_us):
+        """
+        Move the clock forward by `dt_us`, firing every timer due on the way.
+        """
+        target_us = self.now_us + dt_us
+        while self._timers:
+            timer = min(self._timers, key=lambda t: t.due_us)
+            if timer.due_us > target_us:
+                break
+            self.now_us = max(self.now_us, timer.due_us)
+            timer.fire()
+        self.now_us = target_us
+
+    def advance_ms(self, dt_ms):
+        self.advance_us(int(dt_ms * 1000))
+
+    # MicroPython `time` API
+
+    def ticks_ms(self):
+        return (self.now_us // 1000) & TICKS_MAX
+
+    def ticks_us(self):
+        return self.now_us & TICKS_MAX
+
+    def ticks_cpu(self):
+        return self.ticks_us()
+
+    @staticmethod
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & TICKS_MAX
+
+    @staticmethod
+    def ticks_diff(ticks1, ticks2):
+        return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+    def time(self):
+        # MicroPython ports without float time return whole seconds
+        return self.now_us // 1_000_000
+
+    def time_ns(self):
+        return self.now_us * 1000
+
+    def sleep(self, s):
+        self.advance_us(int(s * 1_000_000))
+
+    def sleep_ms(self, ms):
+        self.advance_us(int(ms * 1000))
+
+    def sleep_us(self, us):
+        self.advance_us(int(us))
+
+
+clock = VirtualClock()
+
+
+def install():
+    """
+    Patch the host `time` module so that `from time import ticks_ms` and
+    friends resolve to the virtual clock.
+    """
+    for name in (
+        "ticks_ms",
+        "ticks_us",
+        "ticks_cpu",
+        "ticks_add",
+        "ticks_diff",
+        "time",
+        "time_ns",
+        "sleep",
+        "sleep_ms",
+        "sleep_us",
+    ):
+        setattr(time, name, getattr(clock, name))
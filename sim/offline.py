@@ -0,0 +1,389 @@
+"""
+Offline analysis of recorded PPG sessions with NumPy.
+
+Runs the same filter, threshold, peak picking, peak refinement and PPI gating
+as the firmware (`heart.PeakDetector` and `Machine._on_heart_rate_peak`) over
+whole arrays at once, for replaying large numbers of recordings on a
+computer. `scalar_ppis` feeds the firmware code itself one sample at a time,
+`check_parity` compares the two. `check_fixed_point` compares the fixed point
+detector against the floating point one.
+
+    python -m sim.offline session1.txt session2.txt --rate 250
+    python -m sim.offline --synthetic 3600 --check
+
+Recordings are text files with one raw ADC value per line, as for
+`python -m sim --trace`. The no-peak timeout is checked after every sample,
+the firmware only gets to it once per frame.
+
+Needs NumPy, SciPy makes the low pass filter a lot faster when installed.
+"""
+
+import argparse
+import sys
+from time import perf_counter
+
+import numpy as np
+
+# Before `sim.install`, SciPy needs the standard `secrets` the firmware shadows
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
+
+import sim
+
+sim.install()
+
+from constants import (  # noqa: E402
+    MAX_NO_PEAK_INTERVAL_MS,
+    MAX_PEAK_INTERVAL_MS,
+    MEAN_WINDOW_MS,
+    MEAN_WINDOW_PERCENT,
+    MIN_PEAK_INTERVAL_MS,
+    SAMPLE_RATE,
+)
+from heart import FixedPointPeakDetector, PeakDetector, low_pass_alpha  # noqa: E402
+from hrv import HrvAccumulator  # noqa: E402
+
+
+def load_session(path):
+    values = np.loadtxt(path, ndmin=1)
+    return np.clip(values, 0, 0xFFFF).astype(np.uint16)
+
+
+def session_stamps(count, sample_rate):
+    """
+    The ticks a perfectly regular sampling timer would have stamped.
+    """
+    return np.arange(count, dtype=np.int64) * 1000 // sample_rate
+
+
+def low_pass(values, alpha):
+    """
+    `y[0] = x[0]`, `y[n] = alpha * y[n - 1] + (1 - alpha) * x[n]`.
+
+    The result has to match the firmware to the last bit, on a flat signal
+    the threshold ties with it and rounding decides what is a peak. SciPy's
+    `lfilter` does the exact same operations, without it the recursion runs
+    in Python.
+    """
+    x = np.asarray(values, dtype=np.float64)
+    if not len(x):
+        return x.copy()
+
+    y = np.empty_like(x)
+    y[0] = x[0]
+    if lfilter is not None:
+        y[1:] = lfilter([1 - alpha], [1, -alpha], x[1:], zi=[alpha * x[0]])[0]
+        return y
+
+    previous = y[0]
+    beta = 1 - alpha
+    out = [previous]
+    for value in x[1:].tolist():
+        previous = alpha * previous + beta * value
+        out.append(previous)
+    return np.array(out)
+
+
+def rolling_min(values, size):
+    """
+    Minimum of every `size` long window of `values`, van Herk/Gil-Werman:
+    a prefix and a suffix minimum per block of `size` cover any window.
+    """
+    n = len(values)
+    padded = np.concatenate([values, np.full((-n) % size, np.inf)])
+    blocks = padded.reshape(-1, size)
+    prefix = np.minimum.accumulate(blocks, axis=1).ravel()
+    suffix = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    starts = np.arange(n - size + 1)
+    return np.minimum(suffix[starts], prefix[starts + size - 1])
+
+
+def window_sums(values, size):
+    """
+    Sum of every `size` long window of float32 `values`.
+
+    The sums are taken in integers, which is exact for float32 down to the
+    smallest value that still leaves room for the total. A floating point
+    cumulative sum would not even see a flat stretch of signal as flat.
+    """
+    magnitude = np.abs(values)
+    nonzero = magnitude[magnitude > 0]
+    if not len(nonzero):
+        return np.zeros(len(values) - size + 1)
+
+    # float32 has 24 significant bits
+    needed = 23 - int(np.floor(np.log2(nonzero.min())))
+    room = 62 - int(np.ceil(np.log2(magnitude.max() * len(values) + 1)))
+    shift = min(needed, room)
+
+    scaled = np.round(np.ldexp(values, shift)).astype(np.int64)
+    sums = np.concatenate([[0], np.cumsum(scaled)])
+    windows = sums[size:] - sums[: len(sums) - size]
+    return np.ldexp(windows.astype(np.float64), -shift)
+
+
+def thresholds(filtered, sample_rate):
+    """
+    The threshold `PeakDetector` compares every sample against.
+    """
+    size = max(1, sample_rate * MEAN_WINDOW_MS // 1000)
+    n = len(filtered)
+
+    # The window stores float32, and starts out full of the first sample
+    stored = filtered.astype(np.float32).astype(np.float64)
+    history = np.concatenate([np.full(size, stored[0]), stored])
+
+    means = window_sums(history, size)[:n] / size
+    mins = rolling_min(history, size)[:n]
+
+    corrected = MEAN_WINDOW_PERCENT * (means - mins) + mins
+    return np.where(means == 0, 0.0, corrected)
+
+
+def refine_peak(filtered, stamps, index):
+    """
+    `PeakDetector._refine_peak` for the peak at `index`, which always has a
+    sample after it.
+    """
+    peak_ms = int(stamps[index])
+    if not index:
+        return peak_ms
+    peak = float(filtered[index])
+    before = float(filtered[index - 1])
+    after = float(filtered[index + 1])
+    curvature = 2 * peak - before - after
+    if curvature <= 0:
+        return peak_ms
+    span_ms = int(stamps[index + 1] - stamps[index - 1])
+    return peak_ms + round(span_ms * (after - before) / (4 * curvature))
+
+
+def vector_peaks(values, stamps, sample_rate=SAMPLE_RATE):
+    """
+    Peak ticks and the index of the sample each one was reported at.
+    """
+    n = len(values)
+    if not n:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+
+    filtered = low_pass(values, low_pass_alpha(sample_rate))
+    above = filtered > thresholds(filtered, sample_rate)
+
+    edges = np.diff(np.concatenate([[0], above.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    # A stretch still going at the end of the session was never reported
+    keep = ends < n
+    starts = starts[keep]
+    ends = ends[keep]
+
+    stamps = np.asarray(stamps, dtype=np.int64)
+    peaks = []
+    reports = []
+    last_peak_ms = None
+    # Every stretch only counts once the previous peak is far enough back,
+    # which depends on the peaks before it
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if last_peak_ms is not None:
+            earliest = int(
+                np.searchsorted(stamps, last_peak_ms + MIN_PEAK_INTERVAL_MS)
+            )
+            start = max(start, earliest)
+            if start >= end:
+                continue
+        index = start + int(np.argmax(filtered[start:end]))
+        last_peak_ms = refine_peak(filtered, stamps, index)
+        peaks.append(last_peak_ms)
+        reports.append(end)
+
+    return np.array(peaks, np.int64), np.array(reports, np.int64)
+
+
+def vector_ppis(values, stamps=None, sample_rate=SAMPLE_RATE):
+    """
+    PPIs the firmware would have kept at the end of the session.
+    """
+    if stamps is None:
+        stamps = session_stamps(len(values), sample_rate)
+    stamps = np.asarray(stamps, dtype=np.int64)
+    peaks, reports = vector_peaks(values, stamps, sample_rate)
+    if len(peaks) < 2:
+        return np.zeros(0, np.int64)
+
+    intervals = np.diff(peaks)
+    valid = (MIN_PEAK_INTERVAL_MS < intervals) & (intervals < MAX_PEAK_INTERVAL_MS)
+
+    # The latest stamp seen while each peak was the last one
+    latest = np.append(stamps[reports[1:] - 1], stamps[-1])
+    resets = np.flatnonzero(latest - peaks > MAX_NO_PEAK_INTERVAL_MS)
+    if len(resets):
+        # A reset while peak `k` was the last one drops every PPI up to it
+        valid[: resets[-1]] = False
+
+    return intervals[valid]
+
+
+def scalar_ppis(values, stamps=None, sample_rate=SAMPLE_RATE, detector=PeakDetector):
+    """
+    The same as `vector_ppis`, one sample at a time through the firmware's
+    `PeakDetector`, or the `detector` class given.
+    """
+    if stamps is None:
+        stamps = session_stamps(len(values), sample_rate)
+    detector = detector(sample_rate)
+    ppis = []
+    last_peak_ms = None
+    for value, stamp in zip(values.tolist(), np.asarray(stamps).tolist()):
+        peak_ms = detector.add(value, stamp)
+        if peak_ms is not None:
+            if last_peak_ms is not None:
+                interval = peak_ms - last_peak_ms
+                if MIN_PEAK_INTERVAL_MS < interval < MAX_PEAK_INTERVAL_MS:
+                    ppis.append(interval)
+            last_peak_ms = peak_ms
+        if last_peak_ms is not None and stamp - last_peak_ms > MAX_NO_PEAK_INTERVAL_MS:
+            ppis.clear()
+    return ppis
+
+
+def hrv_summary(ppis):
+    """
+    The numbers `display_heart_rate_analysis` shows, for an array of PPIs.
+    """
+    ppis = np.asarray(ppis, dtype=np.float64)
+    if not len(ppis):
+        return {"PPIS": 0, "MEAN PPI": 0, "MEAN HR": 0, "SDNN": 0, "RMSSD": 0}
+    successive = np.diff(ppis)
+    mean_ppi = ppis.mean()
+    return {
+        "PPIS": len(ppis),
+        "MEAN PPI": mean_ppi,
+        "MEAN HR": 60000 / mean_ppi,
+        "SDNN": ppis.std(),
+        "RMSSD": np.sqrt(np.mean(successive**2)) if len(successive) else 0,
+    }
+
+
+def check_parity(values, stamps=None, sample_rate=SAMPLE_RATE):
+    """
+    Compare the vectorised path against the firmware code on one session.
+    Returns a list of differences, empty if they agree.
+    """
+    vector = vector_ppis(values, stamps, sample_rate).tolist()
+    scalar = scalar_ppis(values, stamps, sample_rate)
+    problems = []
+    if vector != scalar:
+        first = next(
+            (i for i, (a, b) in enumerate(zip(vector, scalar)) if a != b),
+            min(len(vector), len(scalar)),
+        )
+        problems.append(
+            f"PPIs differ from #{first}: {len(vector)} vectorised, "
+            f"{len(scalar)} scalar"
+        )
+
+    hrv = HrvAccumulator(max(1, len(scalar)))
+    for ppi in scalar:
+        hrv.add(ppi)
+    summary = hrv_summary(vector)
+    for name, expected in (
+        ("MEAN PPI", hrv.mean),
+        ("SDNN", hrv.sdnn()),
+        ("RMSSD", hrv.rmssd()),
+    ):
+        if not np.isclose(summary[name], expected, rtol=1e-9, atol=1e-6):
+            problems.append(f"{name} {summary[name]} vs {expected}")
+    return problems
+
+
+def check_fixed_point(values, stamps=None, sample_rate=SAMPLE_RATE):
+    """
+    Compare `FixedPointPeakDetector` against the floating point detector on
+    one session. Returns a list of differences, empty if both find the same
+    peaks. The refined peak ticks are rounded from slightly different
+    values, so a PPI may be a millisecond off.
+    """
+    fixed = scalar_ppis(values, stamps, sample_rate, FixedPointPeakDetector)
+    floating = scalar_ppis(values, stamps, sample_rate)
+    if len(fixed) == len(floating) and all(
+        abs(a - b) <= 1 for a, b in zip(fixed, floating)
+    ):
+        return []
+    first = next(
+        (i for i, (a, b) in enumerate(zip(fixed, floating)) if abs(a - b) > 1),
+        min(len(fixed), len(floating)),
+    )
+    return [
+        f"fixed point PPIs differ from #{first}: {len(fixed)} fixed, "
+        f"{len(floating)} float"
+    ]
+
+
+def synthetic_session(seconds, sample_rate, seed):
+    from sim.traces import SyntheticPpg
+
+    source = SyntheticPpg(seed=seed)
+    t_ms = session_stamps(int(seconds * sample_rate), sample_rate)
+    values = np.array([source(t) for t in t_ms.tolist()])
+    return np.clip(values, 0, 0xFFFF).astype(np.uint16)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m sim.offline")
+    parser.add_argument("sessions", nargs="*", help="recordings, one value per line")
+    parser.add_argument("--rate", type=int, default=SAMPLE_RATE, help="Hz")
+    parser.add_argument(
+        "--synthetic", type=float, help="also analyse a synthetic session (s)"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--check", action="store_true", help="compare against the firmware code"
+    )
+    args = parser.parse_args()
+
+    sessions = [(path, load_session(path)) for path in args.sessions]
+    if args.synthetic:
+        sessions.append(
+            (
+                f"synthetic:{args.seed}",
+                synthetic_session(args.synthetic, args.rate, args.seed),
+            )
+        )
+    if not sessions:
+        parser.error("no sessions given")
+
+    failed = False
+    total_samples = 0
+    total_s = 0.0
+    for name, values in sessions:
+        start = perf_counter()
+        ppis = vector_ppis(values, sample_rate=args.rate)
+        total_s += perf_counter() - start
+        total_samples += len(values)
+
+        summary = hrv_summary(ppis)
+        print(
+            f"{name}: {summary['PPIS']} PPIs, HR {summary['MEAN HR']:.1f}, "
+            f"SDNN {summary['SDNN']:.1f}, RMSSD {summary['RMSSD']:.1f}"
+        )
+        if args.check:
+            problems = check_parity(values, sample_rate=args.rate)
+            problems += check_fixed_point(values, sample_rate=args.rate)
+            failed = failed or bool(problems)
+            for problem in problems:
+                print(f"  parity: {problem}")
+            if not problems:
+                print("  parity: ok")
+
+    signal_h = total_samples / args.rate / 3600
+    print(
+        f"{signal_h:.2f} h of signal in {total_s:.3f} s "
+        f"({signal_h / max(total_s, 1e-9):.1f} h/s)"
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Headless driver for `asm.Machine`.
+
+    from sim import Simulator
+    from sim.traces import SyntheticPpg
+
+    with Simulator(SyntheticPpg(bpm=72)) as sim:
+        sim.enter("measure_heart_rate")
+        stats = sim.run_for(60_000)
+        print(sim.ppis_ms())
+"""
+
+import os
+import shutil
+import tempfile
+import tracemalloc
+from collections import namedtuple
+from time import perf_counter_ns
+
+import sim
+from sim.clock import clock, host_sleep
+
+FrameStat = namedtuple(
+    "FrameStat", "t_ms frame_ns alloc_bytes display_bytes state"
+)
+
+# Matches the pace of the main loop on hardware closely enough
+DEFAULT_FRAME_MS = 20
+# How long the host waits for the second core thread at a time
+SECOND_CORE_WAIT_S = 0.0002
+
+
+class Simulator:
+    """
+    Owns a `Machine` running against the stubbed hardware in a scratch
+    working directory (logs and history land there, not in the repo).
+    """
+
+    def __init__(
+        self,
+        source=None,
+        workdir=None,
+        track_allocations=False,
+        sample_rate=None,
+        fixed_point=None,
+        band_pass=None,
+        second_core=None,
+    ):
+        sim.install()
+
+        self._previous_cwd = os.getcwd()
+        self._owns_workdir = workdir is None
+        self.workdir = workdir or tempfile.mkdtemp(prefix="cardiotron-sim-")
+        os.chdir(self.workdir)
+
+        clock.reset()
+
+        import machine as mpy_machine
+        from constants import PIN_SENSOR
+
+        self._pins = mpy_machine.Pin.instances
+        self._pins.clear()
+        self.source = source
+        mpy_machine.ADC.sources[PIN_SENSOR] = source
+
+        from asm import Machine
+
+        self.machine = Machine()
+        # The second core is a host thread, which has to wait in real time
+        self.machine.second_core.wait = lambda: host_sleep(SECOND_CORE_WAIT_S)
+        if (sample_rate, fixed_point, band_pass, second_core) != (None,) * 4:
+            machine = self.machine
+            machine.configure_heart_sensor(
+                sample_rate or machine.heart_rate_sample_rate,
+                machine.heart_rate_fixed_point if fixed_point is None else fixed_point,
+                machine.heart_rate_band_pass if band_pass is None else band_pass,
+                machine.heart_rate_second_core if second_core is None else second_core,
+            )
+        self.track_allocations = track_allocations
+        if track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def close(self):
+        # Stop the second core thread, whatever state the machine is in
+        self.machine.second_core.stop()
+        if self.track_allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        clock.reset()
+        os.chdir(self._previous_cwd)
+        if self._owns_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def now_ms(self):
+        return clock.now_us / 1000
+
+    @property
+    def display(self):
+        return self.machine.display
+
+    @property
+    def i2c_bytes(self):
+        return self.machine.i2c.bytes_written
+
+    def enter(self, state, *args, **kwargs):
+        """
+        Switch the machine into the state method called `state`.
+        """
+        self.machine.state(getattr(self.machine, state), *args, **kwargs)
+        self.machine.is_first_frame = True
+
+    def step(self, frame_ms=DEFAULT_FRAME_MS):
+        """
+        Advance the virtual clock by one frame and run `execute()` once.
+        """
+        clock.advance_ms(frame_ms)
+        self._catch_up_second_core()
+        state = self.machine.state().__name__
+
+        if self.track_allocations:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+
+        display = self.machine.display
+        sent_before = display.bytes_sent_total
+
+        start_ns = perf_counter_ns()
+        self.machine.execute()
+        frame_ns = perf_counter_ns() - start_ns
+
+        alloc_bytes = 0
+        if self.track_allocations:
+            _, peak = tracemalloc.get_traced_memory()
+            alloc_bytes = peak - before
+
+        display_bytes = display.bytes_sent_total - sent_before
+        return FrameStat(self.now_ms, frame_ns, alloc_bytes, display_bytes, state)
+
+    def _catch_up_second_core(self):
+        """
+        Let the second core process every sample the frame brought before
+        the frame runs, so a run does not depend on how the host schedules
+        its threads.
+        """
+        core = self.machine.second_core
+        samples = self.machine.heart_rate_samples
+        while core.alive and (len(samples) or not core.waiting):
+            host_sleep(SECOND_CORE_WAIT_S)
+
+    def run(self, frames, frame_ms=DEFAULT_FRAME_MS):
+        return [self.step(frame_ms) for _ in range(frames)]
+
+    def run_for(self, duration_ms, frame_ms=DEFAULT_FRAME_MS):
+        return self.run(int(duration_ms // frame_ms), frame_ms)
+
+    def ppis_ms(self):
+        return list(self.machine.heart_rate_ppis_ms)
+
+    # Input
+
+    def press(self, long=False):
+        """
+        Push and release the rotary button, long enough to count as a long
+        press if `long` is set.
+        """
+        from constants import PIN_ROTARY_BUTTON, LONG_PRESS_MS, ROTARY_BUTTON_DEBOUNCE_MS
+
+        button = self._pins[PIN_ROTARY_BUTTON]
+        clock.advance_ms(ROTARY_BUTTON_DEBOUNCE_MS + 1)
+        button.set(0)
+        clock.advance_ms(LONG_PRESS_MS * 2 if long else ROTARY_BUTTON_DEBOUNCE_MS + 1)
+        button.set(1)
+
+    def rotate(self, steps):
+        """
+        Turn the knob by `steps` detents, positive is clockwise.
+        """
+        from constants import PIN_ROTARY_A, PIN_ROTARY_B
+
+        a = self._pins[PIN_ROTARY_A]
+        b = self._pins[PIN_ROTARY_B]
+        b.set(0 if steps > 0 else 1)
+        target = self.machine.rotary_motion_queue + steps
+        while self.machine.rotary_motion_queue != target:
+            a.set(0)
+            a.set(1)
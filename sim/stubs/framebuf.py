@@ -0,0 +1,113 @@
+"""
+CPython stand-in for MicroPython's `framebuf` module.
+
+Only the MONO_VLSB layout used by the SSD1306 is implemented. Glyphs are not
+the real 8x8 font, they are a deterministic pattern derived from the character
+code, which is enough to exercise the same amount of pixel work.
+"""
+
+MONO_VLSB = 0
+MONO_HLSB = 3
+MONO_HMSB = 4
+
+
+def _glyph(ch):
+    if ch == " ":
+        return bytes(8)
+    code = ord(ch)
+    return bytes(((code * (k + 1) * 37) >> 1) & 0x7E for k in range(7)) + b"\x00"
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format=MONO_VLSB, stride=None):
+        if format != MONO_VLSB:
+            raise ValueError("only MONO_VLSB is simulated")
+        self.buf = buffer
+        self.width = width
+        self.height = height
+        self.stride = stride or width
+
+    def _set(self, x, y, c):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            index = (y >> 3) * self.stride + x
+            bit = 1 << (y & 7)
+            if c:
+                self.buf[index] |= bit
+            else:
+                self.buf[index] &= ~bit & 0xFF
+
+    def _get(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return (self.buf[(y >> 3) * self.stride + x] >> (y & 7)) & 1
+        return 0
+
+    def fill(self, c):
+        value = 0xFF if c else 0
+        for i in range(len(self.buf)):
+            self.buf[i] = value
+
+    def pixel(self, x, y, c=None):
+        if c is None:
+            return self._get(x, y)
+        self._set(x, y, c)
+
+    def fill_rect(self, x, y, w, h, c):
+        for yy in range(max(y, 0), min(y + h, self.height)):
+            for xx in range(max(x, 0), min(x + w, self.width)):
+                self._set(xx, yy, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.hline(x, y, w, c)
+        self.hline(x, y + h - 1, w, c)
+        self.vline(x, y, h, c)
+        self.vline(x + w - 1, y, h, c)
+
+    def line(self, x1, y1, x2, y2, c):
+        dx = abs(x2 - x1)
+        dy = -abs(y2 - y1)
+        sx = 1 if x1 < x2 else -1
+        sy = 1 if y1 < y2 else -1
+        err = dx + dy
+        while True:
+            self._set(x1, y1, c)
+            if x1 == x2 and y1 == y2:
+                return
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x1 += sx
+            if e2 <= dx:
+                err += dx
+                y1 += sy
+
+    def text(self, s, x, y, c=1):
+        for ch in s:
+            for col, bits in enumerate(_glyph(ch)):
+                for row in range(8):
+                    if (bits >> row) & 1:
+                        self._set(x + col, y + row, c)
+            x += 8
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        for yy in range(fbuf.height):
+            for xx in range(fbuf.width):
+                c = fbuf._get(xx, yy)
+                if palette is not None:
+                    c = palette._get(c, 0)
+                if c != key:
+                    self._set(x + xx, y + yy, c)
+
+    def scroll(self, xstep, ystep):
+        snapshot = FrameBuffer(bytearray(self.buf), self.width, self.height)
+        for yy in range(self.height):
+            for xx in range(self.width):
+                self._set(xx, yy, snapshot._get(xx - xstep, yy - ystep))
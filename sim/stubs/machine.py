@@ -0,0 +1,240 @@
+"""
+CPython stand-in for MicroPython's `machine` module on the Pico W.
+
+Pins keep their IRQ handlers so the simulator can trigger them, ADC channels
+read from a per-pin signal source and timers run on the virtual clock.
+"""
+
+import time
+from sim.clock import clock
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    instances = {}
+
+    def __init__(self, id, mode=IN, pull=None, value=None):
+        self.id = id
+        self.mode = mode
+        self._value = 1 if pull == Pin.PULL_UP else 0
+        if value is not None:
+            self._value = value
+        self._handler = None
+        self._trigger = 0
+        Pin.instances[id] = self
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self.set(value)
+
+    def on(self):
+        self.set(1)
+
+    def off(self):
+        self.set(0)
+
+    def toggle(self):
+        self.set(self._value ^ 1)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        self._handler = handler
+        self._trigger = trigger
+
+    def set(self, value):
+        """
+        Drive the pin from the outside, firing the IRQ on a matching edge.
+        """
+        value = 1 if value else 0
+        previous, self._value = self._value, value
+        if previous == value or not self._handler:
+            return
+        edge = Pin.IRQ_RISING if value else Pin.IRQ_FALLING
+        if self._trigger & edge:
+            self._handler(self)
+
+
+class ADC:
+    CORE_TEMP = 4
+
+    # Pin id -> callable(ticks_ms) -> int, configured by the simulator
+    sources = {}
+
+    def __init__(self, pin):
+        self.id = pin.id if isinstance(pin, Pin) else pin
+
+    def read_u16(self):
+        source = ADC.sources.get(self.id)
+        if source is None:
+            return 0
+        return max(0, min(0xFFFF, int(source(clock.now_us / 1000))))
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.id = id
+        self.period_us = 0
+        self.due_us = 0
+        self.mode = Timer.PERIODIC
+        self.callback = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, freq=None, period=None, callback=None, hard=True):
+        if freq is not None:
+            self.period_us = int(1_000_000 / freq)
+        else:
+            self.period_us = int(period * 1000)
+        self.mode = mode
+        self.callback = callback
+        self.due_us = clock.now_us + self.period_us
+        clock.add_timer(self)
+
+    def deinit(self):
+        clock.remove_timer(self)
+
+    def fire(self):
+        if self.mode == Timer.PERIODIC:
+            self.due_us += self.period_us
+        else:
+            clock.remove_timer(self)
+        if self.callback:
+            self.callback(self)
+
+
+class Ssd1306Panel:
+    """
+    The display RAM of an SSD1306 in horizontal addressing mode, updated from
+    the command and data bytes sent to it. Lets the simulator check what is
+    actually on the panel rather than in the framebuffer.
+    """
+
+    # Commands followed by argument bytes, other than the address windows
+    ARGUMENTS = {
+        0x20: 1,
+        0x81: 1,
+        0x8D: 1,
+        0xA8: 1,
+        0xD3: 1,
+        0xD5: 1,
+        0xD9: 1,
+        0xDA: 1,
+        0xDB: 1,
+    }
+
+    def __init__(self, width=128, pages=8):
+        self.width = width
+        self.pages = pages
+        self.ram = bytearray(width * pages)
+        self.col0, self.col1 = 0, width - 1
+        self.page0, self.page1 = 0, pages - 1
+        self.col = self.page = 0
+        self._command = None
+        self._args = []
+        self._pending = 0
+
+    def command(self, byte):
+        if self._pending:
+            self._args.append(byte)
+            self._pending -= 1
+            if not self._pending:
+                self._apply()
+            return
+        self._command = byte
+        self._args = []
+        if byte in (0x21, 0x22):
+            self._pending = 2
+        else:
+            self._pending = self.ARGUMENTS.get(byte, 0)
+
+    def _apply(self):
+        if self._command == 0x21:
+            self.col0, self.col1 = self._args
+            self.col = self.col0
+        elif self._command == 0x22:
+            self.page0, self.page1 = self._args
+            self.page = self.page0
+
+    def data(self, buf):
+        for byte in buf:
+            self.ram[self.page * self.width + self.col] = byte
+            self.col += 1
+            if self.col > self.col1:
+                self.col = self.col0
+                self.page += 1
+                if self.page > self.page1:
+                    self.page = self.page0
+
+
+class I2C:
+    def __init__(self, id, scl=None, sda=None, freq=400_000):
+        self.id = id
+        self.freq = freq
+        self.bytes_written = 0
+        self.transactions = 0
+        self.panel = Ssd1306Panel()
+
+    def scan(self):
+        return [0x3C]
+
+    def _write(self, data):
+        self.bytes_written += len(data)
+        self.transactions += 1
+        control, payload = data[0], data[1:]
+        if control == 0x80:
+            self.panel.command(payload[0])
+        elif control == 0x40:
+            self.panel.data(payload)
+
+    def writeto(self, addr, buf, stop=True):
+        self._write(bytes(buf))
+        return 1
+
+    def writevec(self, addr, vector, stop=True):
+        self._write(b"".join(bytes(buf) for buf in vector))
+        return 1
+
+    def readfrom(self, addr, nbytes, stop=True):
+        return bytes(nbytes)
+
+
+class RTC:
+    def __init__(self):
+        pass
+
+    def datetime(self, datetimetuple=None):
+        if datetimetuple is None:
+            return time.localtime()
+
+
+def freq(hz=None):
+    return 125_000_000
+
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state):
+    pass
+
+
+def unique_id():
+    return b"\xe6\x61\x41\x04\x03\x28\x41\x2b"
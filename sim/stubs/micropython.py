@@ -0,0 +1,31 @@
+"""
+CPython stand-in for the `micropython` module.
+"""
+
+
+def const(value):
+    return value
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def schedule(function, arg):
+    function(arg)
+
+
+def native(function):
+    return function
+
+
+def viper(function):
+    return function
+
+
+def mem_info(verbose=False):
+    pass
+
+
+def opt_level(level=None):
+    return 0
@@ -0,0 +1,57 @@
+"""
+CPython stand-in for the Pico W `network` module.
+
+`WLAN.connect` reports `STAT_CONNECTING` for a couple of polls and then
+succeeds, unless `WLAN.outcome` is changed by the simulator.
+"""
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+
+class WLAN:
+    outcome = STAT_GOT_IP
+    polls_until_outcome = 2
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._status = STAT_IDLE
+        self._polls = 0
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+        self._active = bool(is_active)
+
+    def connect(self, ssid=None, key=None, **kwargs):
+        self._status = STAT_CONNECTING
+        self._polls = 0
+
+    def disconnect(self):
+        self._status = STAT_IDLE
+
+    def status(self, param=None):
+        if self._status == STAT_CONNECTING:
+            self._polls += 1
+            if self._polls > WLAN.polls_until_outcome:
+                self._status = WLAN.outcome
+        return self._status
+
+    def isconnected(self):
+        return self._status == STAT_GOT_IP
+
+    def ifconfig(self, config=None):
+        return ("192.168.11.2", "255.255.255.0", "192.168.11.254", "1.1.1.1")
+
+    def config(self, param=None, **kwargs):
+        if param == "mac":
+            return b"\x28\xcd\xc1\x00\x11\x22"
+        return None
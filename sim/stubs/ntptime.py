@@ -0,0 +1,9 @@
+"""
+CPython stand-in for `ntptime`, the host clock is already correct.
+"""
+
+host = "pool.ntp.org"
+
+
+def settime():
+    pass
@@ -0,0 +1,5 @@
+"""
+CPython stand-in for `ujson`.
+"""
+
+from json import *  # noqa: F401,F403
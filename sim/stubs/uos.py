@@ -0,0 +1,5 @@
+"""
+CPython stand-in for `uos`.
+"""
+
+from os import *  # noqa: F401,F403
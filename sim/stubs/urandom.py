@@ -0,0 +1,5 @@
+"""
+CPython stand-in for `urandom`.
+"""
+
+from random import getrandbits, randint, random, seed, uniform, choice  # noqa: F401
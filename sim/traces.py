@@ -0,0 +1,88 @@
+"""
+PPG signal sources for the simulated ADC.
+
+A source is any callable taking the virtual time in milliseconds and returning
+a raw `read_u16` value.
+"""
+
+import math
+import random
+from bisect import bisect_left
+from array import array
+
+
+class SyntheticPpg:
+    """
+    Seeded photoplethysmogram: a systolic peak and a dicrotic notch per beat
+    on top of baseline wander and sensor noise. Beat times are kept so the
+    detected PPIs can be compared against the ground truth.
+    """
+
+    def __init__(
+        self,
+        bpm=70,
+        hrv_ms=30,
+        amplitude=6000,
+        baseline=30000,
+        wander=400,
+        noise=150,
+        seed=0,
+    ):
+        self.mean_ppi_ms = 60000 / bpm
+        self.hrv_ms = hrv_ms
+        self.amplitude = amplitude
+        self.baseline = baseline
+        self.wander = wander
+        self.noise = noise
+        self._random = random.Random(seed)
+        self.beats_ms = [self._random.uniform(0, self.mean_ppi_ms)]
+
+    def _extend(self, t_ms):
+        while self.beats_ms[-1] < t_ms + 2 * self.mean_ppi_ms:
+            ppi = self._random.gauss(self.mean_ppi_ms, self.hrv_ms)
+            self.beats_ms.append(self.beats_ms[-1] + max(ppi, 300))
+
+    def ppis_ms(self, until_ms):
+        """
+        Ground truth intervals between beats that happened before `until_ms`.
+        """
+        beats = [b for b in self.beats_ms if b <= until_ms]
+        return [round(b - a) for a, b in zip(beats, beats[1:])]
+
+    def __call__(self, t_ms):
+        self._extend(t_ms)
+        value = self.baseline + self.wander * math.sin(tau_hz(0.2) * t_ms)
+        for i in range(bisect_left(self.beats_ms, t_ms - 800), len(self.beats_ms)):
+            dt = t_ms - self.beats_ms[i]
+            if dt < -200:
+                break
+            value += self.amplitude * math.exp(-((dt / 90) ** 2))
+            value += 0.35 * self.amplitude * math.exp(-(((dt - 300) / 110) ** 2))
+        return value + self._random.gauss(0, self.noise)
+
+
+class RecordedTrace:
+    """
+    Replays raw ADC values captured at `sample_rate_hz`, looping at the end.
+    """
+
+    def __init__(self, values, sample_rate_hz):
+        self.values = array("H", values)
+        self.sample_rate_hz = sample_rate_hz
+
+    @classmethod
+    def from_file(cls, path, sample_rate_hz):
+        with open(path) as f:
+            values = [int(float(line)) for line in f if line.strip()]
+        return cls(values, sample_rate_hz)
+
+    def __call__(self, t_ms):
+        index = int(t_ms * self.sample_rate_hz / 1000)
+        return self.values[index % len(self.values)]
+
+
+def tau_hz(hz):
+    """
+    Angular frequency per millisecond.
+    """
+    return 2 * math.pi * hz / 1000
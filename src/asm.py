@@ -1,13 +1,13 @@
 from hal import HAL
-from history import kubios_response_to_data, push_data, read_data
+from history import kubios_response_to_data, push_data, sidecars, store
 from ui import Ui
 import time
+from array import array
 from heart import (
-    low_pass_filter,
-    min_max_scaling,
-    compute_corrected_mean,
-    is_sample_peak,
-    draw_heart_rate_counter,
+    FIXED_POINT_FRACTION_BITS,
+    BandPassPeakDetector,
+    FixedPointPeakDetector,
+    PeakDetector,
 )
 from constants import (
     BEFORE_HEART_MEASUREMENT_SPLASH_MESSAGE,
@@ -19,10 +19,11 @@ from constants import (
     NO_KUBIOS_AFTER_MEASUREMENT_SPLASH_MESSAGE,
     NO_WIFI_SPLASH_MESSAGE,
     SAMPLE_RATE,
-    SAMPLE_SIZE,
+    SAMPLE_BUFFER_MS,
+    SAMPLE_DRAIN_MS,
+    SCREEN_SAMPLE_RATE,
     DISPLAY_HEIGHT_PX,
     DISPLAY_WIDTH_PX,
-    MEAN_WINDOW_SIZE,
     MIN_PEAK_INTERVAL_MS,
     MAX_PEAK_INTERVAL_MS,
     SAMPLES_ON_SCREEN_SIZE,
@@ -32,19 +33,21 @@ from constants import (
     UI_CLOCK_HOUR_ARROW_LENGTH_PX,
     UI_CLOCK_MINUTE_ARROW_LENGTH_PX,
     UI_CLOCK_SECOND_ARROW_LENGTH_PX,
-    HEART_SAMPLES_BUFFER_SIZE,
     MAX_NO_PEAK_INTERVAL_MS,
-    PPI_SIZE,
     DEFAULT_MQTT_SERVER_ADDR,
+    HEART_RATE_TIMER_SIZE_Y,
+    HEART_RATE_GRAPH_SIZE_Y,
+    HEART_BAND_PASS,
+    HEART_FIXED_POINT,
+    HEART_SECOND_CORE,
+    HEART_RATE_DISPLAY_FPS,
 )
 from time import localtime
 from math import tau, sin, cos
-from ringbuffer import Ringbuffer
+from ringbuffer import StampedSpscRingbuffer, RunningStatsRingbuffer
+from second_core import COLUMN_FIELDS, SecondCore
 from machine import Timer
-import math
-from collections import OrderedDict
 from utils import hash_int_list
-from wifi import connect_ap
 from network import (
     STAT_CONNECTING,
     STAT_NO_AP_FOUND,
@@ -54,6 +57,10 @@ from network import (
 )
 from secrets import secrets
 from history_ui import HistoryUi
+from hrv import HrvAccumulator
+from graph import GraphRenderer
+from display import TextSlot
+from logging import log, eth_log
 
 
 class Machine(HAL):
@@ -90,28 +97,39 @@ class Machine(HAL):
         )
 
         self.heart_rate = 0
-        self.heart_rate_graph_y = DISPLAY_HEIGHT_PX - 1
-        self.heart_rate_mean_window = Ringbuffer(MEAN_WINDOW_SIZE, "f")
-        self.heart_rate_screen_samples = Ringbuffer(SAMPLES_ON_SCREEN_SIZE, "f")
-        self.heart_rate_peak_screen_locations = set()
-
-        self.filtered_samples = Ringbuffer(SAMPLE_SIZE, "f")
+        self.heart_rate_graph = GraphRenderer(
+            self.display,
+            SAMPLES_ON_SCREEN_SIZE,
+            HEART_RATE_TIMER_SIZE_Y,
+            HEART_RATE_GRAPH_SIZE_Y,
+        )
+        self.heart_rate_timer_slot = TextSlot(0, 0, DISPLAY_WIDTH_PX // 8)
+        self.heart_rate_counter_slot = TextSlot(SAMPLES_ON_SCREEN_SIZE + 16, 32, 3)
+        self.heart_rate_rmssd_slot = TextSlot(SAMPLES_ON_SCREEN_SIZE + 8, 44, 4)
+        self.heart_rate_sdnn_slot = TextSlot(SAMPLES_ON_SCREEN_SIZE + 8, 54, 4)
 
-        self.heart_rate_samples = Ringbuffer(HEART_SAMPLES_BUFFER_SIZE, "H")
         self.heart_rate_sample_timer = Timer()
+        # Bound once, so the timer interrupt does not allocate a new method
+        self._heart_rate_sample_callback = self._read_heart_rate_sample
+        self.second_core = SecondCore(self)
+        self.configure_heart_sensor(SAMPLE_RATE)
 
         self.heart_rate_last_peak_ms = None
         self.heart_rate_ppis_ms = []
+        # New samples were processed and the screen is behind
+        self.heart_rate_dirty = False
+        self.heart_rate_next_frame_ms = 0
+        # Samples the sensor interrupt had no room for this measurement
+        self.heart_rate_dropped_samples = 0
+        # Blocks the second core had processed as of the last frame
+        self.heart_rate_second_core_blocks = 0
+        self.hrv = HrvAccumulator()
         self.rmssd = 0
         self.sdnn = 0
 
         self.heart_rate_first_sane_peak_ms = 0
         self.heart_rate_measuring_start_ms = 0
 
-        self.last_filtered_sample = 0
-        self.last_dy = 0
-
-        self.wlan_connecting_ongoing = None
         self.heart_measurement_duration_s = 0
 
         self.history_ui = HistoryUi(self)
@@ -120,12 +138,16 @@ class Machine(HAL):
         self.main_menu_ui.tick()
 
     def _reset_heart_measurements(self):
-        self.heart_rate_graph_y = DISPLAY_HEIGHT_PX - 1
-        self.heart_rate_mean_window.clear()
-        self.heart_rate_screen_samples.clear()
+        self.heart_rate_detector.reset()
+        self.heart_rate_screen_lows.clear()
+        self.heart_rate_screen_highs.clear()
+        self.heart_rate_graph.reset()
         self.heart_rate_samples.clear()
+        self._reset_heart_rate_column()
         self.heart_rate_last_peak_ms = None
         self.heart_rate_ppis_ms = []
+        self.heart_rate_dirty = False
+        self.hrv.reset()
         self.heart_rate = 0
         self.sdnn = 0
         self.rmssd = 0
@@ -133,17 +155,106 @@ class Machine(HAL):
         self.heart_rate_measuring_start_ms = 0
         self.heart_measurement_duration_s = 0
 
-    def set_heart_sensor_active(self, active):
+    def configure_heart_sensor(
+        self,
+        sample_rate,
+        fixed_point=HEART_FIXED_POINT,
+        band_pass=HEART_BAND_PASS,
+        second_core=HEART_SECOND_CORE,
+    ):
+        """
+        Set the rate the sensor is sampled at, how the signal is processed,
+        in fixed point or through the band pass, which is always in float,
+        and whether that happens on the second core. Takes effect on the
+        next measurement.
+        """
+        fixed_point = fixed_point and not band_pass
+        self.heart_rate_sample_rate = sample_rate
+        self.heart_rate_fixed_point = fixed_point
+        self.heart_rate_band_pass = band_pass
+        self.heart_rate_second_core = second_core
+        if band_pass:
+            detector = BandPassPeakDetector(sample_rate)
+        elif fixed_point:
+            detector = FixedPointPeakDetector(sample_rate)
+        else:
+            detector = PeakDetector(sample_rate)
+        self.heart_rate_detector = detector
+        # The lowest and the highest filtered sample of every graph column
+        self.heart_rate_screen_lows = RunningStatsRingbuffer(
+            SAMPLES_ON_SCREEN_SIZE, detector.typecode
+        )
+        self.heart_rate_screen_highs = RunningStatsRingbuffer(
+            SAMPLES_ON_SCREEN_SIZE, detector.typecode
+        )
+        self.heart_rate_samples = StampedSpscRingbuffer(
+            max(1, sample_rate * SAMPLE_BUFFER_MS // 1000), "H"
+        )
+        # Where `process_samples` drains the samples into
+        drain_size = max(1, sample_rate * SAMPLE_DRAIN_MS // 1000)
+        self.heart_rate_block = memoryview(array("H", [0] * drain_size))
+        self.heart_rate_block_stamps = memoryview(array("L", [0] * drain_size))
+        self.heart_rate_block_filtered = memoryview(
+            array(detector.block_typecode, [0] * drain_size)
+        )
+        # Samples that go into every column of the live graph, so it scrolls
+        # at the same pace whatever the sample rate
+        self.heart_rate_samples_per_column = max(
+            1, round(sample_rate / SCREEN_SAMPLE_RATE)
+        )
+        self._reset_heart_rate_column()
+
+        # Where the results of `_process_heart_rate_block` go, straight to
+        # the UI or into the queues of the second core. Bound once so the
+        # second core does not allocate a method for every one.
+        if second_core:
+            core = self.second_core
+            core.configure(detector.typecode)
+            self._heart_rate_peak_sink = core.put_peak
+            self._heart_rate_column_sink = core.put_column
+            self.heart_rate_peak_block = memoryview(
+                array("L", [0] * len(core.peaks.data))
+            )
+            self.heart_rate_column_block = memoryview(
+                array(detector.typecode, [0] * len(core.columns.data))
+            )
+        else:
+            self._heart_rate_peak_sink = self._on_heart_rate_peak
+            self._heart_rate_column_sink = self._append_heart_rate_column
+
+    def _reset_heart_rate_column(self):
+        self.heart_rate_column_low = 0
+        self.heart_rate_column_high = 0
+        self.heart_rate_column_count = 0
+        self.heart_rate_column_peak = False
+
+    def _read_heart_rate_sample(self, _):
+        self.heart_rate_samples.put(self.sensor_pin_adc.read_u16(), time.ticks_ms())
+
+    def set_sample_timer(self, active):
         if active:
             self.heart_rate_sample_timer.init(
-                period=round(1000 / SAMPLE_RATE),
-                callback=lambda _: self.heart_rate_samples.append(
-                    self.sensor_pin_adc.read_u16()
-                ),
+                freq=self.heart_rate_sample_rate,
+                callback=self._heart_rate_sample_callback,
             )
         else:
             self.heart_rate_sample_timer.deinit()
 
+    def set_heart_sensor_active(self, active):
+        if active:
+            self.heart_rate_samples.clear()
+            self.heart_rate_dropped_samples = 0
+            if self.heart_rate_second_core:
+                # Starts the timer from there too
+                self.second_core.start()
+                self.heart_rate_second_core_blocks = 0
+            else:
+                self.set_sample_timer(True)
+        elif self.heart_rate_second_core:
+            self.second_core.stop()
+        else:
+            self.set_sample_timer(False)
+
     def measure_heart_rate_splash(self):
         next_state = self.toast(
             BEFORE_HEART_MEASUREMENT_SPLASH_MESSAGE, next_state=self.measure_heart_rate
@@ -183,135 +294,219 @@ class Machine(HAL):
 
         if self.is_first_frame:
             self.set_heart_sensor_active(True)
+            self._clear_heart_rate_screen()
 
-        value = self.heart_rate_samples.get()
-        if not value:
+        # The samples themselves are handled by `process_samples`, however
+        # many came in the screen is only drawn at `HEART_RATE_DISPLAY_FPS`
+        if not self.heart_rate_dirty:
+            return
+        now_ms = time.ticks_ms()
+        if time.ticks_diff(now_ms, self.heart_rate_next_frame_ms) < 0:
             return
+        self.heart_rate_next_frame_ms = time.ticks_add(
+            now_ms, 1000 // HEART_RATE_DISPLAY_FPS
+        )
+        self.heart_rate_dirty = False
 
-        mean_window = self.heart_rate_mean_window
+        threshold = self.heart_rate_detector.threshold
+        if self.heart_rate_fixed_point:
+            threshold >>= FIXED_POINT_FRACTION_BITS
+        self.heart_rate_graph.plot(
+            self.heart_rate_screen_lows, self.heart_rate_screen_highs, threshold
+        )
+        self._draw_heart_rate_counters()
 
-        # Reset an old peak location
+        timer_str = ""
+        if self.heart_rate_measuring_start_ms:
+            # Display how long the measurement has been going
+            t = self.heart_measurement_duration_s
 
-        self.display.fill(0)
-        mean = sum(mean_window) / len(mean_window) if len(mean_window) else 0
-        corrected_mean = compute_corrected_mean(mean_window, mean)
+            timer_str = f"{t}s"
+            if t >= 60:
+                m = t // 60
+                s = t % 60
+                timer_str = f"{m}:{s:02}"
 
-        filtered_sample = float(value)
-        if self.filtered_samples:
-            filtered_sample = low_pass_filter(
-                self.last_filtered_sample, filtered_sample
-            )
+            if t >= MIN_MEASUREMENT_TIME_FOR_KUBIOS_S:
+                timer_str += " Ready!"
 
-        dy = filtered_sample - self.last_filtered_sample
+        self.heart_rate_timer_slot.draw(self.display, timer_str)
 
-        self.filtered_samples.append(filtered_sample)
-        self.heart_rate_screen_samples.append(filtered_sample)
+        self.display.show()
 
-        if self.heart_rate_screen_samples.end in self.heart_rate_peak_screen_locations:
-            self.heart_rate_peak_screen_locations.remove(
-                self.heart_rate_screen_samples.end
+    def process_samples(self):
+        samples = self.heart_rate_samples
+        if self.heart_rate_second_core:
+            core = self.second_core
+            # Read first, every peak and column up to them is already queued
+            blocks = core.blocks
+            current_time_ms = core.last_stamp_ms
+            self._collect_second_core()
+            if blocks == self.heart_rate_second_core_blocks:
+                return
+            self.heart_rate_second_core_blocks = blocks
+        elif not len(samples):
+            return
+        else:
+            block = self.heart_rate_block
+            stamps = self.heart_rate_block_stamps
+            while True:
+                count = samples.drain_into(block, stamps)
+                if not count:
+                    break
+                self._process_heart_rate_block(block[:count], stamps[:count])
+            current_time_ms = self.heart_rate_detector.last_stamp_ms
+
+        dropped = samples.overruns
+        if dropped != self.heart_rate_dropped_samples:
+            log(
+                f"Dropped {dropped - self.heart_rate_dropped_samples} samples, "
+                "processing is falling behind"
             )
-
-        mean_window.append(filtered_sample)
-
-        current_time_ms = time.ticks_ms()
-
-        is_peak = is_sample_peak(
-            filtered_sample,
-            dy - self.last_dy,
-            corrected_mean,
-        )
-
-        if is_peak:
-            # NOTE(Artur): Candidate for a new peak sequence, possibly can
-            # break out of bad PPIs
-            if self.heart_rate_last_peak_ms is not None:
-                self.heart_rate_peak_screen_locations.add(
-                    self.heart_rate_screen_samples.end
-                )
-
-                # We start considering measurements starting from now
-                if not self.heart_rate_first_sane_peak_ms:
-                    self.heart_rate_first_sane_peak_ms = current_time_ms
-
-                time_since_peak_ms = current_time_ms - self.heart_rate_last_peak_ms
-                if MIN_PEAK_INTERVAL_MS < time_since_peak_ms < MAX_PEAK_INTERVAL_MS:
-                    if not self.heart_rate_measuring_start_ms:
-                        self.heart_rate_measuring_start_ms = current_time_ms
-                    self.heart_rate_ppis_ms.append(time_since_peak_ms)
-                    mean_peak = (
-                        sum(self.heart_rate_ppis_ms[-PPI_SIZE:])
-                        / len(self.heart_rate_ppis_ms[-PPI_SIZE:])
-                        if self.heart_rate_ppis_ms
-                        else 0
-                    )
-                    self.heart_rate = int(60000 / mean_peak if mean_peak else 0)
-
-            self.heart_rate_last_peak_ms = current_time_ms
+            self.heart_rate_dropped_samples = dropped
 
         if (
-            time.ticks_diff(current_time_ms, self.heart_rate_last_peak_ms)
+            self.heart_rate_last_peak_ms is not None
+            and time.ticks_diff(current_time_ms, self.heart_rate_last_peak_ms)
             > MAX_NO_PEAK_INTERVAL_MS
         ):
             self.heart_rate_measuring_start_ms = 0
             self.heart_rate_first_sane_peak_ms = 0
             self.heart_rate_ppis_ms = []
+            self.hrv.reset()
             self.heart_rate = 0
 
-        mi = min(self.heart_rate_screen_samples)
-        ma = max(self.heart_rate_screen_samples)
-
-        TIMER_SIZE_Y = CHAR_SIZE_HEIGHT_PX
-        GRAPH_SIZE_Y = DISPLAY_HEIGHT_PX - 1 - TIMER_SIZE_Y
-        prev_x = 0
-        for screen_x in range(len(self.heart_rate_screen_samples)):
-            screen_y = (
-                min_max_scaling(
-                    ma, mi, self.heart_rate_screen_samples.data[screen_x], GRAPH_SIZE_Y
-                )
-                + TIMER_SIZE_Y
+        if self.heart_rate_measuring_start_ms:
+            self.heart_measurement_duration_s = round(
+                time.ticks_diff(current_time_ms, self.heart_rate_measuring_start_ms)
+                / 1000
             )
-            self.display.pixel(screen_x, screen_y, 1)
-            self.display.line(prev_x, self.heart_rate_graph_y, screen_x, screen_y, 1)
-            prev_x, self.heart_rate_graph_y = screen_x, screen_y
 
-        for peak_x in self.heart_rate_peak_screen_locations:
-            self.display.pixel(peak_x, DISPLAY_HEIGHT_PX - 1, 1)
+        self.heart_rate_dirty = True
 
-        screen_mean = (
-            min_max_scaling(ma, mi, corrected_mean, GRAPH_SIZE_Y) + TIMER_SIZE_Y
-        )
-
-        # Show a small dot at the bottom indicating the currently read value
-        self.display.pixel(self.heart_rate_screen_samples.end, DISPLAY_HEIGHT_PX - 1, 1)
+    def _collect_second_core(self):
+        """
+        Take in the peaks and the graph columns the second core found.
+        """
+        core = self.second_core
+        core.check()
+
+        peaks = self.heart_rate_peak_block
+        while True:
+            count = core.peaks.drain_into(peaks)
+            if not count:
+                break
+            for i in range(count):
+                self._on_heart_rate_peak(peaks[i])
+
+        columns = self.heart_rate_column_block
+        while True:
+            # Whole columns only, the rest is still being written
+            waiting = len(core.columns) // COLUMN_FIELDS * COLUMN_FIELDS
+            count = core.columns.drain_into(columns[:waiting])
+            if not count:
+                break
+            for i in range(0, count, COLUMN_FIELDS):
+                self._append_heart_rate_column(
+                    columns[i], columns[i + 1], columns[i + 2] != 0
+                )
 
-        self.display.line(0, screen_mean, SAMPLES_ON_SCREEN_SIZE, screen_mean, 1)
+    def _process_heart_rate_block(self, block, stamps):
+        detector = self.heart_rate_detector
+        samples_per_column = self.heart_rate_samples_per_column
+        filtered = self.heart_rate_block_filtered
+        detector.filter_block(block, filtered)
+
+        # The column in the making lives in locals for the whole block
+        low = self.heart_rate_column_low
+        high = self.heart_rate_column_high
+        count = self.heart_rate_column_count
+        peak = self.heart_rate_column_peak
+
+        for i in range(len(block)):
+            value = filtered[i]
+            peak_ms = detector.pick(value, stamps[i])
+            if peak_ms is not None:
+                # The very first peak has nothing to be compared against
+                if detector.peak_count > 1:
+                    peak = True
+                self._heart_rate_peak_sink(peak_ms)
+
+            if not count:
+                low = high = value
+            elif value < low:
+                low = value
+            elif value > high:
+                high = value
+            count += 1
+            if count == samples_per_column:
+                self._heart_rate_column_sink(low, high, peak)
+                count = 0
+                peak = False
+
+        self.heart_rate_column_low = low
+        self.heart_rate_column_high = high
+        self.heart_rate_column_count = count
+        self.heart_rate_column_peak = peak
+
+    def _append_heart_rate_column(self, low, high, peak):
+        lows = self.heart_rate_screen_lows
+        highs = self.heart_rate_screen_highs
+        if self.heart_rate_fixed_point:
+            # Whole ADC units, the graph has no use for the fraction
+            low >>= FIXED_POINT_FRACTION_BITS
+            high >>= FIXED_POINT_FRACTION_BITS
+        lows.append(low)
+        highs.append(high)
+        self.heart_rate_graph.set_peak(
+            (highs.end - 1) % SAMPLES_ON_SCREEN_SIZE, peak
+        )
 
-        draw_heart_rate_counter(self.display, self.heart_rate)
+    def _on_heart_rate_peak(self, peak_ms):
+        # NOTE(Artur): Candidate for a new peak sequence, possibly can
+        # break out of bad PPIs
+        if self.heart_rate_last_peak_ms is not None:
+            # We start considering measurements starting from now
+            if not self.heart_rate_first_sane_peak_ms:
+                self.heart_rate_first_sane_peak_ms = peak_ms
 
-        if self.heart_rate_measuring_start_ms:
-            # Display how long the measurement has been going
-            self.heart_measurement_duration_s = round(
-                (current_time_ms - self.heart_rate_measuring_start_ms) / 1000
+            time_since_peak_ms = time.ticks_diff(
+                peak_ms, self.heart_rate_last_peak_ms
             )
+            if MIN_PEAK_INTERVAL_MS < time_since_peak_ms < MAX_PEAK_INTERVAL_MS:
+                if not self.heart_rate_measuring_start_ms:
+                    self.heart_rate_measuring_start_ms = peak_ms
+                self.heart_rate_ppis_ms.append(time_since_peak_ms)
+                self.hrv.add(time_since_peak_ms)
+                self.heart_rate = int(self.hrv.bpm())
 
-            t = self.heart_measurement_duration_s
-
-            timer_str = f"{t}s"
-            if t >= 60:
-                m = t // 60
-                s = t % 60
-                timer_str = f"{m}:{s:02}"
-
-            if t >= MIN_MEASUREMENT_TIME_FOR_KUBIOS_S:
-                timer_str += " Ready!"
-
-            self.display.text(timer_str, 0, 0, 1)
+        self.heart_rate_last_peak_ms = peak_ms
 
+    def _clear_heart_rate_screen(self):
+        self.display.fill(0)
+        self.heart_rate_graph.reset()
+        for slot in (
+            self.heart_rate_timer_slot,
+            self.heart_rate_counter_slot,
+            self.heart_rate_rmssd_slot,
+            self.heart_rate_sdnn_slot,
+        ):
+            slot.reset()
         self.display.show()
 
-        self.last_filtered_sample = filtered_sample
-        self.last_dy = dy
+    def _draw_heart_rate_counters(self):
+        display = self.display
+        hrv = self.hrv
+
+        self.heart_rate_counter_slot.draw(
+            display, str(self.heart_rate) if self.heart_rate else ""
+        )
+        self.heart_rate_rmssd_slot.draw(
+            display, f"R{int(hrv.rmssd())}" if hrv.count > 1 else ""
+        )
+        self.heart_rate_sdnn_slot.draw(
+            display, f"S{int(hrv.sdnn())}" if hrv.count > 1 else ""
+        )
 
     def display_heart_rate_analysis(self):
         if self.button_short():
@@ -328,54 +523,30 @@ class Machine(HAL):
             return
 
         self.set_heart_sensor_active(False)
-        self.display.fill(0)
-
-        mean_ppi = (
-            sum(self.heart_rate_ppis_ms) / len(self.heart_rate_ppis_ms)
-            if len(self.heart_rate_ppis_ms) != 0
-            else 0
-        )
 
+        mean_ppi = self.hrv.mean
         mean_hr = 60000 / mean_ppi if mean_ppi != 0 else 0
-
-        self.sdnn = (
-            math.sqrt(
-                sum((ppi - mean_ppi) ** 2 for ppi in self.heart_rate_ppis_ms)
-                / len(self.heart_rate_ppis_ms)
-            )
-            if len(self.heart_rate_ppis_ms) != 0
-            else 0
-        )
-
-        successive_diffs = [
-            self.heart_rate_ppis_ms[i + 1] - self.heart_rate_ppis_ms[i]
-            for i in range(len(self.heart_rate_ppis_ms) - 1)
-        ]
-
-        self.rmssd = (
-            math.sqrt(sum(diff**2 for diff in successive_diffs) / len(successive_diffs))
-            if successive_diffs
-            else 0
+        self.sdnn = self.hrv.sdnn()
+        self.rmssd = self.hrv.rmssd()
+
+        lines = (
+            f"Mean HR: {round(mean_hr)}",
+            f"Mean PPI: {round(mean_ppi)}",
+            f"SDNN: {self.sdnn:.2f}",
+            f"rMSSD: {self.rmssd:.2f}",
+            f"pNN50: {self.hrv.pnn50():.0f}%",
         )
 
-        measurements = OrderedDict(
-            [
-                ("Mean HR", f"{round(mean_hr)}"),
-                ("Mean PPI", f"{round(mean_ppi)}"),
-                ("SDNN", f"{self.sdnn:.2f}"),
-                ("rMSSD", f"{self.rmssd:.2f}"),
-            ]
-        )
-
-        for i, (name, value) in enumerate(measurements.items()):
-            self.display.text(
-                f"{name}: {value}",
-                UI_MARGIN,
-                (CHAR_SIZE_HEIGHT_PX + UI_OPTION_GAP) * i,
-                1,
-            )
+        def draw():
+            for i, line in enumerate(lines):
+                self.display.text(
+                    line,
+                    UI_MARGIN,
+                    (CHAR_SIZE_HEIGHT_PX + UI_OPTION_GAP) * i,
+                    1,
+                )
 
-        self.display.show()
+        self.screens.show(lines, draw)
 
         self.aggregate_data(
             self.heart_rate_ppis_ms,
@@ -404,10 +575,12 @@ class Machine(HAL):
                 self.state(next_state if next_state else self.main_menu)
                 return
 
-            self.display.fill(0)
+            self.screens.show(message, _draw_toast)
+
+        def _draw_toast():
             for i, line in enumerate(lines):
                 self.display.text(line, 0, CHAR_SIZE_HEIGHT_PX * i)
-            self.request_redraw()
+            self.draw_cat()
 
         return _toast_state_machine
 
@@ -533,78 +706,79 @@ class Machine(HAL):
 
     def connecting_wifi(self):
         ssid = secrets["ssid"]
-        if not self.wlan_connecting_ongoing:
-            self.wlan_connecting_ongoing = connect_ap(self.wlan, ssid)
-
-        wlan_status = None
-        try:
-            wlan_status = next(self.wlan_connecting_ongoing)
-        except StopIteration:
-            pass
+        if self.is_first_frame:
+            self.start_wifi_connect(ssid)
+            self.display.fill(0)
+            self.display.text("Connecting...", 0, 0, 1)
+            self.request_redraw()
 
         if self.button():
+            self.wlan_connecting_ongoing = None
             self.state(self.main_menu)
+            return
 
-        text = "Connecting..."
-
-        self.display.fill(0)
-        self.display.text(text, 0, 0, 1)
-        self.request_redraw()
-
-        if wlan_status != STAT_CONNECTING:
-            self.wlan_connecting_ongoing = None
+        # `poll_wifi` checks on the connection once a second
+        wlan_status = self.wlan_status
+        if wlan_status is None or wlan_status == STAT_CONNECTING:
+            return
 
         if wlan_status == STAT_GOT_IP:
             self.state(self.wifi_connected)
-            return
         elif wlan_status == STAT_NO_AP_FOUND:
             self.state(self.toast(f"Couldn't\nconnect to\n{ssid}"))
-            return
         elif wlan_status == STAT_WRONG_PASSWORD:
             self.state(self.toast(f"Wrong password!"))
-            return
-        elif wlan_status == STAT_CONNECTING:
-            text = "Connecting..."
         elif wlan_status == STAT_CONNECT_FAIL:
             self.state(self.toast("Connection\nfailed, check\ncredentials"))
-            return
         else:
-            self.wlan_connecting_ongoing = None
             raise Exception(f"Unhandled WLAN status! {wlan_status}")
 
-        time.sleep(1)
-
-        self.display.text(text, 0, 0, 1)
-        self.request_redraw()
-
     def sync_up(self):
         if not self.is_kubios_ready():
             self.state(self.toast("Kubios not\nset up :c"))
             return
 
-        stored_data = read_data()
-
+        # One entry at a time, whatever the size of the backlog. The queue
+        # sends them at its own pace
         incomplete_entries = 0
-        for entry in stored_data:
-            if (
-                "KUBIOS STATUS" in entry
-                and entry["KUBIOS_STATUS"] == KUBIOS_STATUS_WAITING
-            ):
-                ppis = list(map(int, entry["RAW PPIS"][1:-1].split(", ")))
-                self._send_data_to_kubios(ppis)
-                incomplete_entries += 1
+        for position in range(len(store)):
+            entry = store.entry(position)
+            if entry.get("KUBIOS STATUS") != KUBIOS_STATUS_WAITING:
+                continue
+
+            # Entries converted from the text history still carry their PPIs
+            if "RAW PPIS" in entry:
+                sidecars.write(entry["ID"], entry["RAW PPIS"])
 
-        splash = f"Sent {incomplete_entries}\nincomplete\nentries!\n<3"
+            self.kubios_queue.push(entry["ID"])
+            incomplete_entries += 1
+
+        splash = f"Queued {incomplete_entries}\nincomplete\nentries!\n<3"
 
         self.state(
             self.toast(splash, previous_state=self.misc, next_state=self.main_menu)
         )
 
     def on_receive_kubios_response(self, response: dict):
-        # TODO(Artur): verify the response structure
-        data = kubios_response_to_data(response)
+        # Every device gets every response, only the ones we asked for count
+        request_id = response.get("id")
+        if request_id not in self.kubios_queue:
+            eth_log(f"Dropped Kubios response for {request_id}")
+            return
+
+        try:
+            data = kubios_response_to_data(response)
+        except (AssertionError, KeyError, ValueError):
+            log(f"Kubios could not analyse {request_id}")
+            self.kubios_queue.fail(request_id)
+            return
+
         data["KUBIOS STATUS"] = KUBIOS_STATUS_DONE
         push_data(data)
+        # Only leaves the queue once the result is stored
+        self.kubios_queue.complete(request_id)
+        # The analysis replaces the raw PPIs, like it replaces the entry
+        sidecars.remove(request_id)
 
     def aggregate_data(
         self,
@@ -616,17 +790,16 @@ class Machine(HAL):
         sdnn,
     ):
         """
-        Returns `True` if the data was actually sent. `False` if remained local.
+        Returns `True` if the data was queued for Kubios. `False` if remained local.
         """
 
-        if self.is_kubios_ready():
-            # Data is sent off to kubios and handled asynchronously when
-            # a response is received
-            self._send_data_to_kubios(ppis)
-            return True
+        is_kubios_ready = self.is_kubios_ready()
 
         kubios_status = KUBIOS_STATUS_NOT_APPLICABLE
-        if measurement_duration_s >= MIN_MEASUREMENT_TIME_FOR_KUBIOS_S:
+        if (
+            is_kubios_ready
+            or measurement_duration_s >= MIN_MEASUREMENT_TIME_FOR_KUBIOS_S
+        ):
             kubios_status = KUBIOS_STATUS_WAITING
 
         Y, M, D, H, m, *_ = localtime()
@@ -640,11 +813,17 @@ class Machine(HAL):
             "MEAN PPI": mean_ppi_ms,
             "RMSSD": rmssd,
             "SDNN": sdnn,
-            "RAW PPIS": str(ppis),
+            "RAW PPIS": ppis,
         }
 
         push_data(data)
 
+        if is_kubios_ready:
+            # Sent off to kubios by the queue, the entry is replaced by the
+            # analysis when the response is received
+            self.kubios_queue.push(data["ID"])
+            return True
+
         return False
 
     def wifi_connected(self):
@@ -659,6 +838,6 @@ class Machine(HAL):
 
         self.display.text("Connected!", 0, 0, 1)
         self.display.text(ipv4, 0, CHAR_SIZE_HEIGHT_PX, 1)
+        if not self.connect_mqtt(DEFAULT_MQTT_SERVER_ADDR):
+            self.display.text("No MQTT server", 0, 3 * CHAR_SIZE_HEIGHT_PX, 1)
         self.request_redraw()
-
-        self.connect_mqtt(DEFAULT_MQTT_SERVER_ADDR)
@@ -39,20 +39,39 @@ _UI_LERP_RATE = 0.5
 UI_LERP_RATE = log(_UI_LERP_RATE)
 
 # The sample rate of the heart beat sensor (in Hz)
-SAMPLE_RATE = 15
+SAMPLE_RATE = 250
 # Time difference between each sample taken(in ms)
 TIMESTAMP_DIFFERENCE_SENSOR = 0.004
-# Alpha value for the low pass filter
-ALPHA = 0.7
+# Time constant of the low pass filter, independent of the sample rate
+LOW_PASS_TIME_CONSTANT_MS = 30
 # Samples per pixel
 SAMPLES_PROCESSED_PER_COLLECTED = 3
+# Filter the signal and find the peaks in integers rather than floats, which
+# allocate on every operation
+HEART_FIXED_POINT = True
+# Find the peaks in a band passed signal instead, the sections run in order
+# as `(kind, cutoff in Hz)`. Always in float.
+HEART_BAND_PASS = False
+HEART_BAND_PASS_SECTIONS = (("highpass", 0.5), ("lowpass", 5.0))
+# The band pass threshold is this fraction of the signal envelope, which
+# decays with this time constant
+HEART_ENVELOPE_THRESHOLD = 0.5
+HEART_ENVELOPE_DECAY_MS = 1500
 # Pin number of the heart beat sensor
 PIN_SENSOR = 27
-# Total samples to take in account when calculating heart beat measurements
-# Note: The total samples would be SAMPLE_SIZE * SAMPLES_PER_PIXEL
-SAMPLE_SIZE = 200
-# Last n values taken in consideration when the heart rate is calculated
-MEAN_WINDOW_SIZE = 50
+# The sample buffer holds at least this much before samples get dropped,
+# they are taken out of it in chunks of up to `SAMPLE_DRAIN_MS`
+SAMPLE_BUFFER_MS = 800
+SAMPLE_DRAIN_MS = 100
+# Sample and find the peaks on the second core, the UI core only gets the
+# peaks and the graph columns, through queues of this many
+HEART_SECOND_CORE = False
+SECOND_CORE_PEAKS = 16
+SECOND_CORE_COLUMNS = 32
+# How long the second core sleeps when it has no samples to process
+SECOND_CORE_IDLE_MS = 2
+# How far back the peak threshold looks, in ms
+MEAN_WINDOW_MS = 3000
 PPI_SIZE = 50
 
 # Scaling factor for the next peak
@@ -63,8 +82,16 @@ MAX_NO_PEAK_INTERVAL_MS = 2500
 
 # Samples to display on screen
 SAMPLES_ON_SCREEN_SIZE = DISPLAY_WIDTH_PX - 40
-# The amount of samples to be collected from the ADC
-HEART_SAMPLES_BUFFER_SIZE = 256
+# Columns the live graph advances per second, whatever the sample rate
+SCREEN_SAMPLE_RATE = 25
+# The live graph is redrawn at most this often, however often samples are
+# processed
+HEART_RATE_DISPLAY_FPS = 20
+# Rendered screens kept to be put back instead of drawn again, 1 KiB each
+SCREEN_CACHE_SIZE = 4
+# The measurement timer sits above the live graph
+HEART_RATE_TIMER_SIZE_Y = CHAR_SIZE_HEIGHT_PX
+HEART_RATE_GRAPH_SIZE_Y = DISPLAY_HEIGHT_PX - 1 - HEART_RATE_TIMER_SIZE_Y
 
 UI_CLOCK_HOUR_ARROW_LENGTH_PX = 10
 UI_CLOCK_MINUTE_ARROW_LENGTH_PX = 16
@@ -75,14 +102,46 @@ DEFAULT_MQTT_PORT = 1883
 
 MQTT_TOPIC_KUBIOS_RESPONSE = "kubios-response"
 MQTT_TOPICS = [MQTT_TOPIC_KUBIOS_RESPONSE]
+# Time each frame may spend on MQTT socket work, on top of one packet or
+# chunk that is already being handled
+MQTT_FRAME_BUDGET_MS = 4
+MQTT_KEEPALIVE_S = 60
+MQTT_CONNECT_TIMEOUT_MS = 10000
+MQTT_RECONNECT_MS = 5000
+# Largest inbound message, a Kubios response
+MQTT_INBOX_BYTES = 4096
+# Requests waiting to go out, a long measurement is a few kB
+MQTT_OUTBOX_BYTES = 8192
+
+# How often an ongoing Wi-Fi connection is checked on
+WIFI_POLL_INTERVAL_MS = 1000
+
+# Run on the asyncio tasks in `runtime.py` instead of calling
+# `Machine.execute` in a loop
+USE_ASYNC_RUNTIME = False
+# How often every task of the runtime runs, samples pile up in the block
+# buffer in between, the screen only needs a frame per column of the graph
+RUNTIME_SAMPLES_PERIOD_MS = 50
+RUNTIME_NETWORK_PERIOD_MS = 20
+RUNTIME_UI_PERIOD_MS = 40
+RUNTIME_FLUSH_PERIOD_MS = 2000
 
 # History and data storage constants
 HISTORY_ENTRIES_PER_PAGE = 5
 HISTORY_ENTRY_DATA_SEPARATOR = "\0\0"
 HISTORY_ENTRY_KEY_VALUE_SEPARATOR = "\0"
 HISTORY_DATA_FOLDER = "hr_data"
-HISTORY_DATA_FILENAME = HISTORY_DATA_FOLDER + "/data.txt"
+HISTORY_DATA_FILENAME = HISTORY_DATA_FOLDER + "/data.bin"
+# Text format history from before the binary records, converted on first use
+HISTORY_LEGACY_DATA_FILENAME = HISTORY_DATA_FOLDER + "/data.txt"
+# Offsets of the entries in the history file, so they can be found by position
+HISTORY_INDEX_FILENAME = HISTORY_DATA_FOLDER + "/data.idx"
+# Raw PPIs of every measurement, one file of uint16 per entry ID
+HISTORY_PPI_FOLDER = HISTORY_DATA_FOLDER + "/ppi"
 HISTORY_NUMERIC_FIELDS = ["ID", "MEAN HR", "MEAN PPI", "RMSSD", "SDNN", "SNS", "PNS"]
+# The history file is compacted once replaced entries take up more than the
+# live ones, but never below this size
+HISTORY_COMPACTION_MIN_BYTES = 4096
 
 NO_WIFI_SPLASH_MESSAGE = """
 Hey!
@@ -129,5 +188,18 @@ KUBIOS_STATUS_DONE = "DONE"
 KUBIOS_STATUS_NOT_APPLICABLE = "NOT_APPLICABLE"
 KUBIOS_STATUS_WAITING = "WAITING"
 
+# Entry IDs waiting to be analysed by Kubios, kept across restarts
+KUBIOS_QUEUE_FILENAME = HISTORY_DATA_FOLDER + "/kubios.queue"
+# Requests sent without a response yet
+KUBIOS_MAX_IN_FLIGHT = 2
+# Time between two requests, at most one is sent per frame anyway
+KUBIOS_SEND_INTERVAL_MS = 500
+KUBIOS_RESPONSE_TIMEOUT_MS = 20000
+# Wait before the first retry, doubled with every failed attempt up to the max
+KUBIOS_RETRY_BASE_MS = 2000
+KUBIOS_RETRY_MAX_MS = 5 * 60 * 1000
+# Past this an entry is left WAITING until the next "Sync Up"
+KUBIOS_MAX_ATTEMPTS = 8
+
 # NOTE(Artur): does not account for daylight savings
 ASSUMED_TIMEONE_OFFSET_S = 3 * 60 * 60
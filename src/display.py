@@ -0,0 +1,363 @@
+from constants import (
+    DISPLAY_WIDTH_PX,
+    DISPLAY_HEIGHT_PX,
+    CHAR_SIZE_WIDTH_PX,
+    CHAR_SIZE_HEIGHT_PX,
+    SCREEN_CACHE_SIZE,
+)
+
+# SSD1306 commands to set the column and page window of the next data write
+SSD1306_SET_COL_ADDR = 0x21
+SSD1306_SET_PAGE_ADDR = 0x22
+
+DISPLAY_PAGE_HEIGHT_PX = 8
+DISPLAY_PAGES = DISPLAY_HEIGHT_PX // DISPLAY_PAGE_HEIGHT_PX
+
+
+class DirtyPages:
+    """
+    Column span per 8-pixel-tall SSD1306 page that changed since the last
+    `show_dirty`. A page with `x0 > x1` is clean.
+    """
+
+    def __init__(self, width=DISPLAY_WIDTH_PX, pages=DISPLAY_PAGES):
+        self.width = width
+        self.pages = pages
+        self.x0 = bytearray(pages)
+        self.x1 = bytearray(pages)
+        self.clear()
+
+    def clear(self):
+        for page in range(self.pages):
+            self.x0[page] = 0xFF
+            self.x1[page] = 0
+
+    def is_clean(self):
+        for page in range(self.pages):
+            if self.x0[page] <= self.x1[page]:
+                return False
+        return True
+
+    def mark(self, x0, y0, x1, y1):
+        """
+        Mark the rectangle between the two corners, both inclusive.
+        """
+        if x0 > x1:
+            x0, x1 = x1, x0
+        if y0 > y1:
+            y0, y1 = y1, y0
+        x0 = max(x0, 0)
+        x1 = min(x1, self.width - 1)
+        if x0 > x1 or y1 < 0:
+            return
+        page0 = max(y0, 0) // DISPLAY_PAGE_HEIGHT_PX
+        page1 = min(y1 // DISPLAY_PAGE_HEIGHT_PX, self.pages - 1)
+        for page in range(page0, page1 + 1):
+            if x0 < self.x0[page]:
+                self.x0[page] = x0
+            if x1 > self.x1[page]:
+                self.x1[page] = x1
+
+    def mark_all(self):
+        self.mark(0, 0, self.width - 1, self.pages * DISPLAY_PAGE_HEIGHT_PX - 1)
+
+
+def show_dirty(driver, dirty):
+    """
+    Send only the dirty parts of the framebuffer to the panel and return the
+    number of bytes that went over I2C. Runs of pages that are dirty over the
+    full width are contiguous in the framebuffer and go out as one write.
+    """
+    width = dirty.width
+    buffer = memoryview(driver.buffer)
+    sent = 0
+    page = 0
+    while page < dirty.pages:
+        x0 = dirty.x0[page]
+        x1 = dirty.x1[page]
+        if x0 > x1:
+            page += 1
+            continue
+
+        last_page = page
+        if x0 == 0 and x1 == width - 1:
+            while (
+                last_page + 1 < dirty.pages
+                and dirty.x0[last_page + 1] == 0
+                and dirty.x1[last_page + 1] == width - 1
+            ):
+                last_page += 1
+
+        driver.write_cmd(SSD1306_SET_COL_ADDR)
+        driver.write_cmd(x0)
+        driver.write_cmd(x1)
+        driver.write_cmd(SSD1306_SET_PAGE_ADDR)
+        driver.write_cmd(page)
+        driver.write_cmd(last_page)
+        data = buffer[page * width + x0 : last_page * width + x1 + 1]
+        driver.write_data(data)
+        # Every command is a control byte and the command, data gets one
+        # control byte up front
+        sent += 6 * 2 + 1 + len(data)
+
+        page = last_page + 1
+
+    dirty.clear()
+    return sent
+
+
+class PartialDisplay:
+    """
+    Wraps an `SSD1306_I2C` and remembers which parts of every page the
+    drawing calls touched. `show` then trims those spans down to the bytes
+    that differ from what the panel already has and sends only that, so a
+    screen that redraws everything but changes a few pixels costs a few
+    bytes of I2C.
+
+    Anything not drawn through here (`contrast`, `invert`, ...) is passed
+    straight to the driver. Code that wants to mark areas itself can draw on
+    `driver` and update `dirty` directly.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.buffer = driver.buffer
+        self.width = driver.width
+        self.height = driver.height
+        self.dirty = DirtyPages(driver.width, driver.pages)
+        # What the panel is showing, to drop spans that did not change
+        self.shadow = bytearray(len(driver.buffer))
+        self.bytes_sent = 0
+        self.bytes_sent_total = 0
+        # The panel content is unknown until the first full show
+        self._in_sync = False
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    def fill(self, c):
+        self.driver.fill(c)
+        self.dirty.mark_all()
+
+    def pixel(self, x, y, c=None):
+        if c is None:
+            return self.driver.pixel(x, y)
+        self.driver.pixel(x, y, c)
+        self.dirty.mark(x, y, x, y)
+
+    def hline(self, x, y, w, c):
+        self.driver.hline(x, y, w, c)
+        self.dirty.mark(x, y, x + w - 1, y)
+
+    def vline(self, x, y, h, c):
+        self.driver.vline(x, y, h, c)
+        self.dirty.mark(x, y, x, y + h - 1)
+
+    def line(self, x1, y1, x2, y2, c):
+        self.driver.line(x1, y1, x2, y2, c)
+        self.dirty.mark(x1, y1, x2, y2)
+
+    def rect(self, x, y, w, h, c, f=False):
+        self.driver.rect(x, y, w, h, c, f)
+        self.dirty.mark(x, y, x + w - 1, y + h - 1)
+
+    def fill_rect(self, x, y, w, h, c):
+        self.driver.fill_rect(x, y, w, h, c)
+        self.dirty.mark(x, y, x + w - 1, y + h - 1)
+
+    def text(self, s, x, y, c=1):
+        self.driver.text(s, x, y, c)
+        self.dirty.mark(
+            x, y, x + len(s) * CHAR_SIZE_WIDTH_PX - 1, y + CHAR_SIZE_HEIGHT_PX - 1
+        )
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        self.driver.blit(fbuf, x, y, key, palette)
+        # `FrameBuffer` does not expose its size, sprites that know theirs
+        # get a tight area
+        width = getattr(fbuf, "width", None)
+        height = getattr(fbuf, "height", None)
+        if width is None or height is None:
+            self.dirty.mark_all()
+        else:
+            self.dirty.mark(x, y, x + width - 1, y + height - 1)
+
+    def scroll(self, xstep, ystep):
+        self.driver.scroll(xstep, ystep)
+        self.dirty.mark_all()
+
+    def _trim_to_changes(self):
+        dirty = self.dirty
+        width = dirty.width
+        buffer = self.buffer
+        shadow = self.shadow
+        for page in range(dirty.pages):
+            x0 = dirty.x0[page]
+            x1 = dirty.x1[page]
+            offset = page * width
+            while x0 <= x1 and buffer[offset + x0] == shadow[offset + x0]:
+                x0 += 1
+            while x1 >= x0 and buffer[offset + x1] == shadow[offset + x1]:
+                x1 -= 1
+            if x0 > x1:
+                dirty.x0[page] = 0xFF
+                dirty.x1[page] = 0
+            else:
+                dirty.x0[page] = x0
+                dirty.x1[page] = x1
+
+    def show(self):
+        if self._in_sync:
+            self._trim_to_changes()
+        else:
+            self.dirty.mark_all()
+            self._in_sync = True
+
+        dirty = self.dirty
+        width = dirty.width
+        buffer = memoryview(self.buffer)
+        shadow = memoryview(self.shadow)
+        for page in range(dirty.pages):
+            x0 = dirty.x0[page]
+            x1 = dirty.x1[page]
+            if x0 <= x1:
+                shadow[page * width + x0 : page * width + x1 + 1] = buffer[
+                    page * width + x0 : page * width + x1 + 1
+                ]
+
+        self.bytes_sent = show_dirty(self.driver, dirty)
+        self.bytes_sent_total += self.bytes_sent
+
+    def show_all(self):
+        """
+        Resend the whole framebuffer, for when the panel may be out of sync.
+        """
+        self._in_sync = False
+        self.show()
+
+
+class TextSlot:
+    """
+    A fixed spot for a short line of text that is only redrawn when the
+    text actually changes.
+    """
+
+    def __init__(self, x, y, chars):
+        self.x = x
+        self.y = y
+        self.chars = chars
+        self.width = chars * CHAR_SIZE_WIDTH_PX
+        self.text = None
+
+    def reset(self):
+        self.text = None
+
+    def draw(self, display, text):
+        if text == self.text:
+            return
+        self.text = text
+        display.fill_rect(self.x, self.y, self.width, CHAR_SIZE_HEIGHT_PX, 0)
+        display.text(text[: self.chars], self.x, self.y, 1)
+
+
+class Layer:
+    """
+    A small area drawn over a cached screen every frame, i.e. an animation.
+    `draw` is called with the display and only draws inside the area.
+    """
+
+    def __init__(self, x, y, width, height, draw):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.draw = draw
+
+
+class ScreenCache:
+    """
+    Screens that have been drawn before, kept as copies of the framebuffer
+    and keyed on whatever they were drawn from, i.e. the state and the text
+    on them.
+
+    `show` only draws a screen the first time its key is seen, after that
+    the copy is put back instead, and while the same key stays on the
+    display nothing is drawn or sent at all. Only the `layers` passed along
+    are drawn every frame, each over a clean copy of the screen below it.
+
+    At most `screens` screens are kept, the least recently shown goes
+    first. Anything that draws on the display without going through here
+    has to call `invalidate`, `HAL.state` does so on every state change.
+    """
+
+    def __init__(self, display, screens=SCREEN_CACHE_SIZE):
+        self.display = display
+        self.screens = screens
+        # Least recently shown first
+        self.keys = []
+        self.frames = {}
+        self.shown = None
+
+    def invalidate(self):
+        """
+        The display no longer shows what was last put there.
+        """
+        self.shown = None
+
+    def clear(self):
+        self.keys = []
+        self.frames = {}
+        self.shown = None
+
+    def _store(self, key):
+        if len(self.keys) >= self.screens:
+            # Reuse the buffer of the screen that goes
+            frame = self.frames.pop(self.keys.pop(0))
+            frame[:] = self.display.buffer
+        else:
+            frame = bytearray(self.display.buffer)
+        self.keys.append(key)
+        self.frames[key] = frame
+        return frame
+
+    def _restore(self, frame, x, y, width, height):
+        display = self.display
+        x0 = max(x, 0)
+        x1 = min(x + width, display.width)
+        page0 = max(y, 0) // DISPLAY_PAGE_HEIGHT_PX
+        page1 = min(y + height - 1, display.height - 1) // DISPLAY_PAGE_HEIGHT_PX
+        if x0 >= x1 or page0 > page1:
+            return
+        buffer = memoryview(display.buffer)
+        frame = memoryview(frame)
+        for page in range(page0, page1 + 1):
+            offset = page * display.width
+            buffer[offset + x0 : offset + x1] = frame[offset + x0 : offset + x1]
+        display.dirty.mark(x0, page0 * DISPLAY_PAGE_HEIGHT_PX, x1 - 1, y + height - 1)
+
+    def show(self, key, render, layers=()):
+        """
+        Put the screen for `key` on the display, calling `render` to draw it
+        if it is not cached, and draw `layers` over it.
+        """
+        display = self.display
+        if key != self.shown:
+            frame = self.frames.get(key)
+            if frame is None:
+                display.fill(0)
+                render()
+                frame = self._store(key)
+            else:
+                self.keys.remove(key)
+                self.keys.append(key)
+                display.buffer[:] = frame
+                display.dirty.mark_all()
+            self.shown = key
+        elif not layers:
+            return
+
+        frame = self.frames[key]
+        for layer in layers:
+            self._restore(frame, layer.x, layer.y, layer.width, layer.height)
+            layer.draw(display)
+        display.show()
@@ -0,0 +1,200 @@
+from array import array
+from heart import min_max_scaling
+
+# When the data leaves the plotted range, the range is widened by this
+# fraction of its size so the next few samples do not rescale it again
+GRAPH_RESCALE_HEADROOM = 0.125
+
+
+class GraphRenderer:
+    """
+    Sweeping plot of the envelope of a signal, kept as the lowest and the
+    highest sample of every pixel column in two `RunningStatsRingbuffer`s
+    that advance together. Every column is a vertical span from one to the
+    other, stretched to meet the span before it so the trace has no gaps
+    however steep it is.
+
+    Only the columns whose samples changed since the last `plot` are erased
+    and redrawn. The vertical range only changes when the data no longer
+    fits in it (or uses less than half of it), which is the only case that
+    needs a full redraw.
+
+    Drawing goes straight to the driver of a `PartialDisplay` and the
+    renderer marks what it changed itself, a line that is redrawn after being
+    partially erased would otherwise dirty its whole bounding box.
+    """
+
+    def __init__(self, display, width, top, height):
+        self.display = display.driver
+        self.dirty = display.dirty
+        self.width = width
+        self.top = top
+        self.height = height
+        self.bottom = top + height
+
+        # Screen rows of the highest and the lowest sample of every column
+        self.tops = array("B", bytes(width))
+        self.bottoms = array("B", bytes(width))
+        self.peaks = bytearray(width)
+        self.reset()
+
+    def reset(self):
+        self.lo = 0
+        self.hi = 0
+        self.mean_y = -1
+        self.cursor = 0
+        for x in range(self.width):
+            self.peaks[x] = 0
+        self._needs_full_redraw = True
+
+    def _y(self, value):
+        return self.top + min_max_scaling(self.hi, self.lo, value, self.height)
+
+    def _rescale_if_needed(self, lo, hi):
+        shown = self.hi - self.lo
+        if self.lo <= lo and hi <= self.hi and (hi - lo) * 2 > shown:
+            return False
+
+        headroom = (hi - lo) * GRAPH_RESCALE_HEADROOM
+        self.lo = lo - headroom if lo < self.lo else lo
+        self.hi = hi + headroom if hi > self.hi else hi
+        if self.hi == self.lo:
+            self.hi += 1
+        return True
+
+    def _span(self, x):
+        """
+        The rows column `x` covers, down to where the column before it
+        starts or up to where it ends.
+        """
+        top = self.tops[x]
+        bottom = self.bottoms[x]
+        # Column -1 is the last one, the sweep wraps around
+        before_top = self.tops[x - 1]
+        before_bottom = self.bottoms[x - 1]
+        return min(top, before_bottom), max(bottom, before_top)
+
+    def _segment(self, x):
+        """
+        Draw the span of column `x`.
+        """
+        top, bottom = self._span(x)
+        self.display.vline(x, top, bottom - top + 1, 1)
+
+    def _set_column(self, x, lows, highs):
+        self.tops[x] = self._y(highs.data[x])
+        self.bottoms[x] = self._y(lows.data[x])
+
+    def _decorate(self, x):
+        """
+        Mean line, peak marker and cursor pixels of column `x`.
+        """
+        if self.top <= self.mean_y <= self.bottom:
+            self.display.pixel(x, self.mean_y, 1)
+        if self.peaks[x] or x == self.cursor:
+            self.display.pixel(x, self.bottom, 1)
+
+    def _mean_y(self, mean):
+        y = self._y(mean)
+        return y if self.top <= y <= self.bottom else -1
+
+    def _redraw_all(self, lows, highs, mean):
+        display = self.display
+        display.fill_rect(0, self.top, self.width + 1, self.height + 1, 0)
+
+        for x in range(self.width):
+            self._set_column(x, lows, highs)
+        for x in range(self.width):
+            self._segment(x)
+
+        self.mean_y = self._mean_y(mean)
+        if self.mean_y >= 0:
+            display.hline(0, self.mean_y, self.width + 1, 1)
+        for x in range(self.width):
+            self._decorate(x)
+
+        self.dirty.mark(0, self.top, self.width, self.bottom)
+
+    def _move_mean(self, mean_y):
+        display = self.display
+        old_y = self.mean_y
+        self.mean_y = mean_y
+
+        if old_y >= 0:
+            display.hline(0, old_y, self.width + 1, 0)
+            # Put back whatever the old line was covering
+            for x in range(self.width):
+                top, bottom = self._span(x)
+                if top <= old_y <= bottom:
+                    self._segment(x)
+            if old_y == self.bottom:
+                for x in range(self.width):
+                    self._decorate(x)
+            self.dirty.mark(0, old_y, self.width, old_y)
+
+        if mean_y >= 0:
+            display.hline(0, mean_y, self.width + 1, 1)
+            self.dirty.mark(0, mean_y, self.width, mean_y)
+
+    def _redraw_columns(self, lows, highs, first, count):
+        """
+        Redraw `count` columns with new samples starting from `first`,
+        wrapping around.
+        """
+        display = self.display
+        width = self.width
+
+        for i in range(count):
+            self._set_column((first + i) % width, lows, highs)
+
+        # Every span reaches for the one before it, so the column after the
+        # new samples changes too
+        start = first
+        columns = count + 1
+        for i in range(columns):
+            display.vline((start + i) % width, self.top, self.height + 1, 0)
+        for i in range(columns):
+            self._segment((start + i) % width)
+        for i in range(columns):
+            self._decorate((start + i) % width)
+
+        end = (start + columns - 1) % width
+        if end >= start:
+            self.dirty.mark(start, self.top, end, self.bottom)
+        else:
+            self.dirty.mark(start, self.top, width - 1, self.bottom)
+            self.dirty.mark(0, self.top, end, self.bottom)
+
+    def plot(self, lows, highs, mean):
+        """
+        Bring the plot up to date with the column envelopes `lows` and
+        `highs`, the line at `mean` is the detection threshold.
+        """
+        width = self.width
+        cursor = highs.end
+        fresh = (cursor - self.cursor) % width
+
+        if self._rescale_if_needed(lows.min(), highs.max()):
+            self._needs_full_redraw = True
+
+        if self._needs_full_redraw or fresh >= width - 1:
+            self.cursor = cursor
+            self._needs_full_redraw = False
+            self._redraw_all(lows, highs, mean)
+            return
+
+        mean_y = self._mean_y(mean)
+        if mean_y != self.mean_y:
+            self._move_mean(mean_y)
+
+        if fresh:
+            old_cursor = self.cursor
+            self.cursor = cursor
+            self._redraw_columns(lows, highs, old_cursor, fresh)
+
+    def set_peak(self, x, is_peak):
+        """
+        Flag whether the samples of column `x` have a peak, drawn with the
+        column on the next `plot`.
+        """
+        self.peaks[x] = is_peak
@@ -1,6 +1,6 @@
 import json
 from machine import Pin, I2C, ADC
-from time import ticks_ms
+from time import ticks_ms, ticks_add, ticks_diff
 from gc import collect as gc_collect
 from constants import (
     ROTARY_BUTTON_DEBOUNCE_MS,
@@ -21,13 +21,52 @@ from constants import (
     DEFAULT_MQTT_PORT,
     MQTT_TOPICS,
     MQTT_TOPIC_KUBIOS_RESPONSE,
+    MQTT_FRAME_BUDGET_MS,
+    MQTT_KEEPALIVE_S,
+    MQTT_CONNECT_TIMEOUT_MS,
+    MQTT_RECONNECT_MS,
+    MQTT_INBOX_BYTES,
+    MQTT_OUTBOX_BYTES,
+    WIFI_POLL_INTERVAL_MS,
 )
 import ssd1306
 import os
 from utils import hash_int_list
-from wifi import make_wlan
+from wifi import make_wlan, connect_ap
+from network import STAT_CONNECTING, STAT_CONNECT_FAIL
 from logging import log, eth_log
-from umqtt.simple import MQTTClient
+from display import PartialDisplay, ScreenCache
+from kubios import KubiosQueue
+from net.mqtt import MQTTClient, resolve
+
+
+# `{"id": ..., "type": "RRI", "data": [...], "analysis": {"type": "readiness"}}`
+KUBIOS_REQUEST_HEAD = b'{"id": '
+KUBIOS_REQUEST_DATA = b', "type": "RRI", "data": ['
+KUBIOS_REQUEST_TAIL = b'], "analysis": {"type": "readiness"}}'
+
+
+def _put_bytes(out, offset, data):
+    end = offset + len(data)
+    out[offset:end] = data
+    return end
+
+
+def _put_int(out, offset, value):
+    """
+    Write the digits of the non-negative `value` at `offset` without
+    building a string.
+    """
+    end = offset + 1
+    rest = value // 10
+    while rest:
+        end += 1
+        rest //= 10
+
+    for position in range(end - 1, offset - 1, -1):
+        out[position] = 0x30 + value % 10
+        value //= 10
+    return end
 
 
 # Hardware abstraction layer over the Pico W
@@ -51,7 +90,10 @@ class HAL:
         self.rotary_motion_queue = 0
 
         self.i2c = I2C(1, sda=Pin(PIN_I2C_DATA), scl=Pin(PIN_I2C_CLOCK))
-        self.display = ssd1306.SSD1306_I2C(128, 64, self.i2c)
+        self.display = PartialDisplay(
+            ssd1306.SSD1306_I2C(DISPLAY_WIDTH_PX, DISPLAY_HEIGHT_PX, self.i2c)
+        )
+        self.screens = ScreenCache(self.display)
 
         self.button_pressed_timer_running = False
         self.button_pressed_timer = 0
@@ -66,8 +108,15 @@ class HAL:
         self.is_display_flipped = False
 
         self.wlan = make_wlan()
+        self.wlan_connecting_ongoing = None
+        self.wlan_status = None
+        self.wlan_next_poll_ms = 0
         self.mqtt_client = None
         self.mqtt_client_id = None
+        self._kubios_request_buffer = bytearray()
+        self.kubios_queue = KubiosQueue(self._send_data_to_kubios)
+
+        self.flush_pending = False
 
     def _rotary_knob_press(self, _):
         if self.rotary_debounce_timer_ms + ROTARY_BUTTON_DEBOUNCE_MS >= ticks_ms():
@@ -142,7 +191,9 @@ class HAL:
             if self._state is new_state:
                 return
             gc_collect()
-            self.flush_files()
+            self.flush_pending = True
+            # Whatever the new state draws goes over the cached screen
+            self.screens.invalidate()
             self.onboard_led.toggle()
 
             self._state_args = args
@@ -183,13 +234,66 @@ class HAL:
             return True
         return False
 
-    def execute(self):
+    def start_wifi_connect(self, ssid):
         """
-        Run the current state once and update the display.
+        Start connecting to `ssid`, `poll_wifi` moves it along and keeps
+        `wlan_status` up to date.
         """
+        self.wlan_connecting_ongoing = connect_ap(self.wlan, ssid)
+        self.wlan_status = None
+        self.wlan_next_poll_ms = ticks_ms()
+
+    def poll_wifi(self):
+        if not self.wlan_connecting_ongoing:
+            return
+        now_ms = ticks_ms()
+        if ticks_diff(now_ms, self.wlan_next_poll_ms) < 0:
+            return
+        self.wlan_next_poll_ms = ticks_add(now_ms, WIFI_POLL_INTERVAL_MS)
+
+        try:
+            self.wlan_status = next(self.wlan_connecting_ongoing)
+        except StopIteration as e:
+            # Out of tries
+            self.wlan_status = e.value
+            if self.wlan_status in (None, STAT_CONNECTING):
+                self.wlan_status = STAT_CONNECT_FAIL
+
+        if self.wlan_status != STAT_CONNECTING:
+            self.wlan_connecting_ongoing = None
+
+    def poll_network(self):
         if self.mqtt_client:
-            self.mqtt_client.check_msg()
+            self.mqtt_client.poll(MQTT_FRAME_BUDGET_MS)
+            if self.mqtt_client.connected:
+                self.kubios_queue.tick()
 
+    def process_samples(self):
+        """
+        Handle whatever the sensors collected since the last call, separate
+        from drawing it so the two can run at different rates.
+        """
+
+    def flush_if_needed(self):
+        if self.flush_pending:
+            self.flush_pending = False
+            self.flush_files()
+
+    def execute(self):
+        """
+        Run everything once: network, sensors, the current state and the
+        file flush. `runtime` runs the same parts as separate tasks instead.
+        """
+        self.poll_network()
+        self.poll_wifi()
+        self.process_samples()
+        self.run_state()
+        self.flush_if_needed()
+
+    def run_state(self):
+        """
+        Run the current state once and update the display.
+        """
         if ticks_ms() - self.rotary_reset_timer_ms > ROTARY_ROTATION_RESET_TIMEOUT_MS:
             if self.rotary_accumulator:
                 self.rotary_accumulator = 0
@@ -216,6 +320,10 @@ class HAL:
         return wrapper
 
     def request_redraw(self):
+        self.draw_cat()
+        self.display.show()
+
+    def draw_cat(self):
         # TODO: just for testing purposes
         # this is where the cat will be
         self.display.fill_rect(
@@ -226,8 +334,6 @@ class HAL:
             1,
         )
 
-        self.display.show()
-
     def invert_display(self):
         self.is_display_inverted = not self.is_display_inverted
         self.display.invert(self.is_display_inverted)
@@ -238,17 +344,36 @@ class HAL:
         # Micropython-specific function
         os.sync()  # type: ignore
 
-    def _send_data_to_kubios(self, ppis: list[int]):
-        generated_id = hash_int_list(ppis)
-
-        payload = {
-            "id": generated_id,
-            "type": "RRI",
-            "data": ppis,
-            "analysis": {"type": "readiness"},
-        }
-
-        self.mqtt_client.publish("kubios-request", json.dumps(payload))
+    def _kubios_request(self, request_id: int, ppis):
+        """
+        The Kubios request for `ppis` as JSON, written into a buffer that is
+        kept between requests. `ppis` can be any sequence of ints, a view of
+        a PPI sidecar is never copied into a list.
+        """
+        # Every PPI takes at most 5 digits and a separator
+        size = len(KUBIOS_REQUEST_HEAD) + 10 + len(KUBIOS_REQUEST_DATA)
+        size += len(ppis) * 7 + len(KUBIOS_REQUEST_TAIL)
+        if len(self._kubios_request_buffer) < size:
+            self._kubios_request_buffer = bytearray(size)
+        out = self._kubios_request_buffer
+
+        end = _put_bytes(out, 0, KUBIOS_REQUEST_HEAD)
+        end = _put_int(out, end, request_id)
+        end = _put_bytes(out, end, KUBIOS_REQUEST_DATA)
+        for i in range(len(ppis)):
+            if i:
+                end = _put_bytes(out, end, b", ")
+            end = _put_int(out, end, ppis[i])
+        end = _put_bytes(out, end, KUBIOS_REQUEST_TAIL)
+        return memoryview(out)[:end]
+
+    def _send_data_to_kubios(self, ppis, request_id=None):
+        if request_id is None:
+            request_id = hash_int_list(ppis)
+
+        self.mqtt_client.publish(
+            "kubios-request", self._kubios_request(request_id, ppis)
+        )
 
     def on_receive_kubios_response(self, response):
         eth_log(f"HAL.on_receive_kubios_response not overriden. Response: {response}")
@@ -265,20 +390,42 @@ class HAL:
             eth_log(f"Dropped MQTT Message for topic {topic}: {content}")
 
     def connect_mqtt(self, server: str, port: int = DEFAULT_MQTT_PORT):
+        """
+        Returns `False` if `server` could not be resolved, there is no MQTT
+        client then.
+        """
         self.mqtt_client_id = self.wlan.config("mac").hex()
 
         log(f"Connecting to an MQTT Server {server}:{port}")
 
-        self.mqtt_client = MQTTClient(self.mqtt_client_id, server, port)
-        self.mqtt_client.set_callback(self.receive_mqtt_message)
-        self.mqtt_client.connect()
+        if self.mqtt_client:
+            self.mqtt_client.disconnect()
+            self.mqtt_client = None
 
+        # The one blocking lookup, right after Wi-Fi connects, so the client
+        # never has to do it in the middle of a measurement
+        try:
+            address = resolve(server, port)
+        except OSError as e:
+            log(f"Could not resolve the MQTT server {server}: {e}")
+            return False
+
+        # Only starts connecting, `execute` does the rest a bit every frame
+        self.mqtt_client = MQTTClient(
+            self.mqtt_client_id,
+            server,
+            address,
+            MQTT_KEEPALIVE_S,
+            MQTT_INBOX_BYTES,
+            MQTT_OUTBOX_BYTES,
+            MQTT_CONNECT_TIMEOUT_MS,
+            MQTT_RECONNECT_MS,
+        )
+        self.mqtt_client.set_callback(self.receive_mqtt_message)
         for topic in MQTT_TOPICS + [self.mqtt_client_id]:
             self.mqtt_client.subscribe(topic)
-
-        log(
-            f"Connected to an MQTT Server! Hello! I am MQTT Client {self.mqtt_client_id}"
-        )
+        self.mqtt_client.connect()
+        return True
 
     def is_kubios_ready(self) -> bool:
         return self.mqtt_client != None
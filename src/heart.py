@@ -1,17 +1,52 @@
+from biquad import BiquadCascade
 from constants import (
-    ALPHA,
     DISPLAY_HEIGHT_PX,
+    HEART_BAND_PASS_SECTIONS,
+    HEART_ENVELOPE_DECAY_MS,
+    HEART_ENVELOPE_THRESHOLD,
+    LOW_PASS_TIME_CONSTANT_MS,
+    MEAN_WINDOW_MS,
     MEAN_WINDOW_PERCENT,
     MIN_PEAK_INTERVAL_MS,
     MAX_PEAK_INTERVAL_MS,
     PPI_SIZE,
-    SAMPLES_ON_SCREEN_SIZE,
+    SAMPLE_RATE,
 )
+from math import exp
+from ringbuffer import RunningStatsRingbuffer
 import time
 
+# Bits below the ADC unit kept by the fixed point filter, with 16 bit
+# samples the filter state stays under 26 bits
+FIXED_POINT_FRACTION_BITS = 10
+# The filter coefficient gets this many significant bits
+FIXED_POINT_BETA_BITS = 16
+# Differences are multiplied with the coefficient in two parts of at most
+# 13 bits each, so neither product goes past the 31 bits of a MicroPython
+# small int
+FIXED_POINT_SPLIT_BITS = 13
+# `MEAN_WINDOW_PERCENT` with this many fraction bits
+FIXED_POINT_PERCENT_BITS = 12
 
-def low_pass_filter(previous_value: float, next_value: float):
-    return ALPHA * previous_value + (1 - ALPHA) * next_value
+
+def low_pass_alpha(sample_rate):
+    """
+    Smoothing factor of a one-pole low pass filter with a time constant of
+    `LOW_PASS_TIME_CONSTANT_MS` at `sample_rate`.
+    """
+    return exp(-1000 / (sample_rate * LOW_PASS_TIME_CONSTANT_MS))
+
+
+def low_pass_fixed_point(sample_rate):
+    """
+    `1 - low_pass_alpha(sample_rate)` as `(numerator, shift)`, with the
+    numerator just under `FIXED_POINT_BETA_BITS` bits.
+    """
+    beta = 1 - low_pass_alpha(sample_rate)
+    shift = FIXED_POINT_SPLIT_BITS + 1
+    while round(beta * (1 << (shift + 1))) < 1 << FIXED_POINT_BETA_BITS:
+        shift += 1
+    return round(beta * (1 << shift)), shift
 
 
 def min_max_scaling(
@@ -24,37 +59,314 @@ def min_max_scaling(
     )
 
 
-def compute_corrected_mean(mean_window, mean):
+def compute_corrected_mean(min_window, mean):
     if mean == 0:
         return 0
 
-    min_window = min(mean_window)
-    max_window = max(mean_window)
     return MEAN_WINDOW_PERCENT * (mean - min_window) + min_window
 
 
-# obj for last_peak_ms
-def is_sample_peak(
-    sample: float,
-    ddy: float,
-    corrected_mean: float,
-):
-    return ddy < 0 and sample > corrected_mean
+class PeakDetector:
+    """
+    Finds the heart beats in the raw sensor signal, one sample at a time.
+
+    The signal is low pass filtered and compared against a threshold made
+    from the mean and the minimum of the last `MEAN_WINDOW_MS`. The peak is
+    the highest sample of every stretch above the threshold, reported once
+    the signal drops back below it. Stretches starting sooner than
+    `MIN_PEAK_INTERVAL_MS` after a peak are the dicrotic notch of the same
+    beat and are skipped.
+
+    Every sample comes with the tick it was acquired at and peaks are timed
+    with those, so neither slow frames nor dropped samples shift them. The
+    tick is refined to the vertex of a parabola through the highest sample
+    and its two neighbours, so the PPIs are not whole sample periods, which
+    at a low sample rate would swamp the variability they are used for.
+
+    `add` filters one sample and looks for a peak in it. A block of samples
+    can be filtered at once with `filter_block` and then handed to `pick`
+    one by one, which finds the same peaks.
+    """
+
+    # Of the threshold window, and of whatever keeps `filtered` around
+    typecode = "f"
+    # Of the buffers `filter_block` fills
+    block_typecode = "d"
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.alpha = low_pass_alpha(sample_rate)
+        self.window = RunningStatsRingbuffer(
+            max(1, sample_rate * MEAN_WINDOW_MS // 1000), self.typecode
+        )
+        self.reset()
+
+    def reset(self):
+        self.window.clear()
+        # Nothing filtered yet
+        self._level = None
+        self._reset_peaks()
+
+    def _reset_peaks(self):
+        self.sample_count = 0
+        self.last_stamp_ms = 0
+        self.filtered = 0.0
+        self.threshold = 0.0
+        self._above_threshold = False
+        self._peak_value = 0.0
+        self._peak_ms = 0
+        # The neighbours of the peak, for `_refine_peak`
+        self._before_peak = 0.0
+        self._before_peak_ms = 0
+        self._after_peak = 0.0
+        self._after_peak_ms = 0
+        self._peak_is_last = False
+        self._last_peak_ms = None
+        # Peaks reported since the last reset
+        self.peak_count = 0
+
+    def filter(self, value):
+        """
+        Low pass `value`, the next raw sample.
+        """
+        level = self._level
+        if level is None:
+            # Start from the signal level rather than ramping up from zero
+            level = float(value)
+        else:
+            level = self.alpha * level + (1 - self.alpha) * value
+        self._level = level
+        return level
+
+    def filter_block(self, values, out):
+        """
+        `filter` every one of `values` into `out`.
+        """
+        for i in range(len(values)):
+            out[i] = self.filter(values[i])
+
+    def _update_threshold(self, filtered, index):
+        window = self.window
+        if not index:
+            for _ in range(window.size):
+                window.append(filtered)
+        self.threshold = compute_corrected_mean(window.min(), window.mean())
+        window.append(filtered)
+
+    def add(self, value, stamp_ms):
+        """
+        Process the next sample, acquired at tick `stamp_ms`. Returns the
+        tick of the peak that just ended, or `None`.
+        """
+        return self.pick(self.filter(value), stamp_ms)
+
+    def pick(self, filtered, stamp_ms):
+        """
+        `add` for a sample that has already been through `filter`.
+        """
+        index = self.sample_count
+        self.sample_count = index + 1
+        if index:
+            previous = self.filtered
+            previous_ms = self.last_stamp_ms
+        else:
+            previous = filtered
+            previous_ms = stamp_ms
+        self.last_stamp_ms = stamp_ms
+        self.filtered = filtered
+
+        if self._peak_is_last:
+            self._after_peak = filtered
+            self._after_peak_ms = stamp_ms
+            self._peak_is_last = False
+
+        self._update_threshold(filtered, index)
+        threshold = self.threshold
+
+        if filtered > threshold:
+            if not self._above_threshold:
+                if (
+                    self._last_peak_ms is not None
+                    and time.ticks_diff(stamp_ms, self._last_peak_ms)
+                    < MIN_PEAK_INTERVAL_MS
+                ):
+                    return None
+                new_peak = True
+            else:
+                new_peak = filtered > self._peak_value
+            if new_peak:
+                self._peak_value = filtered
+                self._peak_ms = stamp_ms
+                self._before_peak = previous
+                self._before_peak_ms = previous_ms
+                self._peak_is_last = True
+            self._above_threshold = True
+            return None
+
+        if self._above_threshold:
+            self._above_threshold = False
+            peak_ms = self._refine_peak()
+            self._last_peak_ms = peak_ms
+            self.peak_count += 1
+            return peak_ms
+        return None
+
+    def _refine_peak(self):
+        """
+        The tick of the vertex of the parabola through the peak and the
+        samples either side of it, which is never more than half a sample
+        period away from the peak sample.
+        """
+        peak = self._peak_value
+        before = self._before_peak
+        after = self._after_peak
+        curvature = 2 * peak - before - after
+        # The very first sample has nothing before it
+        if curvature <= 0 or self._before_peak_ms == self._peak_ms:
+            return self._peak_ms
+        # Two sample periods
+        span_ms = time.ticks_diff(self._after_peak_ms, self._before_peak_ms)
+        return time.ticks_add(
+            self._peak_ms, round(span_ms * (after - before) / (4 * curvature))
+        )
+
+
+class FixedPointPeakDetector(PeakDetector):
+    """
+    `PeakDetector` on integers only, so no sample allocates a float.
+
+    `filtered` and `threshold` are in ADC units with
+    `FIXED_POINT_FRACTION_BITS` fraction bits. The threshold window holds
+    whole ADC units so its sum stays a small int however long it is.
+    Nothing ever goes past 31 bits, so the host computes exactly what the
+    device does, and `sim.offline --check` checks that the peaks are the
+    ones `PeakDetector` finds, to within the millisecond their refined
+    ticks are rounded to.
+    """
+
+    typecode = "i"
+    block_typecode = "i"
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.beta, self.beta_shift = low_pass_fixed_point(sample_rate)
+        self.percent = round(MEAN_WINDOW_PERCENT * (1 << FIXED_POINT_PERCENT_BITS))
+        super().__init__(sample_rate)
+
+    def _reset_peaks(self):
+        super()._reset_peaks()
+        self.filtered = 0
+        self.threshold = 0
+        self._peak_value = 0
+        self._before_peak = 0
+        self._after_peak = 0
+
+    def _refine_peak(self):
+        peak = self._peak_value
+        slope = self._after_peak - self._before_peak
+        curvature = 2 * peak - self._before_peak - self._after_peak
+        if curvature <= 0 or self._before_peak_ms == self._peak_ms:
+            return self._peak_ms
+        span_ms = time.ticks_diff(self._after_peak_ms, self._before_peak_ms)
+        # The slope is never steeper than the curvature, with both scaled
+        # down until `span_ms` times either fits in 27 bits the rounding
+        # below stays in small ints
+        limit = (1 << 27) // span_ms
+        while curvature >= limit:
+            curvature >>= 1
+            slope >>= 1
+        # `round(span_ms * slope / (4 * curvature))`
+        return time.ticks_add(
+            self._peak_ms,
+            (span_ms * slope * 2 + 4 * curvature) // (8 * curvature),
+        )
+
+    def filter(self, value):
+        level = self._level
+        if level is None:
+            level = value << FIXED_POINT_FRACTION_BITS
+        else:
+            beta = self.beta
+            shift = self.beta_shift
+            # `(difference * beta + half) >> shift`, exactly
+            difference = (value << FIXED_POINT_FRACTION_BITS) - level
+            low = difference & ((1 << FIXED_POINT_SPLIT_BITS) - 1)
+            high = difference >> FIXED_POINT_SPLIT_BITS
+            level += (
+                high * beta
+                + (1 << (shift - 1 - FIXED_POINT_SPLIT_BITS))
+                + (low * beta >> FIXED_POINT_SPLIT_BITS)
+            ) >> (shift - FIXED_POINT_SPLIT_BITS)
+        self._level = level
+        return level
+
+    def _update_threshold(self, filtered, index):
+        window = self.window
+        # Whole ADC units, the first sample has no fraction to round
+        value = (
+            filtered + (1 << FIXED_POINT_FRACTION_BITS >> 1)
+        ) >> FIXED_POINT_FRACTION_BITS
+        if not index:
+            for _ in range(window.size):
+                window.append(value)
+
+        mean = window.total // window.size
+        if mean:
+            low = window.min()
+            self.threshold = (
+                low
+                + ((mean - low) * self.percent >> FIXED_POINT_PERCENT_BITS)
+            ) << FIXED_POINT_FRACTION_BITS
+        else:
+            self.threshold = 0
+        window.append(value)
+
+
+class BandPassPeakDetector(PeakDetector):
+    """
+    `PeakDetector` on a band passed signal, through the biquad sections of
+    `HEART_BAND_PASS_SECTIONS`.
+
+    The high pass takes out the baseline and its wander, so the beats swing
+    around zero and the threshold needs no window of the signal. It is
+    `HEART_ENVELOPE_THRESHOLD` of an envelope that jumps to every new
+    maximum and decays with a time constant of `HEART_ENVELOPE_DECAY_MS`,
+    two numbers per sample instead of a running minimum and mean.
+
+    The sections are in float, near DC they need more precision than a
+    MicroPython small int has room for.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.cascade = BiquadCascade(sample_rate, HEART_BAND_PASS_SECTIONS)
+        self.decay = exp(-1000 / (sample_rate * HEART_ENVELOPE_DECAY_MS))
+        self.reset()
+
+    def reset(self):
+        self._primed = False
+        self.envelope = 0.0
+        self._reset_peaks()
 
+    def _prime(self, value):
+        # Settle on the first sample instead of ringing from zero up to it
+        self.cascade.reset(value)
+        self._primed = True
 
-def draw_graph(display, samples_on_screen, prev_y):
-    max_value = max(samples_on_screen)
-    min_value = min(samples_on_screen)
-    if max_value == min_value:
-        max_value += 1
-    prev_x = 0
-    for screen_x in range(len(samples_on_screen)):
-        screen_y = min_max_scaling(max_value, min_value, samples_on_screen[screen_x])
-        display.pixel(screen_x, screen_y, 1)
-        display.line(prev_x, prev_y, screen_x, screen_y, 1)
-        prev_x, prev_y = screen_x, screen_y
+    def filter(self, value):
+        if not self._primed:
+            self._prime(value)
+        return self.cascade.process(value)
 
+    def filter_block(self, values, out):
+        if not len(values):
+            return
+        if not self._primed:
+            self._prime(values[0])
+        self.cascade.process_block(values, out)
 
-def draw_heart_rate_counter(display, heart_rate):
-    if heart_rate != 0:
-        display.text(str(int(heart_rate)), SAMPLES_ON_SCREEN_SIZE + 16, 32, 1)
+    def _update_threshold(self, filtered, index):
+        envelope = self.envelope * self.decay
+        self.threshold = envelope * HEART_ENVELOPE_THRESHOLD
+        if filtered > envelope:
+            envelope = filtered
+        self.envelope = envelope
@@ -1,3 +1,4 @@
+import framebuf
 import math
 import time
 from constants import DISPLAY_WIDTH_PX, DISPLAY_HEIGHT_PX
@@ -16,6 +17,15 @@ MARGIN = 2
 HEART_X = max(0, DISPLAY_WIDTH_PX - MAX_HEART_SIZE - MARGIN)  # Right corner
 HEART_Y = MARGIN  # Top corner (moved slightly down to avoid top edge)
 
+# The heart reaches one pixel past its size, i.e. `int(1.0 * size)`
+HEART_SPRITE_SIZE = MAX_HEART_SIZE + 1
+# One byte per column for every 8 rows
+HEART_SPRITE_BYTES = HEART_SPRITE_SIZE * ((HEART_SPRITE_SIZE + 7) // 8)
+# Distinct scales the pulse is drawn at
+HEART_SPRITE_SCALES = 12
+# At most this much is spent on the sprites
+HEART_SPRITE_CACHE_BYTES = 1024
+
 # Heart shape coordinates (normalized to 1.0)
 HEART_SHAPE = [
     (0.50, 0.10),  # Top center (cleft)
@@ -35,26 +45,22 @@ HEART_SHAPE = [
 ]
 
 
-def draw_heart(display, scale=1.0):
+def _rasterise_heart(target, scale, x0, y0, width, height):
     """
-    Draw a heart shape on the display with the given scale, ensuring it stays on-screen.
-
-    Args:
-        display: The display object to draw on
-        scale: Scale factor for the heart size (1.0 is normal size)
+    Fill the heart at `scale` into `target` with its corner at `x0`, `y0`,
+    clipped to `width` by `height`.
     """
     size = HEART_SIZE * scale
-    pixels = set()  # Track filled pixels to avoid duplicates
 
     # Draw the heart outline
     for i in range(len(HEART_SHAPE)):
         x1, y1 = HEART_SHAPE[i]
         x2, y2 = HEART_SHAPE[(i + 1) % len(HEART_SHAPE)]
 
-        x1_pos = HEART_X + int(x1 * size)
-        y1_pos = HEART_Y + int(y1 * size)
-        x2_pos = HEART_X + int(x2 * size)
-        y2_pos = HEART_Y + int(y2 * size)
+        x1_pos = x0 + int(x1 * size)
+        y1_pos = y0 + int(y1 * size)
+        x2_pos = x0 + int(x2 * size)
+        y2_pos = y0 + int(y2 * size)
 
         # Draw line between points using a simple Bresenham-like approach
         dx = abs(x2_pos - x1_pos)
@@ -62,10 +68,9 @@ def draw_heart(display, scale=1.0):
         steps = max(dx, dy)
         if steps == 0:
             # Clip coordinates to stay on-screen
-            x = min(max(x1_pos, 0), DISPLAY_WIDTH_PX - 1)
-            y = min(max(y1_pos, 0), DISPLAY_HEIGHT_PX - 1)
-            display.pixel(x, y, 1)
-            pixels.add((x, y))
+            x = min(max(x1_pos, 0), width - 1)
+            y = min(max(y1_pos, 0), height - 1)
+            target.pixel(x, y, 1)
             continue
 
         x_step = (x2_pos - x1_pos) / steps
@@ -74,25 +79,24 @@ def draw_heart(display, scale=1.0):
             x = int(x1_pos + step * x_step)
             y = int(y1_pos + step * y_step)
             # Clip coordinates to stay on-screen
-            x = min(max(x, 0), DISPLAY_WIDTH_PX - 1)
-            y = min(max(y, 0), DISPLAY_HEIGHT_PX - 1)
-            display.pixel(x, y, 1)
-            pixels.add((x, y))
+            x = min(max(x, 0), width - 1)
+            y = min(max(y, 0), height - 1)
+            target.pixel(x, y, 1)
 
     # Scanline fill the heart
-    min_y = max(HEART_Y, 0)
-    max_y = min(HEART_Y + int(size), DISPLAY_HEIGHT_PX - 1)
+    min_y = max(y0, 0)
+    max_y = min(y0 + int(size), height - 1)
     for y in range(min_y, max_y + 1):
         intersections = []
         for i in range(len(HEART_SHAPE)):
             x1, y1 = HEART_SHAPE[i]
             x2, y2 = HEART_SHAPE[(i + 1) % len(HEART_SHAPE)]
 
-            y1_pos = HEART_Y + y1 * size
-            y2_pos = HEART_Y + y2 * size
+            y1_pos = y0 + y1 * size
+            y2_pos = y0 + y2 * size
             if (y1_pos <= y < y2_pos) or (y2_pos <= y < y1_pos):
-                x1_pos = HEART_X + x1 * size
-                x2_pos = HEART_X + x2 * size
+                x1_pos = x0 + x1 * size
+                x2_pos = x0 + x2 * size
                 t = (y - y1_pos) / (y2_pos - y1_pos) if y2_pos != y1_pos else 0
                 x = x1_pos + t * (x2_pos - x1_pos)
                 intersections.append(int(x))
@@ -102,11 +106,89 @@ def draw_heart(display, scale=1.0):
         for i in range(0, len(intersections), 2):
             if i + 1 < len(intersections):
                 x_start = max(intersections[i], 0)
-                x_end = min(intersections[i + 1], DISPLAY_WIDTH_PX - 1)
-                for x in range(x_start, x_end + 1):
-                    if (x, y) not in pixels:
-                        display.pixel(x, y, 1)
-                        pixels.add((x, y))
+                x_end = min(intersections[i + 1], width - 1)
+                target.hline(x_start, y, x_end - x_start + 1, 1)
+
+
+def draw_heart(display, scale=1.0):
+    """
+    Draw a heart shape on the display with the given scale, ensuring it stays on-screen.
+
+    Args:
+        display: The display object to draw on
+        scale: Scale factor for the heart size (1.0 is normal size)
+    """
+    _rasterise_heart(
+        display, scale, HEART_X, HEART_Y, DISPLAY_WIDTH_PX, DISPLAY_HEIGHT_PX
+    )
+
+
+class HeartSprite(framebuf.FrameBuffer):
+    """
+    The heart at one scale, on a cleared square big enough for the largest
+    one so blitting it also erases whatever heart was there before.
+    """
+
+    def __init__(self):
+        # `FrameBuffer` does not expose its size, `Display.blit` needs it
+        self.width = HEART_SPRITE_SIZE
+        self.height = HEART_SPRITE_SIZE
+        self.buffer = bytearray(HEART_SPRITE_BYTES)
+        super().__init__(
+            self.buffer, HEART_SPRITE_SIZE, HEART_SPRITE_SIZE, framebuf.MONO_VLSB
+        )
+
+    def draw(self, scale):
+        self.fill(0)
+        _rasterise_heart(self, scale, 0, 0, HEART_SPRITE_SIZE, HEART_SPRITE_SIZE)
+
+
+class HeartSpriteCache:
+    """
+    Sprites of the heart for `HEART_SPRITE_SCALES` evenly spaced scales
+    between `HEART_PULSE_MIN` and `HEART_PULSE_MAX`, each drawn the first
+    time it is asked for. Once `max_bytes` are used up the scales that are
+    not cached yet are drawn into one shared sprite on every call instead.
+    """
+
+    def __init__(self, max_bytes=HEART_SPRITE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.sprites = [None] * HEART_SPRITE_SCALES
+        self.scratch = None
+        self.scratch_level = None
+        self.step = (HEART_PULSE_MAX - HEART_PULSE_MIN) / (HEART_SPRITE_SCALES - 1)
+
+    def level(self, scale):
+        """
+        Index of the cached scale closest to `scale`.
+        """
+        level = round((scale - HEART_PULSE_MIN) / self.step)
+        return min(max(level, 0), HEART_SPRITE_SCALES - 1)
+
+    def get(self, scale):
+        level = self.level(scale)
+        sprite = self.sprites[level]
+        if sprite is not None:
+            return sprite
+
+        scale = HEART_PULSE_MIN + level * self.step
+        if self.used_bytes + HEART_SPRITE_BYTES <= self.max_bytes:
+            sprite = HeartSprite()
+            sprite.draw(scale)
+            self.sprites[level] = sprite
+            self.used_bytes += HEART_SPRITE_BYTES
+            return sprite
+
+        if self.scratch is None:
+            self.scratch = HeartSprite()
+        if self.scratch_level != level:
+            self.scratch.draw(scale)
+            self.scratch_level = level
+        return self.scratch
+
+
+heart_sprites = HeartSpriteCache()
 
 
 def update_heart_animation(display, last_update_time):
@@ -140,10 +222,7 @@ def update_heart_animation(display, last_update_time):
             1 - math.exp(-3 * (1 - t))
         )
 
-    # Clear the previous heart area (use MAX_HEART_SIZE to cover the largest possible area)
-    display.fill_rect(HEART_X, HEART_Y, MAX_HEART_SIZE, MAX_HEART_SIZE, 0)
-
-    # Draw the heart with the current scale
-    draw_heart(display, scale)
+    # The sprite covers the previous heart as well, no need to clear first
+    display.blit(heart_sprites.get(scale), HEART_X, HEART_Y)
 
     return current_time
@@ -1,14 +1,26 @@
 import uos
 import ujson
+from array import array
 import urandom
 import time
 from logging import log, eth_log
 from constants import (
+    HISTORY_COMPACTION_MIN_BYTES,
     HISTORY_DATA_FILENAME,
     HISTORY_DATA_FOLDER,
-    HISTORY_ENTRY_DATA_SEPARATOR,
-    HISTORY_ENTRY_KEY_VALUE_SEPARATOR,
+    HISTORY_INDEX_FILENAME,
+    HISTORY_LEGACY_DATA_FILENAME,
     HISTORY_NUMERIC_FIELDS,
+    HISTORY_PPI_FOLDER,
+)
+from record import (
+    RECORD_HEADER_SIZE,
+    decode_entry,
+    encode_entry,
+    legacy_line_to_entry,
+    read_record,
+    record_id,
+    record_length,
 )
 import re
 
@@ -56,81 +68,455 @@ def init_history_file():
         uos.listdir(HISTORY_DATA_FOLDER)
     except OSError:
         uos.mkdir(HISTORY_DATA_FOLDER)
-        f = open(HISTORY_DATA_FILENAME, "w")
+        f = open(HISTORY_DATA_FILENAME, "wb")
         f.close()
         log("History file created")
 
 
-def push_data(data):
+# Layout of the index file, an index with another version is rebuilt
+HISTORY_INDEX_VERSION = 2
+# Version, size of the history file it indexes, bytes of replaced entries
+_INDEX_HEADER_WORDS = 3
+# ID and offset of every entry
+_INDEX_RECORD_WORDS = 2
+_INDEX_WORD_BYTES = 4
+# Index records read at once while loading it
+_INDEX_READ_RECORDS = 32
+
+
+class HistoryStore:
     """
-    Push a single bit of data to be stored
+    Append-only log of the history entries with an index file next to it.
+
+    Every push appends one record (see `record`) to the log. Replacing an
+    entry appends its new version and leaves the old record behind,
+    `compact` rewrites the log with only the live records and `push` does so
+    by itself once most of it is replaced entries.
+
+    The index file holds the ID and the offset of the latest record of every
+    entry in the order they were first pushed, so an entry can be read by
+    its position without going through the log. In memory there is only a
+    map from ID to position. The index records the size of the log it
+    describes and is rebuilt from the log if that does not match.
     """
 
-    init_history_file()
+    def __init__(
+        self,
+        path=HISTORY_DATA_FILENAME,
+        index_path=HISTORY_INDEX_FILENAME,
+        legacy_path=HISTORY_LEGACY_DATA_FILENAME,
+    ):
+        self.path = path
+        self.index_path = index_path
+        self.legacy_path = legacy_path
+        self.slots = {}
+        self.count = 0
+        # Goes up with every push, so whatever shows entries knows to read
+        # them again even when one was replaced in place
+        self.version = 0
+        self.stale_bytes = 0
+        # What the log should look like if nobody else touched it
+        self.file_size = -1
+        # The log ends in a damaged record, nothing can be appended after it
+        self.needs_compaction = False
+        self.migrated = False
 
-    for field in HISTORY_NUMERIC_FIELDS:
-        if field not in data:
-            continue
+        self._header = array("I", bytes(_INDEX_HEADER_WORDS * _INDEX_WORD_BYTES))
+        self._record = array("I", bytes(_INDEX_RECORD_WORDS * _INDEX_WORD_BYTES))
+        self._records = array(
+            "I",
+            bytes(_INDEX_READ_RECORDS * _INDEX_RECORD_WORDS * _INDEX_WORD_BYTES),
+        )
+        self._record_header = bytearray(RECORD_HEADER_SIZE)
 
-        if not isinstance(data[field], (int, float)):
-            raise ValueError(f"Invalid numeric value for {field}")
+    @staticmethod
+    def _stat_size(path):
+        try:
+            return uos.stat(path)[6]
+        except OSError:
+            return 0
 
-    data["TIMESTAMP"] = data["TIMESTAMP"].replace("-", "/")
+    @staticmethod
+    def _exists(path):
+        try:
+            uos.stat(path)
+            return True
+        except OSError:
+            return False
 
-    new_data = []
-    existing_data = read_data()
+    def _ensure_index(self):
+        init_history_file()
+        if not self.migrated:
+            self.migrated = True
+            self._migrate_legacy()
+        size = self._stat_size(self.path)
+        if size == self.file_size:
+            return
+        if not self._load_index(size):
+            self._build_index()
 
-    for entry in existing_data:
-        if entry["ID"] == data["ID"]:
-            log(f"Entry with id {entry['ID']} already exists, replacing")
-            entry = data
-            data = None
-        new_data.append(entry)
+    def _migrate_legacy(self):
+        """
+        Convert a text format history file into records, once. Converting
+        again after a power loss only replaces what is already there.
+        """
+        if not self._exists(self.legacy_path):
+            return
 
-    if data:
-        new_data.append(data)
+        log("Converting the history file to binary records")
+        with open(self.legacy_path, "rb") as f:
+            for line in f:
+                try:
+                    self.push(legacy_line_to_entry(line))
+                except (ValueError, IndexError, KeyError):
+                    log("Dropping a damaged history entry")
+        self.compact()
+        uos.remove(self.legacy_path)
 
-    new_data.sort(key=lambda x: x["TIMESTAMP"], reverse=True)
+    def _load_index(self, size):
+        """
+        Take the index file if it describes a log of `size` bytes.
+        """
+        header_bytes = _INDEX_HEADER_WORDS * _INDEX_WORD_BYTES
+        record_bytes = _INDEX_RECORD_WORDS * _INDEX_WORD_BYTES
+        index_size = self._stat_size(self.index_path)
+        if index_size < header_bytes or (index_size - header_bytes) % record_bytes:
+            return False
 
-    with open(HISTORY_DATA_FILENAME, "w") as f:
-        for entry in new_data:
-            line = HISTORY_ENTRY_DATA_SEPARATOR.join(
-                f"{field}{HISTORY_ENTRY_KEY_VALUE_SEPARATOR}{str(entry[field])}"
-                for field in entry
-            )
-            f.write(line + "\n")
+        header = self._header
+        records = self._records
+        with open(self.index_path, "rb") as f:
+            f.readinto(header)
+            if header[0] != HISTORY_INDEX_VERSION or header[1] != size:
+                return False
 
+            self.slots = {}
+            count = (index_size - header_bytes) // record_bytes
+            slot = 0
+            while slot < count:
+                read = f.readinto(records) // record_bytes
+                for i in range(read):
+                    self.slots[records[i * _INDEX_RECORD_WORDS]] = slot + i
+                slot += read
 
-def read_data():
+        self.count = count
+        self.stale_bytes = header[2]
+        self.file_size = size
+        # An index only ever matches a log without damage
+        self.needs_compaction = False
+        return True
+
+    def _build_index(self):
+        """
+        Index the log from scratch and write the index file.
+        """
+        self.slots = {}
+        self.stale_bytes = 0
+        self.needs_compaction = False
+        ids = array("I")
+        offsets = array("I")
+
+        size = self._stat_size(self.path)
+        offset = 0
+        if size:
+            with open(self.path, "rb") as f:
+                while True:
+                    record = read_record(f)
+                    if record is None:
+                        break
+                    if not record:
+                        # Damaged, i.e. cut short by a power loss. Without a
+                        # length to go by, the rest of the log is lost
+                        self.stale_bytes += size - offset
+                        self.needs_compaction = True
+                        break
+
+                    entry_id = record_id(record)
+                    if entry_id in self.slots:
+                        slot = self.slots[entry_id]
+                        self.stale_bytes += self._record_size(f, offsets[slot])
+                        offsets[slot] = offset
+                    else:
+                        self.slots[entry_id] = len(ids)
+                        ids.append(entry_id)
+                        offsets.append(offset)
+                    offset += len(record)
+
+        self.count = len(ids)
+        # An index of a damaged log only covers the records before the damage,
+        # so it is never taken for the whole log and the damage is found again
+        self.file_size = offset
+        self._write_index(ids, offsets)
+        self.file_size = size
+
+    def _record_size(self, f, offset):
+        """
+        Length of the record at `offset`, leaves `f` where it was.
+        """
+        position = f.tell()
+        f.seek(offset)
+        f.readinto(self._record_header)
+        f.seek(position)
+        return record_length(self._record_header)
+
+    def _write_index(self, ids, offsets):
+        with open(self.index_path, "wb") as f:
+            self._write_header(f)
+            record = self._record
+            for i in range(len(ids)):
+                record[0] = ids[i]
+                record[1] = offsets[i]
+                f.write(record)
+
+    def _write_header(self, f):
+        header = self._header
+        header[0] = HISTORY_INDEX_VERSION
+        header[1] = self.file_size
+        header[2] = self.stale_bytes
+        f.seek(0)
+        f.write(header)
+
+    def _read_offset(self, f, slot):
+        f.seek(
+            (_INDEX_HEADER_WORDS + slot * _INDEX_RECORD_WORDS + 1) * _INDEX_WORD_BYTES
+        )
+        f.readinto(self._record)
+        return self._record[0]
+
+    def __len__(self):
+        self._ensure_index()
+        return self.count
+
+    def entries(self, start, stop):
+        """
+        Entries from position `start` up to `stop`, newest first. Only reads
+        those entries, whatever the size of the history.
+        """
+        self._ensure_index()
+        stop = min(stop, self.count)
+        data = []
+        if start >= stop:
+            return data
+        with open(self.index_path, "rb") as index:
+            with open(self.path, "rb") as f:
+                for position in range(start, stop):
+                    f.seek(self._read_offset(index, self.count - 1 - position))
+                    data.append(decode_entry(read_record(f)))
+        return data
+
+    def entry(self, position):
+        """
+        The entry at `position`, newest first.
+        """
+        return self.entries(position, position + 1)[0]
+
+    def read_all(self):
+        """
+        All the entries, newest first.
+        """
+        self._ensure_index()
+        if not self.count:
+            return []
+
+        # One pass over the log is cheaper than a seek per entry
+        data = [None] * self.count
+        if not self.stale_bytes:
+            # Every record is live and in the order the entries were pushed
+            with open(self.path, "rb") as f:
+                for slot in range(self.count):
+                    data[self.count - 1 - slot] = decode_entry(read_record(f))
+            return data
+
+        # Otherwise only the records the index points at are live
+        slots = self.slots
+        offsets = array("I", bytes(self.count * _INDEX_WORD_BYTES))
+        with open(self.index_path, "rb") as index:
+            for slot in range(self.count):
+                offsets[slot] = self._read_offset(index, slot)
+        offset = 0
+        with open(self.path, "rb") as f:
+            while True:
+                record = read_record(f)
+                if not record:
+                    break
+                slot = slots.get(record_id(record))
+                if slot is not None and offsets[slot] == offset:
+                    data[self.count - 1 - slot] = decode_entry(record)
+                offset += len(record)
+        return data
+
+    def push(self, data):
+        self._ensure_index()
+        if self.needs_compaction:
+            self.compact()
+
+        entry_id = data["ID"]
+        slot = self.slots.get(entry_id)
+
+        record = encode_entry(data)
+        with open(self.path, "ab") as f:
+            f.write(record)
+        offset = self.file_size
+        self.file_size += len(record)
+
+        # The log is written first, if the index update gets cut short the
+        # sizes disagree and the index is rebuilt
+        index_record = self._record
+        if slot is None:
+            self.slots[entry_id] = self.count
+            self.count += 1
+            index_record[0] = entry_id
+            index_record[1] = offset
+            with open(self.index_path, "ab") as f:
+                f.write(index_record)
+            with open(self.index_path, "r+b") as f:
+                self._write_header(f)
+        else:
+            log(f"Entry with id {entry_id} already exists, replacing")
+            with open(self.path, "rb") as f:
+                with open(self.index_path, "r+b") as index:
+                    self.stale_bytes += self._record_size(
+                        f, self._read_offset(index, slot)
+                    )
+                    index.seek(
+                        (_INDEX_HEADER_WORDS + slot * _INDEX_RECORD_WORDS + 1)
+                        * _INDEX_WORD_BYTES
+                    )
+                    index_record[0] = offset
+                    index.write(memoryview(index_record)[:1])
+                    self._write_header(index)
+        self.version += 1
+
+        live_bytes = self.file_size - self.stale_bytes
+        if (
+            self.file_size >= HISTORY_COMPACTION_MIN_BYTES
+            and self.stale_bytes > live_bytes
+        ):
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the log without the replaced entries.
+        """
+        self._ensure_index()
+        if not self.stale_bytes:
+            return
+
+        log(f"Compacting history, dropping {self.stale_bytes} bytes")
+        temporary_path = self.path + ".tmp"
+        ids = array("I", bytes(self.count * _INDEX_WORD_BYTES))
+        offsets = array("I", bytes(self.count * _INDEX_WORD_BYTES))
+        for entry_id, slot in self.slots.items():
+            ids[slot] = entry_id
+
+        offset = 0
+        with open(self.index_path, "rb") as index:
+            with open(self.path, "rb") as source:
+                with open(temporary_path, "wb") as target:
+                    for slot in range(self.count):
+                        source.seek(self._read_offset(index, slot))
+                        record = read_record(source)
+                        target.write(record)
+                        offsets[slot] = offset
+                        offset += len(record)
+
+        # Replacing the log in one rename keeps the old one intact until the
+        # new one is complete, a stale index is caught by its size
+        uos.rename(temporary_path, self.path)
+        self.file_size = offset
+        self.stale_bytes = 0
+        self.needs_compaction = False
+        self._write_index(ids, offsets)
+
+
+class PpiSidecars:
+    """
+    Raw PPIs of every measurement, stored as the bytes of an `array("H")`
+    in a file of their own next to the history log.
+
+    `read` fills a buffer that is kept between calls, so going through any
+    number of measurements only ever holds one of them in memory.
+    """
+
+    def __init__(self, folder=HISTORY_PPI_FOLDER):
+        self.folder = folder
+        self.buffer = array("H")
+
+    def path(self, entry_id):
+        return f"{self.folder}/{entry_id}.ppi"
+
+    def write(self, entry_id, ppis):
+        init_history_file()
+        try:
+            uos.mkdir(self.folder)
+        except OSError:
+            pass
+        with open(self.path(entry_id), "wb") as f:
+            f.write(array("H", ppis))
+
+    def read(self, entry_id):
+        """
+        The PPIs of `entry_id` as a view of the shared buffer, valid until the
+        next `read`. `None` if there is no sidecar.
+        """
+        try:
+            size = uos.stat(self.path(entry_id))[6]
+        except OSError:
+            return None
+
+        count = size // 2
+        if len(self.buffer) < count:
+            # Grown in powers of two, so a backlog only reallocates a few times
+            capacity = max(len(self.buffer), 64)
+            while capacity < count:
+                capacity *= 2
+            self.buffer = array("H", bytes(capacity * 2))
+
+        view = memoryview(self.buffer)[:count]
+        with open(self.path(entry_id), "rb") as f:
+            f.readinto(view)
+        return view
+
+    def remove(self, entry_id):
+        try:
+            uos.remove(self.path(entry_id))
+        except OSError:
+            pass
+
+
+store = HistoryStore()
+sidecars = PpiSidecars()
+
+
+def push_data(data):
     """
-    Read and parse data from hr_data/data.txt into a list of dictionaries.
+    Push a single bit of data to be stored
     """
-    data = []
 
-    init_history_file()
+    for field in HISTORY_NUMERIC_FIELDS:
+        if field not in data:
+            continue
+
+        if not isinstance(data[field], (int, float)):
+            raise ValueError(f"Invalid numeric value for {field}")
 
-    with open(HISTORY_DATA_FILENAME, "r") as f:
-        for line in f.readlines():
-            values = line.strip().split(HISTORY_ENTRY_DATA_SEPARATOR)
+    data["TIMESTAMP"] = data["TIMESTAMP"].replace("-", "/")
 
-            entry = {
-                p[0]: p[1]
-                for p in map(
-                    lambda s: s.split(HISTORY_ENTRY_KEY_VALUE_SEPARATOR),
-                    values,
-                )
-            }
+    # Raw PPIs are only ever streamed back, they live in a sidecar so the
+    # record stays small
+    ppis = data.pop("RAW PPIS", None)
+    if ppis is not None:
+        sidecars.write(data["ID"], ppis)
 
-            for k, v in entry.items():
-                if k == "ID":
-                    entry[k] = int(v)
-                    continue
-                if k in HISTORY_NUMERIC_FIELDS:
-                    entry[k] = float(v)
+    store.push(data)
 
-            data.append(entry)
 
-    return data
+def read_data():
+    """
+    Read and parse all the entries in the history file into a list of
+    dictionaries, newest first.
+    """
+    return store.read_all()
 
 
 # random integer generator
@@ -5,8 +5,14 @@ from constants import (
     CHAR_SIZE_WIDTH_PX,
     UI_MARGIN,
 )
-from heart_ui import update_heart_animation
-from history import read_data
+from display import Layer
+from heart_ui import (
+    HEART_SPRITE_SIZE,
+    HEART_X,
+    HEART_Y,
+    update_heart_animation,
+)
+from history import store
 import time
 
 from logging import log
@@ -15,11 +21,37 @@ from logging import log
 class HistoryUi:
     def __init__(self, hal, history_count=0):
         self.asm = hal
-        self.history_data = read_data()
         self.history_count = history_count
         self.selected_row = 0  # 0-3 for rows 1-4
         self.entries_per_screen = 4  # Show 4 entries at a time
         self.heart_animation_time = time.time()
+        self.heart_layer = Layer(
+            HEART_X, HEART_Y, HEART_SPRITE_SIZE, HEART_SPRITE_SIZE, self._draw_heart
+        )
+
+        # Only the rows on screen and the opened entry are kept in memory
+        self.visible_entries = []
+        self.visible_start = -1
+        self.visible_version = -1
+        self.opened_entry = None
+        self.opened_index = -1
+        self.opened_version = -1
+        self.opened_lines = None
+
+    def _visible(self, start_idx, end_idx):
+        if (
+            start_idx != self.visible_start
+            or end_idx - start_idx != len(self.visible_entries)
+            or store.version != self.visible_version
+        ):
+            self.visible_entries = store.entries(start_idx, end_idx)
+            self.visible_start = start_idx
+            self.visible_version = store.version
+        return self.visible_entries
+
+    def _invalidate(self):
+        self.visible_start = -1
+        self.opened_index = -1
 
     @property
     def display(self):
@@ -43,11 +75,26 @@ class HistoryUi:
                 self.asm.history,
             )
 
-        self.display.fill(0)
+        if (
+            index != self.opened_index
+            or store.version != self.opened_version
+            or self.asm.is_first_frame
+        ):
+            self.opened_entry = store.entry(index)
+            self.opened_index = index
+            self.opened_version = store.version
+            self.opened_lines = self._entry_lines(self.opened_entry)
+
+        # The text stays as it is, only the heart is drawn every frame
+        self.asm.screens.show(
+            self.opened_lines, self._draw_entry, (self.heart_layer,)
+        )
+        return None
 
+    def _entry_lines(self, entry):
         # Get the entry and reformat timestamp to dd/mm hh:mm
-        entry = self.history_data[index]
-        timestamp_parts = entry["TIMESTAMP"].split()
+        timestamp = entry["TIMESTAMP"]
+        timestamp_parts = timestamp.split()
         if len(timestamp_parts) >= 2:
             date_parts = timestamp_parts[0].split("/")
             time_parts = timestamp_parts[1].split(":")
@@ -56,27 +103,25 @@ class HistoryUi:
                 formatted_date = f"{date_parts[0]}/{date_parts[1]}"
                 formatted_time = f"{time_parts[0]}:{time_parts[1]}"
                 timestamp = f"{formatted_date} {formatted_time}"
-                self.display.text(timestamp, 0, 0, 1)
-            else:
-                self.display.text(entry["TIMESTAMP"], 0, 0, 1)
-        else:
-            self.display.text(entry["TIMESTAMP"], 0, 0, 1)
 
         hr = f"HR: {round(entry['MEAN HR'])} BPM"
         ppi = f"PPI: {round(entry['MEAN PPI'])} ms"
         rmssd = f"RMSSD: {entry['RMSSD']:.3f} ms"
         sdnn = f"SDNN: {entry['SDNN']:.3f} ms"
-        output = [hr, ppi, rmssd, sdnn]
+        output = [timestamp, hr, ppi, rmssd, sdnn]
 
         if "SNS" in entry:
             output.append(f"SNS: {entry['SNS']:.3f}")
         if "PNS" in entry:
             output.append(f"PNS: {entry['PNS']:.3f}")
 
+        return tuple(output)
+
+    def _draw_entry(self):
         MICRO_UI_GAP_PX = 1
 
-        for i, string in enumerate(output):
-            y = (i + 1) * (CHAR_SIZE_HEIGHT_PX + MICRO_UI_GAP_PX)
+        for i, string in enumerate(self.opened_lines):
+            y = i * (CHAR_SIZE_HEIGHT_PX + MICRO_UI_GAP_PX)
             self.display.text(
                 string,
                 0,
@@ -84,13 +129,11 @@ class HistoryUi:
                 1,
             )
 
+    def _draw_heart(self, display):
         self.heart_animation_time = update_heart_animation(
-            self.display, self.heart_animation_time
+            display, self.heart_animation_time
         )
 
-        self.display.show()
-        return None
-
     def history_tick(self):
         """
         Handle rotary input and button presses for history navigation
@@ -102,14 +145,15 @@ class HistoryUi:
             self.asm.state(self.asm.main_menu)
             return
 
-        if self.asm.button_short() and self.history_data:
+        data_len = len(store)
+
+        if self.asm.button_short() and data_len:
             self.asm.state(self.asm._history_entry, self.history_count)
             return
 
         # Handle rotary input
         rotary_motion = self.asm.pull_rotary()
 
-        data_len = len(self.history_data)
         if data_len == 0:
             self._update_display(0, 0)  # Display empty state
 
@@ -121,7 +165,7 @@ class HistoryUi:
             self._update_display(start_idx, end_idx)
             return
 
-        self.history_data = read_data()
+        self._invalidate()
 
         # Handle rotary navigation
         if rotary_motion > 0:  # Clockwise rotation
@@ -162,11 +206,16 @@ class HistoryUi:
 
     def _update_display(self, start_idx, end_idx):
         """Update the display with the current history entries"""
-        self.display.fill(0)
+        self.asm.screens.show(
+            # The version changes with the entries, a replaced one included
+            (self, start_idx, end_idx, self.history_count, store.version),
+            lambda: self._draw_list(start_idx, end_idx),
+        )
 
+    def _draw_list(self, start_idx, end_idx):
         self.display.text("History", 0, 0, 1)
 
-        data_len = len(self.history_data)
+        data_len = len(store)
         if data_len == 0:
             empty_text = "Nothing yet..."
             text_size_x_px = len(empty_text) * CHAR_SIZE_WIDTH_PX
@@ -185,8 +234,8 @@ class HistoryUi:
             self.display.text("0/0", DISPLAY_WIDTH_PX, 0, 1)
 
         # Display the entries
-        for i, idx in enumerate(range(start_idx, end_idx)):
-            entry = self.history_data[idx]
+        for i, entry in enumerate(self._visible(start_idx, end_idx)):
+            idx = start_idx + i
             timestamp = entry["TIMESTAMP"]  # Already formatted in read_data
 
             # Calculate position for this entry
@@ -201,5 +250,3 @@ class HistoryUi:
             else:
                 # For non-selected entries, draw normal text
                 self.display.text(timestamp, 8, y_pos, 1)
-
-        self.display.show()
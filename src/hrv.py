@@ -0,0 +1,84 @@
+from array import array
+from math import sqrt
+from constants import PPI_SIZE
+
+# Successive PPIs differing by more than this count towards pNN50
+PNN50_THRESHOLD_MS = 50
+
+
+class HrvAccumulator:
+    """
+    Heart rate variability statistics updated in O(1) per PPI, so they are
+    available at any point of the measurement without another pass over it.
+
+    The mean and SDNN use Welford's algorithm, RMSSD and pNN50 keep running
+    sums over the successive differences, and the BPM is averaged over the
+    last `window_size` PPIs only.
+    """
+
+    def __init__(self, window_size=PPI_SIZE):
+        self.window = array("H", bytes(2 * window_size))
+        self.window_size = window_size
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+        self._last_ppi_ms = 0
+        self._successive_square_sum = 0
+        self._nn50 = 0
+
+        self._window_index = 0
+        self._window_count = 0
+        self._window_sum = 0
+        # The sum takes out whatever a slot held before, so it has to be zero
+        for i in range(self.window_size):
+            self.window[i] = 0
+
+    def add(self, ppi_ms):
+        ppi_ms = int(ppi_ms)
+
+        self.count += 1
+        delta = ppi_ms - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (ppi_ms - self.mean)
+
+        if self.count > 1:
+            diff = ppi_ms - self._last_ppi_ms
+            self._successive_square_sum += diff * diff
+            if abs(diff) > PNN50_THRESHOLD_MS:
+                self._nn50 += 1
+        self._last_ppi_ms = ppi_ms
+
+        i = self._window_index
+        self._window_sum += ppi_ms - self.window[i]
+        self.window[i] = ppi_ms
+        self._window_index = (i + 1) % self.window_size
+        if self._window_count < self.window_size:
+            self._window_count += 1
+
+    def sdnn(self):
+        return sqrt(self._m2 / self.count) if self.count else 0
+
+    def rmssd(self):
+        if self.count < 2:
+            return 0
+        return sqrt(self._successive_square_sum / (self.count - 1))
+
+    def pnn50(self):
+        """
+        Percentage of successive PPIs that differ by more than 50 ms.
+        """
+        if self.count < 2:
+            return 0
+        return 100 * self._nn50 / (self.count - 1)
+
+    def bpm(self):
+        """
+        Heart rate over the last `window_size` PPIs.
+        """
+        if not self._window_sum:
+            return 0
+        return 60000 * self._window_count / self._window_sum
@@ -0,0 +1,165 @@
+import uos
+from array import array
+from time import ticks_ms, ticks_add, ticks_diff
+from logging import log
+from constants import (
+    KUBIOS_MAX_ATTEMPTS,
+    KUBIOS_MAX_IN_FLIGHT,
+    KUBIOS_QUEUE_FILENAME,
+    KUBIOS_RESPONSE_TIMEOUT_MS,
+    KUBIOS_RETRY_BASE_MS,
+    KUBIOS_RETRY_MAX_MS,
+    KUBIOS_SEND_INTERVAL_MS,
+)
+from history import init_history_file, sidecars
+
+
+class KubiosQueue:
+    """
+    History entries waiting to be analysed by Kubios, by ID, with their PPIs
+    read from the sidecar files.
+
+    `tick` sends at most one request per call, no more often than every
+    `KUBIOS_SEND_INTERVAL_MS`, and never has more than `KUBIOS_MAX_IN_FLIGHT`
+    waiting for a response. A request that fails to publish or is not
+    answered in time is sent again after a wait that doubles with every
+    attempt. An entry only leaves the queue through `complete`, when its
+    response arrives, after `KUBIOS_MAX_ATTEMPTS`, or when `send` raises
+    `ValueError`, the request can never be sent.
+
+    The IDs are kept in a file, whatever was not answered before a restart
+    is sent again after it.
+    """
+
+    def __init__(self, send, path=KUBIOS_QUEUE_FILENAME):
+        # Called with the PPIs and the ID of every request
+        self.send = send
+        self.path = path
+        # In the order they were queued
+        self.ids = []
+        self.attempts = {}
+        self.retry_at_ms = {}
+        # ID to when it was sent
+        self.in_flight = {}
+        self.last_send_ms = None
+        self._load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, request_id):
+        return request_id in self.attempts
+
+    def _load(self):
+        try:
+            size = uos.stat(self.path)[6]
+        except OSError:
+            return
+
+        ids = array("I", bytes(size - size % 4))
+        with open(self.path, "rb") as f:
+            f.readinto(ids)
+        for request_id in ids:
+            if request_id not in self.attempts:
+                self.ids.append(request_id)
+                self.attempts[request_id] = 0
+
+    def _save(self):
+        init_history_file()
+        with open(self.path, "wb") as f:
+            f.write(array("I", self.ids))
+
+    def push(self, request_id):
+        if request_id in self.attempts:
+            return
+        self.ids.append(request_id)
+        self.attempts[request_id] = 0
+        self._save()
+
+    def _forget(self, request_id):
+        self.ids.remove(request_id)
+        del self.attempts[request_id]
+        self.retry_at_ms.pop(request_id, None)
+        self.in_flight.pop(request_id, None)
+        self._save()
+
+    def complete(self, request_id):
+        """
+        The response for `request_id` arrived, `False` if it was not queued.
+        """
+        if request_id not in self.attempts:
+            return False
+        self._forget(request_id)
+        return True
+
+    def fail(self, request_id, now_ms=None):
+        """
+        Send `request_id` again later, Kubios could not analyse it or it
+        never got there.
+        """
+        if request_id not in self.attempts:
+            return
+        if now_ms is None:
+            now_ms = ticks_ms()
+
+        self.in_flight.pop(request_id, None)
+        attempts = self.attempts[request_id] + 1
+        if attempts >= KUBIOS_MAX_ATTEMPTS:
+            log(f"Giving up on Kubios request {request_id} after {attempts} tries")
+            self._forget(request_id)
+            return
+
+        self.attempts[request_id] = attempts
+        delay_ms = min(KUBIOS_RETRY_BASE_MS << (attempts - 1), KUBIOS_RETRY_MAX_MS)
+        self.retry_at_ms[request_id] = ticks_add(now_ms, delay_ms)
+
+    def _send(self, request_id, now_ms):
+        ppis = sidecars.read(request_id)
+        if ppis is None:
+            log(f"No PPIs stored for entry {request_id}, dropping it")
+            self._forget(request_id)
+            return
+
+        self.last_send_ms = now_ms
+        try:
+            self.send(ppis, request_id)
+        except OSError as e:
+            log(f"Could not send Kubios request {request_id}: {e}")
+            self.fail(request_id, now_ms)
+            return
+        except ValueError as e:
+            # Would fail the same way every time, no point backing off
+            log(f"Kubios request {request_id} can never be sent: {e}, dropping it")
+            self._forget(request_id)
+            return
+        self.retry_at_ms.pop(request_id, None)
+        self.in_flight[request_id] = now_ms
+
+    def tick(self, now_ms=None):
+        if not self.ids:
+            return
+        if now_ms is None:
+            now_ms = ticks_ms()
+
+        for request_id in list(self.in_flight):
+            sent_ms = self.in_flight[request_id]
+            if ticks_diff(now_ms, sent_ms) >= KUBIOS_RESPONSE_TIMEOUT_MS:
+                log(f"No response to Kubios request {request_id}")
+                self.fail(request_id, now_ms)
+
+        if len(self.in_flight) >= KUBIOS_MAX_IN_FLIGHT:
+            return
+        if (
+            self.last_send_ms is not None
+            and ticks_diff(now_ms, self.last_send_ms) < KUBIOS_SEND_INTERVAL_MS
+        ):
+            return
+
+        for request_id in self.ids:
+            if request_id in self.in_flight:
+                continue
+            retry_at_ms = self.retry_at_ms.get(request_id)
+            if retry_at_ms is not None and ticks_diff(retry_at_ms, now_ms) > 0:
+                continue
+            self._send(request_id, now_ms)
+            return
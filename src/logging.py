@@ -34,6 +34,6 @@ def log(*args):
     if not active_log:
         init_logs()
     string = eth_log(*args) + "\n"
-    active_log.write(string.encode("utf-8"))  # type: ignore
+    active_log.write(string)  # type: ignore
     active_log.flush()  # type: ignore
     return string
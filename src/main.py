@@ -14,6 +14,7 @@ if major < 1 or major == 1 and minor < 25:
 from sys import print_exception
 from asm import Machine
 from logging import log, active_log
+from constants import USE_ASYNC_RUNTIME
 import time
 import micropython
 import machine as mpy_machine
@@ -26,7 +27,12 @@ log("Starting to do useful work!")
 
 while True:
     try:
-        machine.execute()
+        if USE_ASYNC_RUNTIME:
+            from runtime import run
+
+            run(machine)
+        else:
+            machine.execute()
     except Exception as e:
         machine.display.fill(0)
         machine.display.text("Wow! Error!", 0, 0)
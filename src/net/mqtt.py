@@ -0,0 +1,437 @@
+"""
+Non-blocking MQTT 3.1.1 client, QoS 0 only
+"""
+
+import errno
+import select
+import socket
+from time import ticks_ms, ticks_us, ticks_diff
+
+from logging import log
+
+# Fixed header packet types, shifted into the high nibble
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+# Bytes read from the socket at once
+READ_CHUNK = 256
+# Bytes handed to the socket at once, one TCP segment
+WRITE_CHUNK = 536
+
+DISCONNECTED = 0
+CONNECTING = 1
+HANDSHAKE = 2
+CONNECTED = 3
+
+
+class Buffer:
+    """
+    Fixed size byte queue, appended at the end and consumed from the start.
+    The bytes left are moved to the front when there is no room at the end.
+    """
+
+    def __init__(self, size):
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def clear(self):
+        self.start = self.end = 0
+
+    def room(self):
+        return len(self.data) - len(self)
+
+    def _make_room(self, size):
+        if self.end + size <= len(self.data):
+            return
+        used = len(self)
+        self.view[:used] = self.view[self.start : self.end]
+        self.start = 0
+        self.end = used
+
+    def put(self, data):
+        self._make_room(len(data))
+        self.view[self.end : self.end + len(data)] = data
+        self.end += len(data)
+
+    def put_byte(self, value):
+        self._make_room(1)
+        self.data[self.end] = value
+        self.end += 1
+
+    def put_length(self, length):
+        """
+        MQTT variable length integer, 7 bits per byte.
+        """
+        while True:
+            byte = length & 0x7F
+            length >>= 7
+            self.put_byte(byte | 0x80 if length else byte)
+            if not length:
+                return
+
+    def put_u16(self, value):
+        self.put_byte(value >> 8)
+        self.put_byte(value & 0xFF)
+
+    def put_string(self, data):
+        self.put_u16(len(data))
+        self.put(data)
+
+    def consume(self, size):
+        self.start += size
+        if self.start == self.end:
+            self.start = self.end = 0
+
+
+def resolve(server, port):
+    """
+    The socket address of `server`, raises `OSError` if it can not be
+    resolved. Blocks for the whole DNS lookup.
+    """
+    return socket.getaddrinfo(server, port)[0][-1]
+
+
+def _length_size(length):
+    size = 1
+    while length > 0x7F:
+        length >>= 7
+        size += 1
+    return size
+
+
+class MQTTClient:
+    """
+    MQTT client that never waits on the network.
+
+    `connect` only starts connecting, `publish` and `subscribe` only queue
+    packets. All the socket work happens in `poll`, which returns once it
+    has nothing left to do or has used up its time budget. A connection
+    that fails or goes quiet is dropped and reopened after
+    `reconnect_ms`, and the subscriptions are sent again.
+
+    The client never resolves names, that blocks for as long as the DNS
+    lookup takes. It gets the `address` of `server` already resolved, i.e.
+    by `resolve`, once, and reconnects to it from then on. `server` only
+    names it in the logs.
+
+    Inbound messages are handed to the callback set with `set_callback` as
+    `(topic, msg)` bytes, like `umqtt.simple` does.
+    """
+
+    def __init__(
+        self,
+        client_id,
+        server,
+        address,
+        keepalive_s,
+        inbox_bytes,
+        outbox_bytes,
+        connect_timeout_ms,
+        reconnect_ms,
+    ):
+        self.client_id = client_id
+        self.server = server
+        self.address = address
+        self.keepalive_s = keepalive_s
+        self.connect_timeout_ms = connect_timeout_ms
+        self.reconnect_ms = reconnect_ms
+
+        self.sock = None
+        self.poller = select.poll()
+        self.state = DISCONNECTED
+        self.cb = None
+        self.subscriptions = []
+        self.next_packet_id = 1
+
+        self.inbox = Buffer(inbox_bytes)
+        self.outbox = Buffer(outbox_bytes)
+        self.wants_write = False
+
+        self.state_ms = 0
+        self.last_sent_ms = 0
+        self.last_received_ms = 0
+        self.ping_pending = False
+        # Nothing happens until `connect`
+        self.enabled = False
+
+    @property
+    def connected(self):
+        return self.state == CONNECTED
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def connect(self):
+        self.enabled = True
+        self._open(ticks_ms())
+
+    def disconnect(self):
+        if self.state == CONNECTED:
+            # Best effort, the socket is closed right after
+            try:
+                self.sock.send(bytes((DISCONNECT, 0)))
+            except OSError:
+                pass
+        self.enabled = False
+        self._close()
+
+    def subscribe(self, topic):
+        topic = topic.encode() if isinstance(topic, str) else topic
+        self.subscriptions.append(topic)
+        if self.state in (HANDSHAKE, CONNECTED):
+            self._queue_subscribe(topic)
+
+    def publish(self, topic, msg):
+        """
+        Queue `msg` for sending, raises `OSError` if it can not be sent now
+        and `ValueError` if it never can, the packet is larger than the
+        whole outbox. The bytes are copied, `msg` can be reused right away.
+        """
+        topic = topic.encode() if isinstance(topic, str) else topic
+        remaining = 2 + len(topic) + len(msg)
+        size = 1 + _length_size(remaining) + remaining
+        if size > len(self.outbox.data):
+            raise ValueError(f"{size} B packet does not fit in the MQTT outbox")
+
+        if self.state != CONNECTED:
+            raise OSError(errno.ENOTCONN)
+        if size > self.outbox.room():
+            raise OSError(errno.ENOBUFS)
+
+        outbox = self.outbox
+        outbox.put_byte(PUBLISH)
+        outbox.put_length(remaining)
+        outbox.put_string(topic)
+        outbox.put(msg)
+        self._want_write()
+
+    def _open(self, now_ms):
+        self._close()
+        self.state = CONNECTING
+        self.state_ms = now_ms
+        try:
+            self.sock = socket.socket()
+            self.sock.setblocking(False)
+            try:
+                self.sock.connect(self.address)
+            except OSError as e:
+                if e.args[0] != errno.EINPROGRESS:
+                    raise
+        except OSError as e:
+            self._fail(now_ms, f"could not connect: {e}")
+            return
+
+        self.poller.register(self.sock, select.POLLIN | select.POLLOUT)
+        self.wants_write = True
+
+    def _close(self):
+        if self.sock is not None:
+            try:
+                self.poller.unregister(self.sock)
+            except (OSError, KeyError):
+                pass
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.state = DISCONNECTED
+        self.inbox.clear()
+        self.outbox.clear()
+        self.ping_pending = False
+
+    def _fail(self, now_ms, reason):
+        log(f"MQTT {self.server}: {reason}, retrying in {self.reconnect_ms} ms")
+        self._close()
+        self.state_ms = now_ms
+
+    def _want_write(self):
+        if not self.wants_write and self.sock is not None:
+            self.poller.modify(self.sock, select.POLLIN | select.POLLOUT)
+            self.wants_write = True
+
+    def _queue_connect(self):
+        outbox = self.outbox
+        client_id = self.client_id.encode()
+        remaining = 10 + 2 + len(client_id)
+        outbox.put_byte(CONNECT)
+        outbox.put_length(remaining)
+        outbox.put_string(b"MQTT")
+        # Protocol level 4, clean session
+        outbox.put_byte(4)
+        outbox.put_byte(0x02)
+        outbox.put_u16(self.keepalive_s)
+        outbox.put_string(client_id)
+
+        for topic in self.subscriptions:
+            self._queue_subscribe(topic)
+
+    def _queue_subscribe(self, topic):
+        outbox = self.outbox
+        outbox.put_byte(SUBSCRIBE)
+        outbox.put_length(2 + 2 + len(topic) + 1)
+        outbox.put_u16(self.next_packet_id)
+        self.next_packet_id = self.next_packet_id % 0xFFFF + 1
+        outbox.put_string(topic)
+        outbox.put_byte(0)
+        self._want_write()
+
+    def _read(self, now_ms):
+        try:
+            chunk = self.sock.recv(min(READ_CHUNK, self.inbox.room()))
+        except OSError as e:
+            if e.args[0] == errno.EAGAIN:
+                return False
+            raise
+        if not chunk:
+            raise OSError(errno.ECONNRESET)
+        self.inbox.put(chunk)
+        self.last_received_ms = now_ms
+        return True
+
+    def _write(self, now_ms):
+        outbox = self.outbox
+        size = min(len(outbox), WRITE_CHUNK)
+        try:
+            sent = self.sock.send(outbox.view[outbox.start : outbox.start + size])
+        except OSError as e:
+            if e.args[0] == errno.EAGAIN:
+                return False
+            raise
+        outbox.consume(sent)
+        self.last_sent_ms = now_ms
+        if not len(outbox):
+            self.poller.modify(self.sock, select.POLLIN)
+            self.wants_write = False
+        return sent > 0
+
+    def _next_packet(self):
+        """
+        Handle one complete packet from the inbox, `False` if there is none.
+        """
+        inbox = self.inbox
+        data = inbox.data
+        available = len(inbox)
+        if available < 2:
+            return False
+
+        remaining = 0
+        shift = 0
+        header = 1
+        while True:
+            if header >= available:
+                return False
+            byte = data[inbox.start + header]
+            remaining |= (byte & 0x7F) << shift
+            header += 1
+            if not byte & 0x80:
+                break
+            shift += 7
+            if header > 4:
+                raise OSError(errno.EINVAL)
+
+        if header + remaining > len(inbox.data):
+            raise OSError(errno.ENOBUFS)
+        if header + remaining > available:
+            return False
+
+        kind = data[inbox.start] & 0xF0
+        body = inbox.start + header
+        if kind == PUBLISH:
+            topic_length = data[body] << 8 | data[body + 1]
+            topic = bytes(inbox.view[body + 2 : body + 2 + topic_length])
+            payload = body + 2 + topic_length
+            # QoS 1 and 2 carry a packet ID, never subscribed for so skipped
+            if data[inbox.start] & 0x06:
+                payload += 2
+            msg = bytes(inbox.view[payload : body + remaining])
+            inbox.consume(header + remaining)
+            if self.cb:
+                self.cb(topic, msg)
+            return True
+
+        if kind == CONNACK:
+            code = data[body + 1]
+            if code:
+                raise OSError(errno.ECONNREFUSED)
+            self.state = CONNECTED
+            log(
+                f"Connected to an MQTT Server! Hello! I am MQTT Client {self.client_id}"
+            )
+        elif kind == PINGRESP:
+            self.ping_pending = False
+        inbox.consume(header + remaining)
+        return True
+
+    def _keep_alive(self, now_ms):
+        if self.state != CONNECTED:
+            if ticks_diff(now_ms, self.state_ms) > self.connect_timeout_ms:
+                raise OSError(errno.ETIMEDOUT)
+            return
+
+        keepalive_ms = self.keepalive_s * 1000
+        if ticks_diff(now_ms, self.last_received_ms) > keepalive_ms * 3 // 2:
+            raise OSError(errno.ETIMEDOUT)
+        if (
+            not self.ping_pending
+            and ticks_diff(now_ms, self.last_sent_ms) > keepalive_ms // 2
+            and self.outbox.room() >= 2
+        ):
+            self.outbox.put(bytes((PINGREQ, 0)))
+            self.ping_pending = True
+            self._want_write()
+
+    def poll(self, budget_ms):
+        """
+        Do whatever socket work there is, for at most about `budget_ms`.
+        Handling one read, write or packet is never interrupted, so a step
+        can run over by that much.
+        """
+        if not self.enabled:
+            return
+        start_us = ticks_us()
+        now_ms = ticks_ms()
+
+        if self.state == DISCONNECTED:
+            if ticks_diff(now_ms, self.state_ms) >= self.reconnect_ms:
+                self._open(now_ms)
+            return
+
+        budget_us = budget_ms * 1000
+        try:
+            while ticks_diff(ticks_us(), start_us) < budget_us:
+                progress = False
+                for _, event in self.poller.poll(0):
+                    if event & (select.POLLERR | select.POLLHUP):
+                        raise OSError(errno.ECONNRESET)
+
+                    if event & select.POLLOUT and self.state == CONNECTING:
+                        self.state = HANDSHAKE
+                        self._queue_connect()
+                    if event & select.POLLOUT and len(self.outbox):
+                        progress = self._write(now_ms) or progress
+                    if event & select.POLLIN and self.inbox.room():
+                        progress = self._read(now_ms) or progress
+
+                while ticks_diff(ticks_us(), start_us) < budget_us:
+                    if not self._next_packet():
+                        break
+                    progress = True
+
+                if not progress:
+                    break
+
+            self._keep_alive(now_ms)
+        except OSError as e:
+            self._fail(now_ms, f"connection lost ({e})")
@@ -0,0 +1,228 @@
+import struct
+from constants import (
+    HISTORY_ENTRY_DATA_SEPARATOR,
+    HISTORY_ENTRY_KEY_VALUE_SEPARATOR,
+    HISTORY_NUMERIC_FIELDS,
+    KUBIOS_STATUS_DONE,
+    KUBIOS_STATUS_NOT_APPLICABLE,
+    KUBIOS_STATUS_WAITING,
+)
+
+# Binary layout of a history entry, bump the version whenever it changes
+RECORD_VERSION = 1
+
+# Version, which optional parts follow, length of the whole record, ID
+RECORD_HEADER = "<BBHI"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+# Year since 2000, month, day, hour, minute, mean HR, mean PPI, RMSSD, SDNN
+RECORD_FIELDS = "<5B4f"
+RECORD_FIELDS_SIZE = struct.calcsize(RECORD_FIELDS)
+
+# Optional parts, stored in this order after the fields when present
+RECORD_HAS_SNS = 1
+RECORD_HAS_PNS = 2
+RECORD_HAS_KUBIOS_STATUS = 4
+RECORD_HAS_PPIS = 8
+
+RECORD_KNOWN_FIELDS = (
+    "ID",
+    "TIMESTAMP",
+    "MEAN HR",
+    "MEAN PPI",
+    "RMSSD",
+    "SDNN",
+    "SNS",
+    "PNS",
+    "KUBIOS STATUS",
+    "RAW PPIS",
+)
+
+# Stored as their position in here
+KUBIOS_STATUSES = (
+    KUBIOS_STATUS_DONE,
+    KUBIOS_STATUS_NOT_APPLICABLE,
+    KUBIOS_STATUS_WAITING,
+)
+
+# PPIs are stored as the difference to the previous one in a signed byte, a
+# difference that does not fit is this byte followed by the whole PPI
+PPI_DELTA_ESCAPE = 0x80
+
+
+def parse_timestamp(timestamp: str):
+    """
+    `"D/M/Y h:m"` to the numbers `(Y, M, D, h, m)`, the year without the
+    century.
+    """
+    date, time = timestamp.split()
+    D, M, Y = date.split("/")
+    h, m = time.split(":")[:2]
+    return int(Y) % 100, int(M), int(D), int(h), int(m)
+
+
+def format_timestamp(Y, M, D, h, m) -> str:
+    return f"{D}/{M}/{Y} {h:02}:{m:02}"
+
+
+def pack_ppis(ppis) -> bytearray:
+    out = bytearray(struct.pack("<H", len(ppis)))
+    previous = 0
+    for ppi in ppis:
+        delta = ppi - previous
+        if -128 < delta < 128:
+            out.append(delta & 0xFF)
+        else:
+            out.append(PPI_DELTA_ESCAPE)
+            out += struct.pack("<H", ppi)
+        previous = ppi
+    return out
+
+
+def unpack_ppis(record, offset):
+    """
+    The PPIs packed at `offset` in `record`, and the offset after them.
+    """
+    (count,) = struct.unpack_from("<H", record, offset)
+    offset += 2
+    ppis = []
+    previous = 0
+    for _ in range(count):
+        delta = record[offset]
+        offset += 1
+        if delta == PPI_DELTA_ESCAPE:
+            previous = record[offset] | record[offset + 1] << 8
+            offset += 2
+        else:
+            previous += delta - 256 if delta > 127 else delta
+        ppis.append(previous)
+    return ppis, offset
+
+
+def encode_entry(entry) -> bytes:
+    for field in entry:
+        if field not in RECORD_KNOWN_FIELDS:
+            raise ValueError(f"Field {field} can not be stored")
+
+    Y, M, D, h, m = parse_timestamp(entry["TIMESTAMP"])
+    fields = struct.pack(
+        RECORD_FIELDS,
+        Y,
+        M,
+        D,
+        h,
+        m,
+        entry["MEAN HR"],
+        entry["MEAN PPI"],
+        entry["RMSSD"],
+        entry["SDNN"],
+    )
+
+    flags = 0
+    optional = bytearray()
+    if "SNS" in entry:
+        flags |= RECORD_HAS_SNS
+        optional += struct.pack("<f", entry["SNS"])
+    if "PNS" in entry:
+        flags |= RECORD_HAS_PNS
+        optional += struct.pack("<f", entry["PNS"])
+    if "KUBIOS STATUS" in entry:
+        flags |= RECORD_HAS_KUBIOS_STATUS
+        optional.append(KUBIOS_STATUSES.index(entry["KUBIOS STATUS"]))
+    if "RAW PPIS" in entry:
+        flags |= RECORD_HAS_PPIS
+        optional += pack_ppis(entry["RAW PPIS"])
+
+    length = RECORD_HEADER_SIZE + RECORD_FIELDS_SIZE + len(optional)
+    if length > 0xFFFF:
+        raise ValueError("Entry is too long to be stored")
+
+    header = struct.pack(RECORD_HEADER, RECORD_VERSION, flags, length, entry["ID"])
+    return header + fields + optional
+
+
+def decode_entry(record) -> dict:
+    _, flags, _, entry_id = struct.unpack_from(RECORD_HEADER, record)
+    Y, M, D, h, m, mean_hr, mean_ppi, rmssd, sdnn = struct.unpack_from(
+        RECORD_FIELDS, record, RECORD_HEADER_SIZE
+    )
+    entry = {
+        "ID": entry_id,
+        "TIMESTAMP": format_timestamp(Y, M, D, h, m),
+        "MEAN HR": mean_hr,
+        "MEAN PPI": mean_ppi,
+        "RMSSD": rmssd,
+        "SDNN": sdnn,
+    }
+
+    offset = RECORD_HEADER_SIZE + RECORD_FIELDS_SIZE
+    if flags & RECORD_HAS_SNS:
+        (entry["SNS"],) = struct.unpack_from("<f", record, offset)
+        offset += 4
+    if flags & RECORD_HAS_PNS:
+        (entry["PNS"],) = struct.unpack_from("<f", record, offset)
+        offset += 4
+    if flags & RECORD_HAS_KUBIOS_STATUS:
+        entry["KUBIOS STATUS"] = KUBIOS_STATUSES[record[offset]]
+        offset += 1
+    if flags & RECORD_HAS_PPIS:
+        entry["RAW PPIS"], offset = unpack_ppis(record, offset)
+
+    return entry
+
+
+def record_id(record) -> int:
+    return struct.unpack_from(RECORD_HEADER, record)[3]
+
+
+def record_length(header) -> int:
+    return struct.unpack_from(RECORD_HEADER, header)[2]
+
+
+def read_record(f):
+    """
+    The next record in `f`, `None` at the end of the file. A record that is
+    cut short, or is not a record at all, comes back as `b""`.
+    """
+    header = f.read(RECORD_HEADER_SIZE)
+    if not header:
+        return None
+    if len(header) < RECORD_HEADER_SIZE:
+        return b""
+
+    version, _, length, _ = struct.unpack(RECORD_HEADER, header)
+    if version != RECORD_VERSION or length < RECORD_HEADER_SIZE + RECORD_FIELDS_SIZE:
+        return b""
+
+    body = f.read(length - RECORD_HEADER_SIZE)
+    if len(body) < length - RECORD_HEADER_SIZE:
+        return b""
+    return header + body
+
+
+def legacy_line_to_entry(line: bytes) -> dict:
+    """
+    An entry of the text format history files were stored in before,
+    `key\\0value` pairs separated by `\\0\\0`.
+    """
+    values = line.decode().strip().split(HISTORY_ENTRY_DATA_SEPARATOR)
+
+    entry = {
+        p[0]: p[1]
+        for p in map(
+            lambda s: s.split(HISTORY_ENTRY_KEY_VALUE_SEPARATOR),
+            values,
+        )
+    }
+
+    for k, v in entry.items():
+        if k == "ID":
+            entry[k] = int(v)
+            continue
+        if k in HISTORY_NUMERIC_FIELDS:
+            entry[k] = float(v)
+
+    if "RAW PPIS" in entry:
+        ppis = entry["RAW PPIS"].strip("[]")
+        entry["RAW PPIS"] = [int(ppi) for ppi in ppis.split(",")] if ppis else []
+
+    return entry
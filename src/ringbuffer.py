@@ -45,3 +45,223 @@ class Ringbuffer:
                 out += "> "
             out += str(v) + " "
         return out
+
+
+class _SlidingExtreme:
+    """
+    Monotonic queue of sequence numbers whose values in `data` only ever
+    decrease (for the maximum) or increase (for the minimum) from the front.
+    Storage is preallocated, pushing never allocates.
+    """
+
+    def __init__(self, data, size, is_max):
+        self.data = data
+        self.size = size
+        self.is_max = is_max
+        self.seqs = [0] * size
+        self.head = 0
+        self.length = 0
+
+    def reset(self, seq):
+        self.seqs[0] = seq
+        self.head = 0
+        self.length = 1
+
+    def push(self, seq):
+        size = self.size
+        seqs = self.seqs
+        data = self.data
+
+        # Drop everything that slid out of the window
+        oldest = seq - size
+        while self.length and seqs[self.head] <= oldest:
+            self.head = (self.head + 1) % size
+            self.length -= 1
+
+        # Drop everything the new value dominates
+        value = data[seq % size]
+        while self.length:
+            back = (self.head + self.length - 1) % size
+            back_value = data[seqs[back] % size]
+            if back_value < value if self.is_max else back_value > value:
+                self.length -= 1
+            else:
+                break
+
+        seqs[(self.head + self.length) % size] = seq
+        self.length += 1
+
+    def value(self):
+        return self.data[self.seqs[self.head] % self.size]
+
+
+class RunningStatsRingbuffer(Ringbuffer):
+    """
+    Ringbuffer that keeps the sum, minimum and maximum over all of its `size`
+    slots up to date on every `append`. Reading them is O(1) instead of a pass
+    over the whole buffer.
+    """
+
+    def __init__(self, size, typecode):
+        super().__init__(size, typecode)
+        self._min = _SlidingExtreme(self.data, size, False)
+        self._max = _SlidingExtreme(self.data, size, True)
+        self._reset_stats()
+
+    def _reset_stats(self):
+        # The slots start out as zeros, pretend they were appended just now
+        self._seq = self.size
+        self.total = 0
+        self._min.reset(self.size - 1)
+        self._max.reset(self.size - 1)
+
+    def append(self, value):
+        slot = self.end
+        self.total -= self.data[slot]
+        super().append(value)
+        # Store first, `array` may round the value (i.e. float32)
+        self.total += self.data[slot]
+
+        seq = self._seq
+        self._seq = seq + 1
+        self._min.push(seq)
+        self._max.push(seq)
+
+        # Floating point sums drift, resync once per full turn of the buffer
+        if slot == self.size - 1:
+            self.total = sum(self.data)
+
+    def clear(self):
+        super().clear()
+        self._reset_stats()
+
+    def mean(self):
+        return self.total / self.size
+
+    def min(self):
+        return self._min.value()
+
+    def max(self):
+        return self._max.value()
+
+
+class SpscRingbuffer:
+    """
+    Preallocated queue of values with a single producer, i.e. an interrupt
+    calling `put`, and a single consumer, i.e. the main loop calling
+    `drain_into`.
+
+    The producer only ever writes `head` and `overruns` and the consumer only
+    `tail`, so neither side has to disable interrupts. The capacity is
+    rounded up to a power of two, the slot of an index is found with a mask.
+    Indices run up to twice the capacity before wrapping, which tells a full
+    buffer from an empty one and keeps them small enough to never allocate.
+    When the buffer is full new values are dropped and counted in `overruns`.
+    """
+
+    def __init__(self, capacity, typecode):
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.capacity = size
+        self.mask = size - 1
+        self.wrap = 2 * size - 1
+        self.data = array(typecode, [0] * size)
+        self.view = memoryview(self.data)
+        self.clear()
+
+    def clear(self):
+        """
+        Drop everything, only while the producer is stopped.
+        """
+        self.head = 0
+        self.tail = 0
+        self.overruns = 0
+
+    def __len__(self):
+        return (self.head - self.tail) & self.wrap
+
+    def put(self, value):
+        """
+        Store the next value, safe to call from a hard interrupt.
+        """
+        head = self.head
+        if (head - self.tail) & self.wrap == self.capacity:
+            self.overruns += 1
+            return
+        self.data[head & self.mask] = value
+        # Only published once the value is in place
+        self.head = (head + 1) & self.wrap
+
+    def put_all(self, values):
+        """
+        Store all of `values` or, when they do not fit, none of them, so a
+        consumer that drains groups of `len(values)` never sees half of one.
+        A dropped group counts as one overrun.
+        """
+        head = self.head
+        count = len(values)
+        if self.capacity - ((head - self.tail) & self.wrap) < count:
+            self.overruns += 1
+            return
+        data = self.data
+        mask = self.mask
+        for i in range(count):
+            data[(head + i) & mask] = values[i]
+        self.head = (head + count) & self.wrap
+
+    def _copy(self, view, out, tail, count):
+        start = tail & self.mask
+        first = min(count, self.capacity - start)
+        out[:first] = view[start : start + first]
+        if count > first:
+            out[first:count] = view[: count - first]
+
+    def drain_into(self, out):
+        """
+        Move the oldest values into the `memoryview` `out`, as many as are
+        waiting and fit. Returns how many were moved.
+        """
+        tail = self.tail
+        count = min(len(out), (self.head - tail) & self.wrap)
+        self._copy(self.view, out, tail, count)
+        self.tail = (tail + count) & self.wrap
+        return count
+
+
+class StampedSpscRingbuffer(SpscRingbuffer):
+    """
+    `SpscRingbuffer` that also keeps a stamp (i.e. the acquisition tick) for
+    every value, in a parallel array so the values stay compact.
+    """
+
+    def __init__(self, capacity, typecode, stamp_typecode="L"):
+        super().__init__(capacity, typecode)
+        self.stamps = array(stamp_typecode, [0] * self.capacity)
+        self.stamps_view = memoryview(self.stamps)
+
+    def put(self, value, stamp):
+        """
+        Store the next value and its stamp, safe to call from a hard
+        interrupt.
+        """
+        head = self.head
+        if (head - self.tail) & self.wrap == self.capacity:
+            self.overruns += 1
+            return
+        i = head & self.mask
+        self.data[i] = value
+        self.stamps[i] = stamp
+        self.head = (head + 1) & self.wrap
+
+    def drain_into(self, out, stamps_out):
+        """
+        Like `SpscRingbuffer.drain_into`, with the stamps going into
+        `stamps_out`.
+        """
+        tail = self.tail
+        count = min(len(out), len(stamps_out), (self.head - tail) & self.wrap)
+        self._copy(self.view, out, tail, count)
+        self._copy(self.stamps_view, stamps_out, tail, count)
+        self.tail = (tail + count) & self.wrap
+        return count
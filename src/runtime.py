@@ -0,0 +1,79 @@
+"""
+Cooperative runtime on asyncio, an alternative to calling `execute` in a
+loop. Enabled with `USE_ASYNC_RUNTIME`.
+"""
+
+import asyncio
+from time import ticks_ms, ticks_add, ticks_diff
+from constants import (
+    RUNTIME_SAMPLES_PERIOD_MS,
+    RUNTIME_NETWORK_PERIOD_MS,
+    RUNTIME_UI_PERIOD_MS,
+    RUNTIME_FLUSH_PERIOD_MS,
+    WIFI_POLL_INTERVAL_MS,
+)
+
+
+class Job:
+    def __init__(self, name, priority, period_ms, step):
+        self.name = name
+        # Lower goes first
+        self.priority = priority
+        self.period_ms = period_ms
+        self.step = step
+        self.due_ms = ticks_ms()
+        self.runs = 0
+
+
+class Runtime:
+    """
+    Runs the parts of `HAL.execute` as separate asyncio tasks, each at its
+    own rate, and sleeps in between instead of spinning. The states are
+    still run through `HAL.state` and `run_state` like before, only less
+    often than the samples are processed.
+
+    A job that is due while a job with a lower `priority` is also due lets
+    that one run first.
+    """
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.jobs = [
+            Job("samples", 0, RUNTIME_SAMPLES_PERIOD_MS, machine.process_samples),
+            Job("network", 1, RUNTIME_NETWORK_PERIOD_MS, machine.poll_network),
+            Job("ui", 2, RUNTIME_UI_PERIOD_MS, machine.run_state),
+            Job("wifi", 3, WIFI_POLL_INTERVAL_MS, machine.poll_wifi),
+            Job("flush", 4, RUNTIME_FLUSH_PERIOD_MS, machine.flush_if_needed),
+        ]
+
+    def _is_overtaken(self, job, now_ms):
+        for other in self.jobs:
+            if other.priority < job.priority and ticks_diff(now_ms, other.due_ms) >= 0:
+                return True
+        return False
+
+    async def _run_job(self, job):
+        while True:
+            now_ms = ticks_ms()
+            wait_ms = ticks_diff(job.due_ms, now_ms)
+            if wait_ms > 0:
+                await asyncio.sleep(wait_ms / 1000)
+                continue
+            if self._is_overtaken(job, now_ms):
+                await asyncio.sleep(0)
+                continue
+
+            job.due_ms = ticks_add(job.due_ms, job.period_ms)
+            # Skip the runs that were missed instead of catching up on them
+            if ticks_diff(job.due_ms, now_ms) < 0:
+                job.due_ms = ticks_add(now_ms, job.period_ms)
+            job.step()
+            job.runs += 1
+            await asyncio.sleep(0)
+
+    async def main(self):
+        await asyncio.gather(*(self._run_job(job) for job in self.jobs))
+
+
+def run(machine):
+    asyncio.run(Runtime(machine).main())
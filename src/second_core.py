@@ -0,0 +1,133 @@
+"""
+Sensor sampling and peak detection on the second core of the RP2040, so
+display, network and flash stalls on the first one never hold them up.
+Enabled with `HEART_SECOND_CORE`.
+"""
+
+import _thread
+import time
+from array import array
+from constants import SECOND_CORE_COLUMNS, SECOND_CORE_IDLE_MS, SECOND_CORE_PEAKS
+from ringbuffer import SpscRingbuffer
+
+# Values per graph column in `SecondCore.columns`: low, high and whether the
+# column has a peak
+COLUMN_FIELDS = 3
+
+
+class SecondCore:
+    """
+    Runs the sample timer and `Machine._process_heart_rate_block` on a
+    `_thread`, which MicroPython puts on the second core.
+
+    The results go back through two `SpscRingbuffer`s, each with a single
+    producer on this core and a single consumer on the UI core, so neither
+    side ever takes a lock. `peaks` holds the tick of every peak and
+    `columns` the graph columns, `COLUMN_FIELDS` values each and only ever
+    published whole.
+
+    Whatever the thread raises is kept and raised again on the UI core by
+    `check`, there is nobody to see it on this one.
+    """
+
+    def __init__(self, machine):
+        self.machine = machine
+        self.peaks = SpscRingbuffer(SECOND_CORE_PEAKS, "L")
+        self.columns = None
+        self._column = None
+        # Set by the UI core to ask the thread to stop
+        self.running = False
+        # Set by the thread once it has started the timer, cleared once it
+        # has stopped it
+        self.sampling = False
+        # Cleared by the thread once it is gone
+        self.alive = False
+        self.error = None
+        # Blocks of samples processed and the tick of the newest sample,
+        # both written after everything up to it was published
+        self.blocks = 0
+        self.last_stamp_ms = 0
+        # Found nothing to process the last time it looked, which tells the
+        # simulator it has caught up
+        self.waiting = False
+        # Called whenever there is nothing to do, the simulator swaps it out
+        # for a sleep that does not move its virtual clock
+        self.wait = self._sleep
+
+    @staticmethod
+    def _sleep():
+        time.sleep_ms(SECOND_CORE_IDLE_MS)
+
+    def configure(self, typecode):
+        """
+        Size the queues for a detector that keeps its values as `typecode`,
+        only while stopped.
+        """
+        self.columns = SpscRingbuffer(SECOND_CORE_COLUMNS * COLUMN_FIELDS, typecode)
+        self._column = array(typecode, [0] * COLUMN_FIELDS)
+
+    def start(self):
+        """
+        Start the thread and wait until it samples, so sampling starts when
+        asked as it would on this core.
+        """
+        if self.alive:
+            return
+        self.peaks.clear()
+        self.columns.clear()
+        self.error = None
+        self.blocks = 0
+        self.running = True
+        self.alive = True
+        _thread.start_new_thread(self._run, ())
+        while self.alive and not self.sampling:
+            self.wait()
+
+    def stop(self):
+        """
+        Stop the thread and wait until it is gone, the timer with it.
+        """
+        self.running = False
+        while self.alive:
+            self.wait()
+
+    def check(self):
+        error = self.error
+        if error is not None:
+            self.error = None
+            raise error
+
+    def put_peak(self, peak_ms):
+        self.peaks.put(peak_ms)
+
+    def put_column(self, low, high, peak):
+        column = self._column
+        column[0] = low
+        column[1] = high
+        column[2] = 1 if peak else 0
+        self.columns.put_all(column)
+
+    def _run(self):
+        machine = self.machine
+        samples = machine.heart_rate_samples
+        block = machine.heart_rate_block
+        stamps = machine.heart_rate_block_stamps
+        try:
+            machine.set_sample_timer(True)
+            self.sampling = True
+            while self.running:
+                self.waiting = False
+                count = samples.drain_into(block, stamps)
+                if not count:
+                    self.waiting = True
+                    self.wait()
+                    continue
+                machine._process_heart_rate_block(block[:count], stamps[:count])
+                self.last_stamp_ms = stamps[count - 1]
+                self.blocks += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            machine.set_sample_timer(False)
+            self.sampling = False
+            self.alive = False
@@ -32,18 +32,14 @@ class Ui:
             return
 
         rotary_motion = self.hal.pull_rotary()
-
-        if not rotary_motion and not self.hal.is_first_frame:
-            return
-
-        self.is_first_frame = False
-
         self.selected_option = (
             len(self.options) + self.selected_option + rotary_motion
         ) % len(self.options)
 
-        self.display.fill(0)
+        # Nothing is drawn while the same option stays selected
+        self.hal.screens.show((self, self.selected_option), self._draw)
 
+    def _draw(self):
         max_chars_in_option = max(map(lambda o: len(o[0]), self.options))
         option_label_width = (max_chars_in_option + 1) * CHAR_SIZE_WIDTH_PX
 
@@ -69,4 +65,4 @@ class Ui:
                 color,
             )
 
-        self.hal.request_redraw()
+        self.hal.draw_cat()